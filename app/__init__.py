@@ -2,7 +2,11 @@ from flask import Flask
 from flask_login import LoginManager
 import os
 
+from .logging_utils import configure_logging
+
 def create_app():
+    configure_logging()
+    
     app = Flask(__name__)
     app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', os.urandom(24).hex())
     
@@ -17,6 +21,13 @@ def create_app():
     from .auth import bp as auth_bp
     app.register_blueprint(auth_bp)
     
+    from .metrics import init_app as init_metrics
+    init_metrics(app)
+    
+    from .profiling import PROFILING, init_app as init_profiling
+    if PROFILING:
+        init_profiling(app)
+    
     @login_manager.user_loader
     def load_user(user_id):
         from .auth import User
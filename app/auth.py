@@ -3,8 +3,10 @@ from flask_login import LoginManager, UserMixin, login_user, logout_user, login_
 from werkzeug.security import generate_password_hash, check_password_hash
 import os
 import json
+import logging
 
 bp = Blueprint('auth', __name__)
+logger = logging.getLogger(__name__)
 
 # Path to store user data
 USERS_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'users.json')
@@ -81,9 +83,11 @@ def login():
         if User.verify_password(username, password):
             user = User.get(username)
             login_user(user)
+            logger.info("User %s logged in from %s", username, request.remote_addr)
             next_page = request.args.get('next')
             return redirect(next_page or url_for('main.index'))
         else:
+            logger.warning("Failed login for %s from %s", username, request.remote_addr)
             flash('Invalid username or password', 'error')
     
     return render_template('login.html')
@@ -111,6 +115,7 @@ def register():
             return render_template('register.html')
         
         if User.add_user(username, password, is_admin):
+            logger.info("User %s created by %s", username, current_user.username)
             flash(f'User {username} created successfully', 'success')
             return redirect(url_for('auth.register'))
         else:
@@ -160,6 +165,7 @@ def delete_user(username):
     
     del users[username]
     User.save_users(users)
+    logger.info("User %s deleted by %s", username, current_user.username)
     
     flash(f'User {username} has been deleted', 'success')
     return redirect(url_for('auth.register')) 
\ No newline at end of file
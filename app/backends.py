@@ -0,0 +1,533 @@
+"""Backends: the Samba installation that Samba Manager manages.
+
+Everything samba_utils needs from the outside world goes through one
+Backend object:
+
+- configuration storage  read_file, write_file, testparm
+- user database          list_users, add_user, remove_user, set_user_enabled,
+                         set_password
+- service control        samba_installed, service_status, reload_config,
+                         restart_services
+- sessions               list_sessions, terminate_session, terminate_machine
+- filesystem             disk_usage, validate_path, create_directory
+
+SystemBackend is the real installation (Samba tools, sudo or the privileged
+helper, /etc/samba). SimulatedBackend is a deterministic stand-in that
+models thousands of shares, users and sessions with realistic latencies, so
+the routes and caches can be load-tested without Samba or root. Select it
+with SAMBA_MANAGER_BACKEND=simulated; it is sized with SAMBA_MANAGER_SIM_SHARES,
+SAMBA_MANAGER_SIM_USERS and SAMBA_MANAGER_SIM_SESSIONS, keeps its
+configuration files in SAMBA_MANAGER_SIM_DIR, and SAMBA_MANAGER_SIM_LATENCY
+scales its latencies (0 disables them).
+"""
+
+import logging
+import os
+import random
+import re
+import subprocess
+import tempfile
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from .privileged_helper import atomic_write_file
+
+logger = logging.getLogger(__name__)
+
+BACKEND_NAME = os.environ.get('SAMBA_MANAGER_BACKEND', 'system')
+SIMULATED_DIR = (os.environ.get('SAMBA_MANAGER_SIM_DIR')
+                 or os.path.join(tempfile.gettempdir(), 'samba-manager-sim'))
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+class Backend(ABC):
+    """Interface of a managed Samba installation"""
+
+    name = None
+
+    # Configuration storage
+
+    @abstractmethod
+    def read_file(self, path):
+        """Return the bytes of a configuration file"""
+
+    @abstractmethod
+    def write_file(self, path, content, mode='644', backup=False):
+        """Atomically replace a file with content (bytes), keeping the old
+        file as path.bak when backup is set"""
+
+    @abstractmethod
+    def testparm(self, path=None, verbose=False):
+        """Validate a configuration file (Samba's default one when path is
+        None) like `testparm -s [-v]`; returns a CompletedProcess"""
+
+    # User database
+
+    @abstractmethod
+    def list_users(self):
+        """Return the Samba users as dicts with username, enabled and flags"""
+
+    @abstractmethod
+    def add_user(self, username, password, create_system_user=False):
+        """Add a Samba user, creating the system user first when asked"""
+
+    @abstractmethod
+    def remove_user(self, username, delete_system_user=False):
+        """Remove a Samba user and optionally its system user"""
+
+    @abstractmethod
+    def set_user_enabled(self, username, enabled):
+        """Enable or disable a Samba user"""
+
+    @abstractmethod
+    def set_password(self, username, password):
+        """Set the Samba password of a user"""
+
+    # Service control
+
+    @abstractmethod
+    def samba_installed(self):
+        """Return whether the Samba tools are available"""
+
+    @abstractmethod
+    def service_status(self):
+        """Return a dict per unit in samba_utils.SERVICE_UNITS with state,
+        sub_state, main_pid, uptime, memory and tasks"""
+
+    @abstractmethod
+    def reload_config(self):
+        """Make the running daemons read the configuration again; returns
+        False when that is not possible without a restart"""
+
+    @abstractmethod
+    def restart_services(self):
+        """Restart the Samba daemons"""
+
+    # Sessions
+
+    @abstractmethod
+    def list_sessions(self):
+        """Return a dict with the Samba version, the session processes and
+        the share connections, as get_active_connections() does"""
+
+    @abstractmethod
+    def terminate_session(self, pid):
+        """End the session served by smbd process pid (a numeric string);
+        returns (success, message)"""
+
+    @abstractmethod
+    def terminate_machine(self, machine):
+        """End every session of a client machine name or address; returns
+        (success, message)"""
+
+    # Filesystem stats
+
+    @abstractmethod
+    def disk_usage(self, path):
+        """Return df -h style usage of the filesystem holding path, or None.
+        Exact sizes are added as size_bytes, used_bytes and available_bytes
+        where the backend knows them."""
+
+    def disk_usage_many(self, paths):
+        """Return {path: disk_usage(path)} for the paths whose usage is known"""
+        usage = {}
+        for path in paths:
+            info = self.disk_usage(path)
+            if info:
+                usage[path] = info
+        return usage
+
+    @abstractmethod
+    def validate_path(self, path):
+        """Make sure a share path exists and is accessible, creating it when
+        missing; returns (valid, message)"""
+
+    @abstractmethod
+    def create_directory(self, name, path):
+        """Create the directory of share name with the share permissions;
+        returns whether it exists afterwards"""
+
+
+class SystemBackend(Backend):
+    """The real Samba installation, driven through samba_utils"""
+
+    name = 'system'
+
+    def __init__(self):
+        from . import samba_utils
+        self.utils = samba_utils
+
+    def read_file(self, path):
+        return self.utils._system_read_file(path)
+
+    def write_file(self, path, content, mode='644', backup=False):
+        self.utils._system_write_file(path, content, mode=mode, backup=backup)
+
+    def testparm(self, path=None, verbose=False):
+        return self.utils._system_testparm(path, verbose)
+
+    def list_users(self):
+        return self.utils._system_samba_users()
+
+    def add_user(self, username, password, create_system_user=False):
+        return self.utils._system_add_samba_user(username, password, create_system_user)
+
+    def remove_user(self, username, delete_system_user=False):
+        return self.utils._system_remove_samba_user(username, delete_system_user)
+
+    def set_user_enabled(self, username, enabled):
+        if enabled:
+            return self.utils._system_enable_samba_user(username)
+        return self.utils._system_disable_samba_user(username)
+
+    def set_password(self, username, password):
+        return self.utils._system_reset_samba_password(username, password)
+
+    def samba_installed(self):
+        return self.utils._system_samba_installed()
+
+    def service_status(self):
+        return self.utils._system_service_status()
+
+    def reload_config(self):
+        return self.utils._system_reload_config()
+
+    def restart_services(self):
+        return self.utils._system_restart_services()
+
+    def list_sessions(self):
+        return self.utils._system_active_connections()
+
+    def disk_usage(self, path):
+        return self.utils._system_disk_usage(path)
+
+    def disk_usage_many(self, paths):
+        return self.utils._system_disk_usage_many(paths)
+
+    def validate_path(self, path):
+        return self.utils._system_validate_share_path(path)
+
+    def create_directory(self, name, path):
+        return self.utils._system_create_share_directory(name, path)
+
+    def terminate_session(self, pid):
+        return self.utils._system_terminate_connection(pid)
+
+    def terminate_machine(self, machine):
+        return self.utils._system_terminate_connection_by_machine(machine)
+
+
+# Simulated latencies in seconds: a fixed cost and a cost per item (share,
+# user or session), roughly what the real tools take on a busy server
+SIMULATED_LATENCY = {
+    'read_file': (0.0002, 0),
+    'write_file': (0.002, 0),
+    'testparm': (0.1, 0.00002),
+    'list_users': (0.02, 0.00005),
+    'change_user': (0.05, 0),
+    'service_status': (0.01, 0),
+    'reload_config': (0.05, 0.00001),
+    'restart_services': (1.0, 0),
+    'list_sessions': (0.03, 0.00002),
+    'terminate_session': (0.02, 0),
+    'disk_usage': (0.003, 0),
+    'create_directory': (0.005, 0),
+}
+
+INCLUDE_RE = re.compile(r'^\s*include\s*=\s*(.+?)\s*$', re.MULTILINE)
+
+SIMULATED_GROUPS = ('staff', 'users', 'finance', 'engineering', 'sales', 'smbusers')
+SIMULATED_PROTOCOLS = ('SMB3_11', 'SMB3_02', 'SMB2_10')
+
+
+class SimulatedBackend(Backend):
+    """Deterministic in-memory Samba installation.
+
+    The same seed and sizes always produce the same shares, users, sessions
+    and disk usage. Configuration files are real files in `directory`
+    (created on first use, then left alone), so the parsers and caches see
+    the same I/O as in production; files outside it cannot be read or
+    written. Share directories only exist in memory: the seeded share paths
+    and any absolute path a share is created with. Every operation sleeps
+    for its SIMULATED_LATENCY times `latency`."""
+
+    name = 'simulated'
+
+    def __init__(self, directory=SIMULATED_DIR, shares=1000, users=5000, sessions=500, latency=1.0, seed=1):
+        self.directory = os.path.abspath(directory)
+        self.shares = shares
+        self.latency = latency
+        self.seed = seed
+        self.started = time.time()
+        self.reloads = 0
+        self.restarts = 0
+        self._lock = threading.Lock()
+        self._directories = {f'/srv/samba/share{i:05d}' for i in range(shares)}
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.smb_conf = os.path.join(self.directory, 'smb.conf')
+        self.share_conf = os.path.join(self.directory, 'shares.conf')
+        if not os.path.exists(self.smb_conf):
+            self._write_initial_config()
+
+        rng = random.Random(seed)
+        self._users = OrderedDict()
+        for i in range(users):
+            name = f'user{i:05d}'
+            enabled = rng.random() >= 0.05
+            self._users[name] = {'username': name, 'enabled': enabled,
+                                 'flags': '[U          ]' if enabled else '[DU         ]'}
+
+        self._processes = []
+        self._connections = []
+        for i in range(sessions):
+            pid = 20000 + i
+            address = f'10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}'
+            self._processes.append({
+                'pid': str(pid),
+                'username': f'user{rng.randrange(max(users, 1)):05d}',
+                'group': rng.choice(SIMULATED_GROUPS),
+                'machine': f'{address} (ipv4:{address}:{rng.randrange(1024, 65535)})',
+                'machine_ip': address,
+                'protocol': rng.choice(SIMULATED_PROTOCOLS),
+                'version': '-',
+                'encryption': '-',
+                'signing': 'partial(AES-128-CMAC)'
+            })
+            self._connections.append({
+                'service': f'share{rng.randrange(max(shares, 1)):05d}',
+                'pid': str(pid),
+                'machine': address,
+                'machine_ip': address,
+                'connected_at': f'Mon Jan  8 09:{rng.randrange(60):02d}:{rng.randrange(60):02d} AM 2024 UTC'
+            })
+
+    def _delay(self, operation, items=0):
+        base, per_item = SIMULATED_LATENCY[operation]
+        if self.latency > 0:
+            time.sleep((base + per_item * items) * self.latency)
+
+    def _write_initial_config(self):
+        rng = random.Random(self.seed)
+        with open(self.smb_conf, 'w') as f:
+            f.write("[global]\n"
+                    "    workgroup = WORKGROUP\n"
+                    "    server string = Simulated Samba Server\n"
+                    "    security = user\n"
+                    "    map to guest = Bad User\n"
+                    "    log file = /var/log/samba/log.%m\n"
+                    "    max log size = 1000\n"
+                    "    server role = standalone\n"
+                    f"    include = {self.share_conf}\n")
+        parts = ["# Samba shares configuration\n\n"]
+        for i in range(self.shares):
+            group = rng.choice(SIMULATED_GROUPS)
+            parts.append(f"[share{i:05d}]\n"
+                         f"    path = /srv/samba/share{i:05d}\n"
+                         f"    comment = Simulated share {i}\n"
+                         f"    browseable = yes\n"
+                         f"    read only = {rng.choice(('yes', 'no'))}\n"
+                         f"    guest ok = no\n"
+                         f"    valid users = @{group}\n"
+                         f"    force group = {group}\n\n")
+        with open(self.share_conf, 'w') as f:
+            f.write(''.join(parts))
+
+    def _own(self, path):
+        real = os.path.realpath(path)
+        if os.path.commonpath([real, self.directory]) != self.directory:
+            raise PermissionError(f"The simulated backend does not manage {path}")
+        return real
+
+    def read_file(self, path):
+        self._delay('read_file')
+        with open(self._own(path), 'rb') as f:
+            return f.read()
+
+    def write_file(self, path, content, mode='644', backup=False):
+        self._delay('write_file')
+        atomic_write_file(self._own(path), content, mode=mode, backup=backup)
+
+    def testparm(self, path=None, verbose=False):
+        self._delay('testparm', self.shares)
+        args = ['testparm', '-s'] + (['-v'] if verbose else []) + ([path] if path else [])
+        try:
+            content = self.read_file(path or self.smb_conf).decode('utf-8', 'replace')
+            # testparm prints the configuration with its includes expanded
+            for include in INCLUDE_RE.findall(content):
+                if os.path.exists(include):
+                    content += '\n' + self.read_file(include).decode('utf-8', 'replace')
+            content = INCLUDE_RE.sub('', content)
+        except OSError as e:
+            return subprocess.CompletedProcess(args, 1, '', f"Can't load {path or self.smb_conf} - {e}\n")
+        return subprocess.CompletedProcess(args, 0, content, 'Loaded services file OK.\n')
+
+    def list_users(self):
+        with self._lock:
+            users = [dict(user) for user in self._users.values()]
+        self._delay('list_users', len(users))
+        return users
+
+    def add_user(self, username, password, create_system_user=False):
+        self._delay('change_user')
+        with self._lock:
+            if username in self._users:
+                return False
+            self._users[username] = {'username': username, 'enabled': True, 'flags': '[U          ]'}
+        return True
+
+    def remove_user(self, username, delete_system_user=False):
+        self._delay('change_user')
+        with self._lock:
+            return self._users.pop(username, None) is not None
+
+    def set_user_enabled(self, username, enabled):
+        self._delay('change_user')
+        with self._lock:
+            user = self._users.get(username)
+            if user is None:
+                return False
+            user['enabled'] = enabled
+            user['flags'] = '[U          ]' if enabled else '[DU         ]'
+        return True
+
+    def set_password(self, username, password):
+        self._delay('change_user')
+        with self._lock:
+            return username in self._users
+
+    def samba_installed(self):
+        return True
+
+    def service_status(self):
+        self._delay('service_status')
+        uptime = int(time.time() - self.started)
+        sessions = len(self._processes)
+        return {
+            'smbd': {'state': 'active', 'sub_state': 'running', 'main_pid': 1100, 'uptime': uptime,
+                     'memory': (20 + sessions // 50) * 1024 * 1024, 'tasks': 1 + sessions},
+            'nmbd': {'state': 'active', 'sub_state': 'running', 'main_pid': 1090, 'uptime': uptime,
+                     'memory': 6 * 1024 * 1024, 'tasks': 1},
+            'winbind': {'state': 'inactive', 'sub_state': 'not-found', 'main_pid': None, 'uptime': None,
+                        'memory': None, 'tasks': None},
+            'samba-ad-dc': {'state': 'inactive', 'sub_state': 'dead', 'main_pid': None, 'uptime': None,
+                            'memory': None, 'tasks': None},
+        }
+
+    def reload_config(self):
+        self._delay('reload_config', self.shares)
+        self.reloads += 1
+        return True
+
+    def restart_services(self):
+        self._delay('restart_services')
+        self.restarts += 1
+        self.started = time.time()
+        return True
+
+    def list_sessions(self):
+        self._delay('list_sessions', len(self._processes))
+        return {
+            'version': 'Samba version 4.17.12 (simulated)',
+            'processes': [dict(process) for process in self._processes],
+            'connections': [dict(connection) for connection in self._connections]
+        }
+
+    def terminate_session(self, pid):
+        self._delay('terminate_session')
+        with self._lock:
+            if not any(process['pid'] == pid for process in self._processes):
+                return False, f"Process {pid} is not a Samba connection or doesn't exist"
+            self._processes = [process for process in self._processes if process['pid'] != pid]
+            self._connections = [connection for connection in self._connections if connection['pid'] != pid]
+        return True, f"Connection {pid} terminated successfully"
+
+    def terminate_machine(self, machine):
+        self._delay('terminate_session')
+        with self._lock:
+            pids = {connection['pid'] for connection in self._connections
+                    if machine in (connection['machine'], connection['machine_ip'])}
+            pids.update(process['pid'] for process in self._processes if process['machine_ip'] == machine)
+            self._processes = [process for process in self._processes if process['pid'] not in pids]
+            self._connections = [connection for connection in self._connections if connection['pid'] not in pids]
+        return True, f"Connection from {machine} terminated successfully"
+
+    def validate_path(self, path):
+        self._delay('create_directory')
+        if not os.path.isabs(path):
+            return False, f"Path must be absolute: {path}"
+        path = os.path.normpath(path)
+        with self._lock:
+            if path in self._directories:
+                return True, "Path is valid and accessible"
+            self._directories.add(path)
+        return True, "Path created successfully"
+
+    def create_directory(self, name, path):
+        return self.validate_path(path)[0]
+
+    def disk_usage(self, path):
+        self._delay('disk_usage')
+        # Shares under the same top-level directory share a filesystem
+        mount = '/' + (path.strip('/').split('/')[0] if path.strip('/') else '')
+        rng = random.Random(zlib.crc32(mount.encode()) ^ self.seed)
+        size = rng.randrange(100, 8000) * 1024 ** 3
+        used = rng.randrange(size // 20, size)
+        return {
+            'filesystem': f'/dev/sim{zlib.crc32(mount.encode()) % 16}',
+            'size': human_size(size),
+            'used': human_size(used),
+            'available': human_size(size - used),
+            'use_percent': f'{used * 100 // size}%',
+            'mounted_on': mount,
+            'size_bytes': size,
+            'used_bytes': used,
+            'available_bytes': size - used
+        }
+
+
+def human_size(size):
+    """Format a size in bytes the way `df -h` does"""
+    for unit in ('', 'K', 'M', 'G', 'T', 'P'):
+        if size < 1024 or unit == 'P':
+            break
+        size /= 1024
+    if unit == '':
+        return str(int(size))
+    return f'{size:.1f}{unit}' if size < 10 else f'{size:.0f}{unit}'
+
+
+def create_backend(name=BACKEND_NAME):
+    if name == 'system':
+        return SystemBackend()
+    if name == 'simulated':
+        return SimulatedBackend(
+            shares=int(os.environ.get('SAMBA_MANAGER_SIM_SHARES', '1000')),
+            users=int(os.environ.get('SAMBA_MANAGER_SIM_USERS', '5000')),
+            sessions=int(os.environ.get('SAMBA_MANAGER_SIM_SESSIONS', '500')),
+            latency=float(os.environ.get('SAMBA_MANAGER_SIM_LATENCY', '1')),
+            seed=int(os.environ.get('SAMBA_MANAGER_SIM_SEED', '1')),
+        )
+    raise ValueError(f"Unknown backend {name!r}, expected 'system' or 'simulated'")
+
+
+def get_backend():
+    """Return the backend selected by SAMBA_MANAGER_BACKEND"""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = create_backend()
+            logger.info("Using the %s backend", _backend.name)
+        return _backend
+
+
+def set_backend(backend):
+    """Replace the backend, e.g. with a differently sized SimulatedBackend"""
+    global _backend
+    with _backend_lock:
+        _backend = backend
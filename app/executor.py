@@ -0,0 +1,408 @@
+"""Central execution of external commands.
+
+Every external command the application runs goes through execute() (or
+execute_async() from asyncio code), which adds what subprocess.run does not:
+
+- a default timeout per tool, so one hung smbstatus or pdbedit cannot pin a
+  request worker forever;
+- a bound on how many copies of the same tool run at once, so a slow
+  backend queues requests instead of exhausting every worker;
+- de-duplication of identical concurrent read-only commands: when two
+  requests ask for `smbstatus` at the same time, one process runs and both
+  get its result;
+- a record of every run (tool, duration, exit code, output size), kept as
+  per-tool histograms in COMMAND_STATS and passed to any hooks registered
+  with add_command_hook().
+
+The tool name is the command name after `sudo` and its options.
+"""
+
+import asyncio
+import logging
+import os
+import subprocess
+import threading
+import time
+import weakref
+
+logger = logging.getLogger(__name__)
+
+# Default timeout in seconds per tool, and for anything not listed
+TOOL_TIMEOUTS = {
+    'smbstatus': 15,
+    'smbcontrol': 15,
+    'testparm': 30,
+    'pdbedit': 30,
+    'smbpasswd': 30,
+    'systemctl': 60,
+    'service': 60,
+    'df': 10,
+    'du': 120,
+    'getent': 10,
+    'id': 5,
+    'ps': 5,
+    'tar': 300,
+    'apt-get': 900,
+    'dnf': 900,
+    'yum': 900,
+}
+DEFAULT_TIMEOUT = float(os.environ.get('SAMBA_MANAGER_COMMAND_TIMEOUT', '60'))
+
+# Maximum number of concurrent processes per tool, and for anything not listed
+TOOL_CONCURRENCY = {
+    'smbstatus': 2,
+    'testparm': 2,
+    'pdbedit': 2,
+    'du': 2,
+    'tar': 1,
+    'apt-get': 1,
+    'dnf': 1,
+    'yum': 1,
+}
+DEFAULT_CONCURRENCY = 8
+
+# Commands that only read state. Identical concurrent calls share one run.
+# A tool maps to None when every invocation is read-only, or to the
+# arguments that make an invocation read-only.
+READ_ONLY_COMMANDS = {
+    'smbstatus': None,
+    'testparm': None,
+    'df': None,
+    'du': None,
+    'getent': None,
+    'id': None,
+    'ps': None,
+    'cat': None,
+    'test': None,
+    'pdbedit': {'-L', '--list'},
+    'systemctl': {'is-active', 'is-enabled', 'show', 'status'},
+}
+
+# Upper bounds in seconds of the command duration histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_lock = threading.Lock()
+_semaphores = {}
+_inflight = {}
+_async_state = weakref.WeakKeyDictionary()
+
+
+def _command(args):
+    """Strip sudo and its options from an argument list"""
+    args = list(args)
+    if args and os.path.basename(args[0]) == 'sudo':
+        args = args[1:]
+        while args and args[0].startswith('-'):
+            args = args[1:]
+    return args
+
+
+def tool_name(args):
+    """Return the tool an argument list runs, looking past sudo and its options"""
+    args = _command(args)
+    return os.path.basename(args[0]) if args else ''
+
+
+def tool_timeout(args):
+    return TOOL_TIMEOUTS.get(tool_name(args), DEFAULT_TIMEOUT)
+
+
+def is_read_only(args):
+    """Whether a command only reads state, see READ_ONLY_COMMANDS"""
+    tool = tool_name(args)
+    if tool not in READ_ONLY_COMMANDS:
+        return False
+    allowed = READ_ONLY_COMMANDS[tool]
+    return allowed is None or any(arg in allowed for arg in _command(args)[1:])
+
+
+class CommandStats:
+    """Per-tool counts, exit codes and duration histograms of executed commands"""
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._tools = {}
+        self.since = time.time()
+
+    def record(self, record):
+        with self._lock:
+            stats = self._tools.get(record['tool'])
+            if stats is None:
+                stats = self._tools[record['tool']] = {
+                    'count': 0,
+                    'shared': 0,
+                    'errors': 0,
+                    'timeouts': 0,
+                    'total_seconds': 0.0,
+                    'max_seconds': 0.0,
+                    'stdout_bytes': 0,
+                    'exit_codes': {},
+                    'histogram': [0] * (len(self.buckets) + 1),
+                }
+            if record['shared']:
+                # Another caller's run answered this one; it is counted there
+                stats['shared'] += 1
+                return
+            duration = record['duration']
+            stats['count'] += 1
+            stats['total_seconds'] += duration
+            stats['max_seconds'] = max(stats['max_seconds'], duration)
+            stats['stdout_bytes'] += record['stdout_size']
+            if record['timed_out']:
+                stats['timeouts'] += 1
+            elif record['returncode'] is None:
+                stats['errors'] += 1
+            else:
+                code = str(record['returncode'])
+                stats['exit_codes'][code] = stats['exit_codes'].get(code, 0) + 1
+            index = next((i for i, bound in enumerate(self.buckets) if duration <= bound), len(self.buckets))
+            stats['histogram'][index] += 1
+
+    def snapshot(self):
+        """Return a list with the statistics of each tool, most total time
+        first. Buckets are cumulative, as in Prometheus: each counts the runs
+        that took at most `le` seconds."""
+        with self._lock:
+            tools = {tool: dict(stats, exit_codes=dict(stats['exit_codes']), histogram=list(stats['histogram']))
+                     for tool, stats in self._tools.items()}
+        result = []
+        for tool, stats in sorted(tools.items(), key=lambda item: -item[1]['total_seconds']):
+            histogram = stats.pop('histogram')
+            count = stats['count']
+            stats['mean_seconds'] = stats['total_seconds'] / count if count else 0.0
+            stats['p50_seconds'] = self._quantile(histogram, count, 0.5)
+            stats['p95_seconds'] = self._quantile(histogram, count, 0.95)
+            cumulative = 0
+            stats['buckets'] = []
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), histogram):
+                cumulative += bucket_count
+                stats['buckets'].append({'le': bound if bound != float('inf') else '+Inf', 'count': cumulative})
+            result.append(dict(tool=tool, **stats))
+        return result
+
+    def _quantile(self, histogram, count, q):
+        # Upper bound of the bucket holding the quantile
+        if not count:
+            return None
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, histogram):
+            cumulative += bucket_count
+            if cumulative >= q * count:
+                return bound
+        return None
+
+    def reset(self):
+        with self._lock:
+            self._tools.clear()
+            self.since = time.time()
+
+
+COMMAND_STATS = CommandStats()
+_hooks = []
+
+
+def add_command_hook(hook):
+    """Call hook(record) after every command; see _record() for the fields"""
+    _hooks.append(hook)
+
+
+def remove_command_hook(hook):
+    _hooks.remove(hook)
+
+
+def _record(args, started, result=None, error=None, shared=False):
+    record = {
+        'tool': tool_name(args),
+        'args': args,
+        'duration': time.perf_counter() - started,
+        'returncode': result.returncode if result is not None else None,
+        'timed_out': isinstance(error, subprocess.TimeoutExpired),
+        'stdout_size': len(result.stdout or '') if result is not None else 0,
+        'shared': shared,
+    }
+    COMMAND_STATS.record(record)
+    for hook in list(_hooks):
+        try:
+            hook(record)
+        except Exception:
+            logger.exception("Command hook %r failed", hook)
+
+
+def _semaphore(tool):
+    with _lock:
+        semaphore = _semaphores.get(tool)
+        if semaphore is None:
+            semaphore = threading.BoundedSemaphore(TOOL_CONCURRENCY.get(tool, DEFAULT_CONCURRENCY))
+            _semaphores[tool] = semaphore
+        return semaphore
+
+
+def _subprocess_runner(args, input, timeout, text, env):
+    return subprocess.run(list(args), input=input, capture_output=True, text=text,
+                          timeout=timeout, env=env, check=False)
+
+
+class _Call:
+    """A command run on behalf of every caller that asked for it meanwhile"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def execute(args, input=None, timeout=None, check=False, text=True, env=None, runner=None):
+    """Run a command and return a subprocess.CompletedProcess with captured output.
+
+    timeout defaults to the tool's entry in TOOL_TIMEOUTS and raises
+    subprocess.TimeoutExpired (after killing the process) when exceeded.
+    With check=True a non-zero exit raises subprocess.CalledProcessError.
+    runner, if given, is called as runner(args, input, timeout, text, env)
+    instead of starting the process directly (used to route privileged
+    commands through the helper) and gets the same limits.
+    """
+    args = list(args)
+    tool = tool_name(args)
+    if timeout is None:
+        timeout = TOOL_TIMEOUTS.get(tool, DEFAULT_TIMEOUT)
+    runner = runner or _subprocess_runner
+
+    key = None
+    if input is None and env is None and is_read_only(args):
+        key = (tuple(args), text, runner)
+
+    if key is not None:
+        with _lock:
+            call = _inflight.get(key)
+            if call is not None:
+                owner = False
+            else:
+                call = _inflight[key] = _Call()
+                owner = True
+        if not owner:
+            logger.debug("Sharing the result of a running %s", tool)
+            # The owner's run is itself bounded by the timeout
+            started = time.perf_counter()
+            call.done.wait()
+            _record(args, started, call.result, call.error, shared=True)
+            result = _result(call)
+            return _checked(result, check)
+
+    started = None
+    try:
+        with _semaphore(tool):
+            started = time.perf_counter()
+            result = runner(args, input, timeout, text, env)
+    except BaseException as e:
+        if key is not None:
+            _finish(key, error=e)
+        if isinstance(e, subprocess.TimeoutExpired):
+            logger.warning("%s timed out after %s seconds", tool, timeout)
+        if started is not None:
+            _record(args, started, error=e)
+        raise
+
+    _record(args, started, result)
+    if key is not None:
+        _finish(key, result=result)
+    return _checked(result, check)
+
+
+def _finish(key, result=None, error=None):
+    with _lock:
+        call = _inflight.pop(key)
+    call.result = result
+    call.error = error
+    call.done.set()
+
+
+def _result(call):
+    if call.error is not None:
+        raise call.error
+    return call.result
+
+
+def _checked(result, check):
+    if check and result.returncode != 0:
+        raise subprocess.CalledProcessError(result.returncode, result.args, result.stdout, result.stderr)
+    return result
+
+
+async def execute_async(args, input=None, timeout=None, check=False, text=True, env=None):
+    """asyncio variant of execute() with the same timeouts, per-tool limits
+    and sharing of identical read-only commands, without blocking the loop."""
+    args = list(args)
+    tool = tool_name(args)
+    if timeout is None:
+        timeout = TOOL_TIMEOUTS.get(tool, DEFAULT_TIMEOUT)
+
+    loop = asyncio.get_running_loop()
+    state = _async_state.get(loop)
+    if state is None:
+        state = _async_state[loop] = {'semaphores': {}, 'inflight': {}}
+
+    key = None
+    if input is None and env is None and is_read_only(args):
+        key = (tuple(args), text)
+        future = state['inflight'].get(key)
+        if future is not None:
+            started = time.perf_counter()
+            try:
+                result = await asyncio.shield(future)
+            except Exception as e:
+                _record(args, started, error=e, shared=True)
+                raise
+            _record(args, started, result, shared=True)
+            return _checked(result, check)
+        future = state['inflight'][key] = loop.create_future()
+
+    semaphore = state['semaphores'].get(tool)
+    if semaphore is None:
+        semaphore = state['semaphores'][tool] = asyncio.Semaphore(TOOL_CONCURRENCY.get(tool, DEFAULT_CONCURRENCY))
+
+    started = None
+    try:
+        async with semaphore:
+            started = time.perf_counter()
+            result = await _run_async(args, input, timeout, text, env)
+    except BaseException as e:
+        if started is not None:
+            _record(args, started, error=e)
+        if key is not None:
+            state['inflight'].pop(key, None)
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            elif not future.done():
+                future.set_exception(e)
+                # Mark retrieved, waiters (if any) get it through shield()
+                future.exception()
+        raise
+
+    _record(args, started, result)
+    if key is not None:
+        state['inflight'].pop(key, None)
+        future.set_result(result)
+    return _checked(result, check)
+
+
+async def _run_async(args, input, timeout, text, env):
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdin=asyncio.subprocess.PIPE if input is not None else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        env=env,
+    )
+    data = input.encode() if text and input is not None else input
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(data), timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        logger.warning("%s timed out after %s seconds", tool_name(args), timeout)
+        raise subprocess.TimeoutExpired(args, timeout)
+    if text:
+        stdout = stdout.decode(errors='replace')
+        stderr = stderr.decode(errors='replace')
+    return subprocess.CompletedProcess(args, process.returncode, stdout, stderr)
@@ -0,0 +1,120 @@
+"""Logging setup for Samba Manager.
+
+Modules log through named loggers (logging.getLogger(__name__)), which all
+propagate to the package logger 'app'. configure_logging() attaches a single
+queue-backed handler to it: request threads only enqueue records and a
+background listener does the actual writing. Per-item DEBUG messages are
+rate limited per message template, so enabling debug logging on a server
+with thousands of shares does not flood the journal.
+"""
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+
+PACKAGE_LOGGER = 'app'
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+_listener = None
+_handler = None
+_lock = threading.Lock()
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks: records are dropped when the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class RateLimitFilter(logging.Filter):
+    """Allow at most `rate` records per message template every `per` seconds.
+
+    Only records below `max_level` are limited, so warnings and errors always
+    get through. Records are keyed on the unformatted message, which is why
+    per-item messages use %-style arguments rather than f-strings. The first
+    record after a window closes reports how many were suppressed.
+    """
+
+    def __init__(self, rate=10, per=60.0, max_level=logging.INFO):
+        super().__init__()
+        self.rate = rate
+        self.per = per
+        self.max_level = max_level
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= self.max_level:
+            return True
+
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.per:
+                suppressed = window[2] if window else 0
+                self._windows[key] = [now, 1, 0]
+                if suppressed:
+                    record.msg = f'{record.msg} (suppressed {suppressed} similar messages)'
+                return True
+            if window[1] < self.rate:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+
+def configure_logging(level=None, stream=None):
+    """Attach the queue-backed handler to the package logger (idempotent).
+
+    The level defaults to SAMBA_MANAGER_LOG_LEVEL (INFO), and the number of
+    identical DEBUG messages allowed per minute to SAMBA_MANAGER_LOG_RATE.
+    """
+    global _listener, _handler
+
+    with _lock:
+        logger = logging.getLogger(PACKAGE_LOGGER)
+        if level is None:
+            level = os.environ.get('SAMBA_MANAGER_LOG_LEVEL', 'INFO')
+        logger.setLevel(level.upper() if isinstance(level, str) else level)
+
+        if _listener is not None:
+            return logger
+
+        output = logging.StreamHandler(stream)
+        output.setFormatter(logging.Formatter(LOG_FORMAT))
+
+        log_queue = queue.Queue(maxsize=10000)
+        _handler = DroppingQueueHandler(log_queue)
+        _handler.addFilter(RateLimitFilter(rate=int(os.environ.get('SAMBA_MANAGER_LOG_RATE', '10'))))
+        logger.addHandler(_handler)
+        logger.propagate = False
+
+        _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+        return logger
+
+
+def shutdown_logging():
+    """Flush queued records and stop the background listener"""
+    global _listener, _handler
+
+    with _lock:
+        if _listener is not None:
+            logging.getLogger(PACKAGE_LOGGER).removeHandler(_handler)
+            _listener.stop()
+            _listener = None
+            _handler = None
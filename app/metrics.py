@@ -0,0 +1,324 @@
+"""Prometheus metrics for Samba Manager.
+
+GET /metrics returns the text exposition format. Everything it reports is
+already in memory when the scrape arrives:
+
+- request latency per route, recorded by hooks installed with init_app();
+- configuration cache hits and misses, external command timings and reload
+  counts, kept by the modules that own them;
+- Samba state (sessions and connections per share, users, filesystem usage
+  and service status), collected by a background sampler every
+  SAMBA_MANAGER_METRICS_INTERVAL seconds (default 30).
+
+A scrape never runs smbstatus, pdbedit or df itself, so the scrape interval
+does not change how often they run. Filesystem usage of all shares is read
+with statvfs() in-process, without forking per share. The sampler starts
+with the first scrape, so processes that are never scraped (tests, the CLI)
+run no collectors; that scrape waits briefly for the first sample. Samba
+state that needs privileges the application does not have (see
+samba_utils.get_capabilities) is not collected.
+
+When SAMBA_MANAGER_METRICS_TOKEN is set, scrapes must send it as a bearer
+token; otherwise only requests from the local host are answered.
+"""
+
+import hmac
+import logging
+import os
+import threading
+import time
+
+from flask import Blueprint, Response, g, request
+
+from .executor import COMMAND_STATS
+from .samba_config import CONFIG_CACHE
+
+logger = logging.getLogger(__name__)
+
+bp = Blueprint('metrics', __name__)
+
+SAMPLE_INTERVAL = float(os.environ.get('SAMBA_MANAGER_METRICS_INTERVAL', '30'))
+# How long a scrape arriving right after startup waits for the first sample
+FIRST_SAMPLE_WAIT = 5
+METRICS_TOKEN = os.environ.get('SAMBA_MANAGER_METRICS_TOKEN', '')
+
+# Upper bounds in seconds of the request duration histogram buckets
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class RequestMetrics:
+    """Duration histograms of handled requests per endpoint, method and status"""
+
+    def __init__(self, buckets=REQUEST_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, endpoint, method, status, duration):
+        key = (endpoint, method, str(status))
+        index = next((i for i, bound in enumerate(self.buckets) if duration <= bound), len(self.buckets))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'histogram': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+            series['histogram'][index] += 1
+            series['sum'] += duration
+            series['count'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {key: dict(series, histogram=list(series['histogram']))
+                    for key, series in self._series.items()}
+
+
+REQUEST_METRICS = RequestMetrics()
+
+
+class StateSampler:
+    """Collect Samba state in a background thread every interval seconds.
+
+    The thread starts on the first call to start(); snapshot() returns the
+    most recent sample (empty until the first one completes)."""
+
+    def __init__(self, collect, interval):
+        self.collect = collect
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._thread = None
+        self._snapshot = {}
+        self._ready = threading.Event()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='metrics-sampler', daemon=True)
+            self._thread.start()
+
+    def snapshot(self):
+        with self._lock:
+            return self._snapshot
+
+    def wait(self, timeout):
+        """Wait up to timeout seconds for the first sample"""
+        return self._ready.wait(timeout)
+
+    def _run(self):
+        while True:
+            started = time.monotonic()
+            previous = self.snapshot()
+            try:
+                sample = self.collect()
+                sample['errors'] = previous.get('errors', 0)
+            except Exception as e:
+                # Keep serving the last good sample
+                logger.exception("Collecting metrics failed: %s", e)
+                sample = dict(previous, errors=previous.get('errors', 0) + 1)
+            sample['duration'] = time.monotonic() - started
+            sample['timestamp'] = time.time()
+            with self._lock:
+                self._snapshot = sample
+            self._ready.set()
+            time.sleep(max(1.0, self.interval - sample['duration']))
+
+
+def collect_samba_state():
+    """Gather the Samba state reported by /metrics from the usual collectors,
+    skipping those whose privileges are missing"""
+    from .backends import get_backend
+    from .samba_utils import (
+        get_active_connections, get_samba_users, get_service_status, get_share_usage_stats, has_capability
+    )
+
+    def allowed(capability):
+        # Only the system backend needs privileges
+        return get_backend().name != 'system' or has_capability(capability)
+
+    sample = {
+        'services': {name: status['state'].split()[0] == 'active' for name, status in get_service_status().items()},
+    }
+
+    if allowed('signal_smbd'):
+        connections = get_active_connections()
+        share_connections = {}
+        for connection in connections['connections']:
+            share_connections[connection['service']] = share_connections.get(connection['service'], 0) + 1
+        sample['sessions'] = len(connections['processes'])
+        sample['share_connections'] = share_connections
+
+        users = get_samba_users()
+        sample['users'] = len(users)
+        sample['disabled_users'] = sum(1 for user in users if not user.get('enabled', True))
+
+    if allowed('read_config'):
+        usage = {}
+        for stats in get_share_usage_stats():
+            info = stats['usage']
+            usage[stats['name']] = {field: info.get(f'{field}_bytes') for field in ('size', 'used', 'available')}
+        sample['usage'] = usage
+
+    return sample
+
+
+SAMPLER = StateSampler(collect_samba_state, SAMPLE_INTERVAL)
+
+
+def init_app(app):
+    """Time every request and serve /metrics"""
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _observe_request(response):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            REQUEST_METRICS.observe(request.endpoint or 'none', request.method, response.status_code,
+                                    time.perf_counter() - started)
+        return response
+
+    app.register_blueprint(bp)
+
+
+@bp.route('/metrics')
+def metrics():
+    if METRICS_TOKEN:
+        supplied = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(supplied.encode(), f'Bearer {METRICS_TOKEN}'.encode()):
+            return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    elif request.remote_addr not in ('127.0.0.1', '::1'):
+        return Response('Forbidden\n', status=403, mimetype='text/plain')
+
+    SAMPLER.start()
+    SAMPLER.wait(FIRST_SAMPLE_WAIT)
+    return Response(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class _Writer:
+    def __init__(self):
+        self.lines = []
+
+    def family(self, name, kind, help_text):
+        self.lines.append(f'# HELP {name} {help_text}')
+        self.lines.append(f'# TYPE {name} {kind}')
+
+    def sample(self, name, value, **labels):
+        if value is not None:
+            self.lines.append(f'{name}{_labels(**labels)} {_number(value)}')
+
+    def histogram(self, name, buckets, cumulative, total, count, **labels):
+        for bound, bucket_count in zip(tuple(buckets) + (float('inf'),), cumulative):
+            self.sample(f'{name}_bucket', bucket_count, **labels, le=_number(bound))
+        self.sample(f'{name}_sum', total, **labels)
+        self.sample(f'{name}_count', count, **labels)
+
+    def text(self):
+        return '\n'.join(self.lines) + '\n'
+
+
+def render_metrics():
+    """Render every metric in the Prometheus text exposition format"""
+    from .samba_utils import RELOAD_SCHEDULER
+
+    out = _Writer()
+
+    out.family('samba_manager_http_request_duration_seconds', 'histogram',
+               'Time spent handling requests, per endpoint.')
+    for (endpoint, method, status), series in sorted(REQUEST_METRICS.snapshot().items()):
+        cumulative, running = [], 0
+        for bucket_count in series['histogram']:
+            running += bucket_count
+            cumulative.append(running)
+        out.histogram('samba_manager_http_request_duration_seconds', REQUEST_METRICS.buckets, cumulative,
+                      series['sum'], series['count'], endpoint=endpoint, method=method, status=status)
+
+    out.family('samba_manager_config_cache_hits_total', 'counter',
+               'Configuration lookups answered from the cache.')
+    out.sample('samba_manager_config_cache_hits_total', CONFIG_CACHE.hits)
+    out.family('samba_manager_config_cache_misses_total', 'counter',
+               'Configuration lookups that had to read and parse files.')
+    out.sample('samba_manager_config_cache_misses_total', CONFIG_CACHE.misses)
+
+    commands = COMMAND_STATS.snapshot()
+    out.family('samba_manager_command_duration_seconds', 'histogram',
+               'Run time of external commands, per tool.')
+    for stats in commands:
+        out.histogram('samba_manager_command_duration_seconds', COMMAND_STATS.buckets,
+                      [bucket['count'] for bucket in stats['buckets']],
+                      stats['total_seconds'], stats['count'], tool=stats['tool'])
+    out.family('samba_manager_command_exits_total', 'counter',
+               'External commands that exited, per tool and exit code.')
+    for stats in commands:
+        for code, count in sorted(stats['exit_codes'].items()):
+            out.sample('samba_manager_command_exits_total', count, tool=stats['tool'], code=code)
+    out.family('samba_manager_command_timeouts_total', 'counter',
+               'External commands killed after their timeout.')
+    for stats in commands:
+        out.sample('samba_manager_command_timeouts_total', stats['timeouts'], tool=stats['tool'])
+    out.family('samba_manager_command_shared_total', 'counter',
+               'Calls answered by an identical command that was already running.')
+    for stats in commands:
+        out.sample('samba_manager_command_shared_total', stats['shared'], tool=stats['tool'])
+
+    out.family('samba_manager_reloads_total', 'counter',
+               'Samba configuration reloads run by the manager.')
+    out.sample('samba_manager_reloads_total', RELOAD_SCHEDULER.reloads)
+    out.family('samba_manager_reload_pending', 'gauge',
+               'Whether configuration changes are waiting for a reload.')
+    out.sample('samba_manager_reload_pending', int(RELOAD_SCHEDULER.pending()))
+
+    state = SAMPLER.snapshot()
+    out.family('samba_manager_sample_timestamp_seconds', 'gauge',
+               'When the Samba state below was collected.')
+    out.sample('samba_manager_sample_timestamp_seconds', state.get('timestamp'))
+    out.family('samba_manager_sample_duration_seconds', 'gauge',
+               'Time taken to collect the Samba state.')
+    out.sample('samba_manager_sample_duration_seconds', state.get('duration'))
+    out.family('samba_manager_sample_errors_total', 'counter',
+               'Failed attempts to collect the Samba state.')
+    out.sample('samba_manager_sample_errors_total', state.get('errors'))
+
+    if 'services' in state:
+        out.family('samba_service_up', 'gauge', 'Whether a Samba service is active.')
+        for name, up in sorted(state['services'].items()):
+            out.sample('samba_service_up', int(up), service=name)
+    if 'sessions' in state:
+        out.family('samba_sessions', 'gauge', 'Client sessions (smbd processes) listed by smbstatus.')
+        out.sample('samba_sessions', state['sessions'])
+        out.family('samba_share_connections', 'gauge', 'Connections to each share listed by smbstatus.')
+        for name, count in sorted(state['share_connections'].items()):
+            out.sample('samba_share_connections', count, share=name)
+    if 'users' in state:
+        out.family('samba_users', 'gauge', 'Samba user accounts.')
+        out.sample('samba_users', state['users'])
+        out.family('samba_users_disabled', 'gauge', 'Disabled Samba user accounts.')
+        out.sample('samba_users_disabled', state['disabled_users'])
+    if 'usage' in state:
+        for field, help_text in (('size', 'Size of the filesystem holding each share.'),
+                                 ('used', 'Space used on the filesystem holding each share.'),
+                                 ('available', 'Space available on the filesystem holding each share.')):
+            name = f'samba_share_filesystem_{field}_bytes'
+            out.family(name, 'gauge', help_text)
+            for share, usage in sorted(state['usage'].items()):
+                out.sample(name, usage[field], share=share)
+
+    return out.text()
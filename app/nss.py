@@ -0,0 +1,140 @@
+"""In-process snapshot of the system users and groups.
+
+Pages that list users and groups read them from one NssSnapshot built with
+pwd.getpwall() and grp.getgrall() instead of forking `getent` on every
+request. The snapshot is rebuilt when /etc/passwd, /etc/group or
+/etc/nsswitch.conf change. When nsswitch.conf lists sources other than
+local files (LDAP, SSSD, winbind...), whose changes no file shows, it is
+also rebuilt every SAMBA_MANAGER_NSS_REFRESH seconds (default 300).
+"""
+
+import grp
+import logging
+import os
+import pwd
+import threading
+import time
+
+from .samba_config import file_key
+
+logger = logging.getLogger(__name__)
+
+NSS_FILES = ('/etc/passwd', '/etc/group', '/etc/nsswitch.conf')
+NSSWITCH_CONF = '/etc/nsswitch.conf'
+NSS_REFRESH = float(os.environ.get('SAMBA_MANAGER_NSS_REFRESH', '300'))
+# Sources whose entries all live in the files above
+LOCAL_SOURCES = ('files', 'compat')
+
+
+class NssSnapshot:
+    """Users and groups at one point in time, indexed by name, uid, gid,
+    primary group and membership. Must not be modified."""
+
+    def __init__(self, users, groups):
+        self.users = users
+        self.groups = groups
+        self.users_by_name = {}
+        self.users_by_uid = {}
+        self.primary_users = {}
+        for user in users:
+            # Like getpwnam/getpwuid, the first entry wins
+            self.users_by_name.setdefault(user.pw_name, user)
+            self.users_by_uid.setdefault(user.pw_uid, user)
+            self.primary_users.setdefault(user.pw_gid, []).append(user.pw_name)
+        self.groups_by_name = {}
+        self.groups_by_gid = {}
+        self.user_groups = {}
+        for group in groups:
+            self.groups_by_name.setdefault(group.gr_name, group)
+            self.groups_by_gid.setdefault(group.gr_gid, group)
+            for member in group.gr_mem:
+                self.user_groups.setdefault(member, []).append(group.gr_name)
+
+    def user(self, name):
+        return self.users_by_name.get(name)
+
+    def group(self, name):
+        return self.groups_by_name.get(name)
+
+    def user_by_uid(self, uid):
+        return self.users_by_uid.get(uid)
+
+    def group_by_gid(self, gid):
+        return self.groups_by_gid.get(gid)
+
+    def members(self, group_name):
+        """Supplementary members of a group"""
+        group = self.groups_by_name.get(group_name)
+        return list(group.gr_mem) if group is not None else []
+
+    def primary_members(self, group_name):
+        """Users whose primary group is group_name"""
+        group = self.groups_by_name.get(group_name)
+        return list(self.primary_users.get(group.gr_gid, ())) if group is not None else []
+
+    def groups_of(self, username):
+        """Names of the groups listing username as a supplementary member"""
+        return self.user_groups.get(username, [])
+
+
+def _nss_sources():
+    """Return the sources nsswitch.conf lists for passwd and group"""
+    sources = set()
+    try:
+        with open(NSSWITCH_CONF) as f:
+            for line in f:
+                database, _, rest = line.split('#', 1)[0].partition(':')
+                if database.strip() in ('passwd', 'group'):
+                    # Skip actions such as [NOTFOUND=return]
+                    sources.update(word for word in rest.split() if not word.startswith('['))
+    except OSError:
+        pass
+    return sources or set(LOCAL_SOURCES)
+
+
+class NssCache:
+    """Holds the current NssSnapshot and rebuilds it when it is out of date"""
+
+    def __init__(self, files=NSS_FILES, refresh=NSS_REFRESH):
+        self.files = files
+        self.refresh = refresh
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._keys = None
+        self._expire = 0
+        self.builds = 0
+
+    def get(self):
+        keys = tuple(file_key(path) for path in self.files)
+        with self._lock:
+            if self._snapshot is not None and keys == self._keys and time.monotonic() < self._expire:
+                return self._snapshot
+
+            started = time.perf_counter()
+            snapshot = NssSnapshot(pwd.getpwall(), grp.getgrall())
+            remote = _nss_sources() - set(LOCAL_SOURCES)
+            self._snapshot = snapshot
+            self._keys = keys
+            self._expire = time.monotonic() + self.refresh if remote else float('inf')
+            self.builds += 1
+            logger.debug("Read %s users and %s groups in %.3fs%s", len(snapshot.users), len(snapshot.groups),
+                         time.perf_counter() - started,
+                         f" (refreshed every {self.refresh:g}s for {', '.join(sorted(remote))})" if remote else '')
+            return snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+
+
+NSS_CACHE = NssCache()
+
+
+def get_nss():
+    """Return the current snapshot of the system users and groups"""
+    return NSS_CACHE.get()
+
+
+def invalidate_nss():
+    """Forget the snapshot, e.g. right after adding or removing a user or group"""
+    NSS_CACHE.invalidate()
@@ -0,0 +1,182 @@
+"""Read-only access to the Samba account database files.
+
+Reads the passdb.tdb file of the tdbsam backend and the text file of the
+smbpasswd backend directly, so listing users costs one file read instead of
+a pdbedit run. Only the fields the manager shows are decoded: username,
+RID (tdbsam) or uid (smbpasswd), account flags, the time the password was
+last set and the logon hours.
+
+Data that is not in a format this module knows (another TDB version, an
+old tdbsam record layout) raises PassdbFormatError, and callers fall back
+to pdbedit.
+"""
+
+import struct
+from functools import lru_cache
+
+# struct tdb_header: magic_food[32], version, hash_size, rwlocks,
+# recovery_start, sequence_number, magic1_hash, magic2_hash, feature_flags,
+# mutex_size, reserved[25]. The freelist head and the hash table follow it.
+TDB_MAGIC_FOOD = b'TDB file\n'
+TDB_VERSION = 0x26011967 + 6
+TDB_HEADER_SIZE = 168
+TDB_MAGIC = 0x26011999
+
+# tdbsam keys and the record layouts this module can decode
+TDBSAM_VERSION_KEY = b'INFO/version\x00'
+TDBSAM_VERSIONS = (3, 4)
+TDBSAM_USER_PREFIX = b'USER_'
+
+# Account control bits in the order pdbedit prints their letters
+ACCOUNT_FLAGS = (
+    (0x0004, 'N'),  # password not required
+    (0x0001, 'D'),  # disabled
+    (0x0002, 'H'),  # home directory required
+    (0x0008, 'T'),  # temporary duplicate account
+    (0x0010, 'U'),  # normal user
+    (0x0020, 'M'),  # MNS logon user
+    (0x0080, 'W'),  # workstation trust
+    (0x0100, 'S'),  # server trust
+    (0x0400, 'L'),  # locked out
+    (0x0200, 'X'),  # password does not expire
+    (0x0040, 'I'),  # domain trust
+)
+
+_u32 = struct.Struct('<I').unpack_from
+_times = struct.Struct('<7I').unpack_from
+_rids = struct.Struct('<2I').unpack_from
+_account = struct.Struct('<IHI').unpack_from
+TDB_RECORD_SIZE = 24
+
+
+class PassdbFormatError(ValueError):
+    """The data is not in a format this module can read"""
+
+
+@lru_cache(maxsize=None)
+def account_flags(acct_ctrl):
+    """Format account control bits the way pdbedit does, e.g. [DU         ]"""
+    letters = ''.join(letter for bit, letter in ACCOUNT_FLAGS if acct_ctrl & bit)
+    return f'[{letters:<11}]'
+
+
+def tdb_records(data, prefix=b''):
+    """Yield (key, value) of every record whose key starts with prefix in the
+    contents of a TDB file.
+
+    The hash chains are followed from the hash table, so free and dead
+    records are never visited."""
+    if data[:len(TDB_MAGIC_FOOD)] != TDB_MAGIC_FOOD or len(data) < TDB_HEADER_SIZE:
+        raise PassdbFormatError("Not a TDB file")
+    # TDB files are written in the byte order of the host that created them
+    for order in '<>':
+        if struct.unpack_from(order + 'I', data, 32)[0] == TDB_VERSION:
+            break
+    else:
+        raise PassdbFormatError("Unsupported TDB version")
+
+    hash_size = struct.unpack_from(order + 'I', data, 36)[0]
+    table_end = TDB_HEADER_SIZE + 4 * (hash_size + 1)
+    if table_end > len(data):
+        raise PassdbFormatError("Truncated TDB hash table")
+
+    record = struct.Struct(order + '6I').unpack_from
+    size = len(data)
+    # A chain longer than the number of records that fit is a loop
+    steps = size // TDB_RECORD_SIZE
+    for offset in struct.unpack_from(f'{order}{hash_size}I', data, TDB_HEADER_SIZE + 4):
+        while offset:
+            steps -= 1
+            if steps < 0 or offset < table_end or offset + TDB_RECORD_SIZE > size:
+                raise PassdbFormatError(f"Corrupt TDB hash chain at offset {offset}")
+            next_offset, _, key_len, data_len, _, magic = record(data, offset)
+            start = offset + TDB_RECORD_SIZE
+            if magic == TDB_MAGIC and data.startswith(prefix, start):
+                end = start + key_len + data_len
+                if end > size:
+                    raise PassdbFormatError(f"TDB record at offset {offset} runs past the end of the file")
+                yield data[start:start + key_len], data[start + key_len:end]
+            offset = next_offset
+
+
+def _tdbsam_user(value, hours_cache):
+    # Layout "dddddddBBBBBBBBBBBBddBBBdwdBwwd" (init_samu_from_buffer_v3):
+    # seven times, twelve strings starting with the username, user and group
+    # RID, three password blobs, account flags, logon divisions, logon hours
+    # length and the logon hours. Strings are NUL terminated blobs.
+    times = _times(value, 0)
+    length = _u32(value, 28)[0]
+    username = value[32:32 + length].rstrip(b'\x00').decode('utf-8', 'replace')
+    offset = 32 + length
+    for _ in range(11):
+        offset += 4 + _u32(value, offset)[0]
+    user_rid = _rids(value, offset)[0]
+    offset += 8
+    for _ in range(3):
+        offset += 4 + _u32(value, offset)[0]
+    acct_ctrl, _, hours_len = _account(value, offset)
+    offset += 10
+    length = min(_u32(value, offset)[0], (hours_len + 7) // 8)
+    # Nearly every account has the same logon hours; format them once
+    hours = value[offset + 4:offset + 4 + length]
+    logon_hours = hours_cache.get(hours)
+    if logon_hours is None:
+        logon_hours = hours_cache[hours] = hours.hex().upper() or None
+    return {
+        'username': username,
+        'enabled': not acct_ctrl & 0x0001,
+        'flags': account_flags(acct_ctrl),
+        'rid': user_rid,
+        'pass_last_set': times[4] or None,
+        'logon_hours': logon_hours,
+    }
+
+
+def parse_tdbsam(data):
+    """Return the users in the contents of a tdbsam passdb.tdb file"""
+    version = None
+    users = []
+    hours_cache = {}
+    try:
+        for key, value in tdb_records(bytes(data)):
+            if key.startswith(TDBSAM_USER_PREFIX):
+                users.append(_tdbsam_user(value, hours_cache))
+            elif key == TDBSAM_VERSION_KEY:
+                version = _u32(value)[0]
+    except struct.error as e:
+        raise PassdbFormatError(f"Truncated tdbsam record: {e}") from e
+    if version not in TDBSAM_VERSIONS:
+        raise PassdbFormatError(f"Unsupported tdbsam version {version}")
+    return users
+
+
+def _last_change_time(field):
+    if field.startswith('LCT-'):
+        try:
+            return int(field[4:], 16) or None
+        except ValueError:
+            pass
+    return None
+
+
+def parse_smbpasswd(content):
+    """Parse smbpasswd format (the file, or `pdbedit -L -w` output) into
+    user dicts in a single pass over the lines"""
+    users = []
+    for line in content.splitlines():
+        if not line or line[0] == '#':
+            continue
+        # name:uid:LM hash:NT hash:[flags]:LCT-<hex time>:
+        parts = line.split(':', 6)
+        username = parts[0].strip()
+        if not username:
+            continue
+        flags = (parts[4].strip() if len(parts) > 4 else '') or '[U          ]'
+        users.append({
+            'username': username,
+            'enabled': 'D' not in flags,
+            'flags': flags,
+            'uid': int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else None,
+            'pass_last_set': _last_change_time(parts[5]) if len(parts) > 5 else None,
+        })
+    return users
@@ -0,0 +1,628 @@
+"""Privileged helper for Samba Manager.
+
+Running every privileged operation through `sudo` forks a process and pays
+for PAM and sudoers evaluation each time; adding one share used to fork more
+than a dozen of them. The helper is a small root daemon that the web
+application talks to over a Unix socket instead. It only offers a narrow set
+of operations (read_file, atomic_write, stat, mkdir, chown, chmod, signal and
+run_allowed_tool), each checked against the policy below. Files are only
+changed under /etc/samba and inside the shares configured in smb.conf, and
+tools only run with the arguments the application itself uses. Anything
+else is refused, and the application falls back to sudo.
+
+Start it as root, allowing the user the web application runs as:
+
+    sudo python3 -m app.privileged_helper --allow-user samba-manager
+
+The application uses the helper whenever its socket
+(SAMBA_MANAGER_HELPER_SOCKET, default /run/samba-manager/helper.sock)
+answers, and falls back to sudo otherwise.
+
+Requests and responses are single JSON lines. File contents are base64
+encoded.
+"""
+
+import argparse
+import base64
+import json
+import logging
+import os
+import pwd
+import grp
+import re
+import shutil
+import signal as signals
+import socket
+import socketserver
+import stat as stat_module
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+
+from .samba_config import ConfigCache, load_config_file
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = '/run/samba-manager/helper.sock'
+
+# Files the helper reads on behalf of the application
+READ_ROOTS = ('/etc/samba', '/var/lib/samba', '/var/log/samba', '/var/log/samba-manager')
+READ_FILES = ('/etc/passwd', '/etc/group')
+
+# Files the helper replaces, creates, chowns and chmods. Paths inside the
+# shares configured in SMB_CONF may be changed too (see share_roots()).
+WRITE_ROOTS = ('/etc/samba',)
+SMB_CONF = os.environ.get('SAMBA_MANAGER_SMB_CONF', '/etc/samba/smb.conf')
+
+# Share paths that never count as share roots, however they are configured
+PROTECTED_PATHS = ('/', '/bin', '/boot', '/dev', '/etc', '/home', '/lib', '/lib64', '/media',
+                   '/mnt', '/opt', '/proc', '/root', '/run', '/sbin', '/srv', '/sys', '/tmp',
+                   '/usr', '/var')
+PROTECTED_TREES = ('/bin', '/boot', '/dev', '/etc', '/lib', '/lib64', '/proc', '/root',
+                   '/run', '/sbin', '/sys', '/usr', '/var')
+
+# Processes that may be signalled and the signals allowed
+SAMBA_PROCESSES = ('smbd', 'nmbd', 'winbindd', 'samba')
+ALLOWED_SIGNALS = (0, signals.SIGTERM, signals.SIGKILL, signals.SIGHUP)
+
+# Tools run_allowed_tool may run, searched for in a fixed PATH
+TOOL_PATH = '/usr/sbin:/usr/bin:/sbin:/bin'
+ALLOWED_TOOLS = ('testparm', 'smbcontrol', 'smbstatus', 'pdbedit', 'smbpasswd', 'systemctl', 'service')
+SYSTEMCTL_VERBS = ('start', 'stop', 'restart', 'reload', 'is-active', 'is-enabled', 'show', 'status', 'enable')
+SAMBA_UNITS = ('smbd', 'nmbd', 'winbind', 'samba-ad-dc', 'samba')
+TOOL_TIMEOUT = 60
+
+# Account files written by the bulk user import for `pdbedit -i`
+IMPORT_FILE_PREFIX = 'samba-import-'
+IMPORT_FILE_SUFFIX = '.smbpasswd'
+IMPORT_FILE_RE = re.compile(rf'^{re.escape(IMPORT_FILE_PREFIX)}\w+{re.escape(IMPORT_FILE_SUFFIX)}$')
+ACCOUNT_NAME_RE = re.compile(r'^[A-Za-z0-9_][A-Za-z0-9_.-]*\$?$')
+# Share or machine names passed to smbcontrol close-share
+TARGET_NAME_RE = re.compile(r'^[\w.:@$][\w.:@$ -]*$')
+
+
+class HelperError(Exception):
+    """An operation was refused or failed inside the helper"""
+
+
+class HelperUnavailable(ConnectionError):
+    """The helper could not be reached"""
+
+
+def _real(path):
+    if not isinstance(path, str) or not os.path.isabs(path):
+        raise HelperError(f"Path must be absolute: {path!r}")
+    return os.path.realpath(path)
+
+
+def _under(path, roots):
+    return any(path == root or path.startswith(root.rstrip('/') + '/') for root in roots)
+
+
+def check_read(path):
+    real = _real(path)
+    if real in READ_FILES or _under(real, READ_ROOTS):
+        return real
+    raise PermissionError(f"Reading {path} is not allowed")
+
+
+def check_write(path):
+    real = os.path.join(_real(os.path.dirname(path)), os.path.basename(path))
+    if _under(real, WRITE_ROOTS):
+        return real
+    raise PermissionError(f"Writing {path} is not allowed")
+
+
+def _home_directories():
+    return {os.path.realpath(user.pw_dir) for user in pwd.getpwall() if user.pw_dir}
+
+
+def _share_root(path, homes):
+    """The real path of a configured share path, or None when it must not be
+    treated as a share root (a system directory or a user's home)"""
+    if not path or '%' in path or not os.path.isabs(path):
+        return None
+    real = os.path.realpath(path)
+    if real in PROTECTED_PATHS or _under(real, PROTECTED_TREES):
+        return None
+    # A share containing a home directory would expose its .ssh and the like
+    if any(_under(home, (real,)) for home in homes):
+        return None
+    return real
+
+
+def _load_share_roots():
+    try:
+        config = load_config_file(SMB_CONF)
+    except OSError:
+        return [SMB_CONF], ()
+    homes = _home_directories()
+    roots = {_share_root(section.get('path'), homes) for section in config.share_sections()}
+    return config.dependencies() or [SMB_CONF], tuple(sorted(root for root in roots if root))
+
+
+_share_roots = ConfigCache()
+
+
+def share_roots():
+    """Real paths of the shares configured in SMB_CONF and its includes,
+    reloaded whenever one of those files changes"""
+    return _share_roots.get('share_roots', [SMB_CONF], _load_share_roots,
+                            depends_on=lambda value: value[0])[1]
+
+
+def check_modify(path, recursive=False):
+    """Allow creating, chowning and chmodding below /etc/samba and inside
+    configured shares. Recursive changes are only allowed on a share root."""
+    real = _real(path)
+    roots = share_roots()
+    if recursive:
+        if real in roots:
+            return real
+        raise PermissionError(f"Recursive changes to {path} are not allowed")
+    if (_under(real, WRITE_ROOTS) and real not in WRITE_ROOTS) or _under(real, roots):
+        return real
+    raise PermissionError(f"Changing {path} is not allowed")
+
+
+def _account_name(arg):
+    return bool(ACCOUNT_NAME_RE.match(arg))
+
+
+def _target_name(arg):
+    return bool(TARGET_NAME_RE.match(arg))
+
+
+def _samba_config(arg):
+    return os.path.isabs(arg) and _under(os.path.realpath(arg), WRITE_ROOTS)
+
+
+def _import_file(arg):
+    """smbpasswd:<file> naming a private, regular import file"""
+    backend, _, path = arg.partition(':')
+    if backend != 'smbpasswd' or not os.path.isabs(path) or not IMPORT_FILE_RE.match(os.path.basename(path)):
+        return False
+    if os.path.realpath(path) != os.path.normpath(path):
+        return False
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return stat_module.S_ISREG(st.st_mode) and not st.st_mode & 0o077
+
+
+# The argument lists the application runs each tool with. Strings must match
+# exactly, functions check the argument in their place.
+TOOL_ARGUMENTS = {
+    'pdbedit': (('-L', '-w'), ('-i', _import_file)),
+    'smbpasswd': (('-s', '-a', _account_name), ('-s', _account_name), ('-d', _account_name),
+                  ('-e', _account_name), ('-x', _account_name)),
+    'smbcontrol': (('all', 'reload-config'), ('smbd', 'close-share', _target_name)),
+    'smbstatus': ((),),
+    'testparm': (('-s',), ('-s', _samba_config), ('-s', '-v'), ('-s', '-v', _samba_config)),
+}
+
+
+def _matches(args, pattern):
+    return len(args) == len(pattern) and all(
+        expected(arg) if callable(expected) else arg == expected for arg, expected in zip(args, pattern))
+
+
+def check_tool(argv):
+    if not argv or not all(isinstance(arg, str) for arg in argv):
+        raise HelperError("Tool arguments must be a list of strings")
+    tool, args = argv[0], argv[1:]
+    if tool not in ALLOWED_TOOLS:
+        raise PermissionError(f"Tool {tool} is not allowed")
+    if tool in ('systemctl', 'service'):
+        if any(arg.startswith('-') for arg in args):
+            raise PermissionError(f"{tool} {' '.join(args)} is not allowed")
+        words = list(args)
+        if tool == 'service':
+            # service <unit> <verb>
+            words = words[1:] + words[:1]
+        if not words or words[0] not in SYSTEMCTL_VERBS:
+            raise PermissionError(f"{tool} {' '.join(args)} is not allowed")
+        for unit in words[1:]:
+            if unit.rsplit('.service', 1)[0] not in SAMBA_UNITS:
+                raise PermissionError(f"Unit {unit} is not allowed")
+    elif not any(_matches(args, pattern) for pattern in TOOL_ARGUMENTS[tool]):
+        raise PermissionError(f"{tool} {' '.join(args)} is not allowed")
+    path = shutil.which(tool, path=TOOL_PATH)
+    if path is None:
+        raise FileNotFoundError(f"{tool} is not installed")
+    return [path] + argv[1:]
+
+
+def _resolve_owner(user, group):
+    uid = -1 if user in (None, '') else (int(user) if str(user).isdigit() else pwd.getpwnam(user).pw_uid)
+    gid = -1 if group in (None, '') else (int(group) if str(group).isdigit() else grp.getgrnam(group).gr_gid)
+    return uid, gid
+
+
+def _walk(path, recursive):
+    yield path
+    if recursive and os.path.isdir(path) and not os.path.islink(path):
+        for root, dirs, files in os.walk(path):
+            for name in dirs + files:
+                yield os.path.join(root, name)
+
+
+def atomic_write_file(target, content, mode=None, backup=False):
+    """Write content to a temporary file in the target directory, fsync it
+    and rename it over the target, so readers see either the old or the new
+    file. The file keeps the old file's mode and owner unless mode is given.
+    With backup set the old file is kept as target.bak, as a hardlink where
+    the filesystem allows it. Returns the number of bytes written."""
+    directory = os.path.dirname(os.path.abspath(target))
+    existing = None
+    try:
+        existing = os.stat(target)
+    except FileNotFoundError:
+        pass
+
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(target) + '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        if mode is not None:
+            os.chmod(temp_path, int(mode, 8) if isinstance(mode, str) else mode)
+        elif existing is not None:
+            os.chmod(temp_path, stat_module.S_IMODE(existing.st_mode))
+        else:
+            os.chmod(temp_path, 0o644)
+        if existing is not None and os.geteuid() == 0:
+            os.chown(temp_path, existing.st_uid, existing.st_gid)
+        if backup and existing is not None:
+            _backup_file(target)
+        os.rename(temp_path, target)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+    return len(content)
+
+
+def _backup_file(target):
+    # Link (or copy) under a temporary name first, so target.bak is replaced
+    # in one rename and never missing
+    backup_path = target + '.bak'
+    temp_backup = f'{backup_path}.{os.getpid()}.{threading.get_ident()}'
+    try:
+        os.link(target, temp_backup)
+    except FileExistsError:
+        os.unlink(temp_backup)
+        os.link(target, temp_backup)
+    except OSError:
+        shutil.copy2(target, temp_backup)
+    os.rename(temp_backup, backup_path)
+
+
+# Operations. Each takes keyword arguments from the request and returns a
+# JSON-serialisable result.
+
+def op_ping():
+    return {'pid': os.getpid()}
+
+
+def op_read_file(path):
+    with open(check_read(path), 'rb') as f:
+        return base64.b64encode(f.read()).decode('ascii')
+
+
+def op_atomic_write(path, data, mode=None, backup=False):
+    return atomic_write_file(check_write(path), base64.b64decode(data), mode=mode, backup=backup)
+
+
+def op_stat(path):
+    # Only what the helper may read or change anyway, so it cannot be used to
+    # probe arbitrary paths as root
+    try:
+        real = check_read(path)
+    except PermissionError:
+        real = check_modify(path)
+    try:
+        st = os.stat(real)
+    except FileNotFoundError:
+        return None
+    return {
+        'mode': stat_module.S_IMODE(st.st_mode),
+        'is_dir': stat_module.S_ISDIR(st.st_mode),
+        'uid': st.st_uid,
+        'gid': st.st_gid,
+        'size': st.st_size,
+        'mtime_ns': st.st_mtime_ns,
+        'readable': os.access(real, os.R_OK),
+        'writable': os.access(real, os.W_OK),
+    }
+
+
+def op_mkdir(path, parents=True, mode=None):
+    real = check_modify(path)
+    mode = 0o777 if mode is None else (int(mode, 8) if isinstance(mode, str) else mode)
+    if parents:
+        os.makedirs(real, mode=mode, exist_ok=True)
+    elif not os.path.isdir(real):
+        os.mkdir(real, mode)
+    return True
+
+
+def op_chown(path, user=None, group=None, recursive=False):
+    real = check_modify(path, recursive)
+    uid, gid = _resolve_owner(user, group)
+    for item in _walk(real, recursive):
+        os.chown(item, uid, gid, follow_symlinks=False)
+    return True
+
+
+def op_chmod(path, mode, recursive=False):
+    real = check_modify(path, recursive)
+    mode = int(mode, 8) if isinstance(mode, str) else mode
+    for item in _walk(real, recursive):
+        if not os.path.islink(item):
+            os.chmod(item, mode)
+    return True
+
+
+def op_signal(pid, sig=signals.SIGTERM):
+    """Send sig to a Samba process. Signal 0 only checks that it exists.
+    Returns the process name, or None if there is no such process."""
+    pid = int(pid)
+    sig = int(sig)
+    if pid <= 1 or sig not in ALLOWED_SIGNALS:
+        raise PermissionError(f"Signal {sig} to {pid} is not allowed")
+    try:
+        with open(f'/proc/{pid}/comm') as f:
+            comm = f.read().strip()
+    except FileNotFoundError:
+        return None
+    if comm not in SAMBA_PROCESSES:
+        raise PermissionError(f"Process {pid} ({comm}) is not a Samba process")
+    try:
+        os.kill(pid, sig)
+    except ProcessLookupError:
+        return None
+    return comm
+
+
+def op_run_allowed_tool(argv, input=None, timeout=None):
+    cmd = check_tool(argv)
+    result = subprocess.run(cmd, input=input, capture_output=True, text=True, check=False,
+                            timeout=timeout or TOOL_TIMEOUT,
+                            env={'PATH': TOOL_PATH, 'LANG': 'C.UTF-8'})
+    return {'returncode': result.returncode, 'stdout': result.stdout, 'stderr': result.stderr}
+
+
+OPERATIONS = {
+    'ping': op_ping,
+    'read_file': op_read_file,
+    'atomic_write': op_atomic_write,
+    'stat': op_stat,
+    'mkdir': op_mkdir,
+    'chown': op_chown,
+    'chmod': op_chmod,
+    'signal': op_signal,
+    'run_allowed_tool': op_run_allowed_tool,
+}
+
+READ_ONLY_OPERATIONS = ('ping', 'read_file', 'stat')
+
+# Exceptions re-raised with the same type in the client
+ERROR_TYPES = {
+    'PermissionError': PermissionError,
+    'FileNotFoundError': FileNotFoundError,
+    'FileExistsError': FileExistsError,
+    'NotADirectoryError': NotADirectoryError,
+    'IsADirectoryError': IsADirectoryError,
+    'KeyError': KeyError,
+    'TimeoutExpired': TimeoutError,
+}
+
+
+def handle_request(request):
+    """Run one decoded request and return the response dict"""
+    try:
+        op = OPERATIONS.get(request.get('op'))
+        if op is None:
+            raise HelperError(f"Unknown operation: {request.get('op')!r}")
+        return {'ok': True, 'result': op(**request.get('args', {}))}
+    except TypeError as e:
+        return {'ok': False, 'type': 'HelperError', 'error': f"Bad arguments: {e}"}
+    except Exception as e:
+        return {'ok': False, 'type': type(e).__name__, 'error': str(e)}
+
+
+class HelperRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        uid = self._peer_uid()
+        if uid not in self.server.allowed_uids:
+            logger.warning("Refusing connection from uid %s", uid)
+            return
+
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+            except ValueError:
+                response = {'ok': False, 'type': 'HelperError', 'error': 'Invalid request'}
+            else:
+                started = time.monotonic()
+                response = handle_request(request)
+                # Changes and refusals are logged as an audit trail
+                if response['ok'] and request.get('op') in READ_ONLY_OPERATIONS:
+                    level = logging.DEBUG
+                else:
+                    level = logging.INFO
+                logger.log(level, "uid %s %s %s (%.1f ms)", uid, request.get('op'),
+                           'ok' if response['ok'] else response['error'],
+                           (time.monotonic() - started) * 1000)
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+            self.wfile.flush()
+
+    def _peer_uid(self):
+        creds = self.request.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+        return struct.unpack('3i', creds)[1]
+
+
+class HelperServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, allowed_uids, group=None):
+        self.allowed_uids = set(allowed_uids) | {0}
+        os.makedirs(os.path.dirname(socket_path), mode=0o755, exist_ok=True)
+        try:
+            os.unlink(socket_path)
+        except FileNotFoundError:
+            pass
+        super().__init__(socket_path, HelperRequestHandler)
+        os.chmod(socket_path, 0o660)
+        if group is not None:
+            os.chown(socket_path, 0, grp.getgrnam(group).gr_gid)
+
+
+class HelperClient:
+    """Client side of the helper protocol.
+
+    Keeps one connection per thread and reconnects once when sending over a
+    cached connection fails, e.g. after the helper was restarted. Once a
+    request has been sent it is never repeated, since the operation may have
+    run; losing the connection then raises HelperUnavailable. Errors raised
+    in the helper are re-raised with the same builtin type where possible,
+    otherwise as HelperError."""
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, timeout=TOOL_TIMEOUT + 5):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def call(self, op, **args):
+        request = json.dumps({'op': op, 'args': args}).encode() + b'\n'
+        for attempt in (1, 2):
+            cached = getattr(self._local, 'conn', None) is not None
+            try:
+                self._connection().sendall(request)
+                break
+            except OSError as e:
+                self._close()
+                # No complete request reached the helper, so only a stale
+                # cached connection is worth one fresh attempt
+                if not cached or attempt == 2:
+                    raise HelperUnavailable(str(e)) from e
+
+        try:
+            line = self._local.reader.readline()
+        except OSError as e:
+            self._close()
+            raise HelperUnavailable(str(e)) from e
+        if not line:
+            self._close()
+            raise HelperUnavailable("Privileged helper closed the connection")
+
+        response = json.loads(line)
+        if not response['ok']:
+            raise ERROR_TYPES.get(response.get('type'), HelperError)(response['error'])
+        return response['result']
+
+    def close(self):
+        self._close()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            conn.settimeout(self.timeout)
+            try:
+                conn.connect(self.socket_path)
+            except OSError:
+                conn.close()
+                raise
+            self._local.conn = conn
+            self._local.reader = conn.makefile('rb')
+        return conn
+
+    def _close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.reader.close()
+            conn.close()
+            self._local.conn = None
+
+    def ping(self):
+        return self.call('ping')
+
+    def read_file(self, path):
+        return base64.b64decode(self.call('read_file', path=path))
+
+    def atomic_write(self, path, data, mode=None, backup=False):
+        if isinstance(data, str):
+            data = data.encode('utf-8', 'surrogateescape')
+        return self.call('atomic_write', path=path, data=base64.b64encode(data).decode('ascii'),
+                         mode=mode, backup=backup)
+
+    def stat(self, path):
+        return self.call('stat', path=path)
+
+    def mkdir(self, path, parents=True, mode=None):
+        return self.call('mkdir', path=path, parents=parents, mode=mode)
+
+    def chown(self, path, user=None, group=None, recursive=False):
+        return self.call('chown', path=path, user=user, group=group, recursive=recursive)
+
+    def chmod(self, path, mode, recursive=False):
+        return self.call('chmod', path=path, mode=mode, recursive=recursive)
+
+    def signal(self, pid, sig=signals.SIGTERM):
+        return self.call('signal', pid=pid, sig=int(sig))
+
+    def run_allowed_tool(self, argv, input=None, timeout=None):
+        """Run an allowed tool as root, returning a CompletedProcess"""
+        result = self.call('run_allowed_tool', argv=list(argv), input=input, timeout=timeout)
+        return subprocess.CompletedProcess(argv, result['returncode'], result['stdout'], result['stderr'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Samba Manager privileged helper')
+    parser.add_argument('--socket', default=os.environ.get('SAMBA_MANAGER_HELPER_SOCKET', DEFAULT_SOCKET),
+                        help='Unix socket to listen on')
+    parser.add_argument('--allow-user', action='append', default=[],
+                        help='User allowed to connect (may be repeated)')
+    parser.add_argument('--group', help='Group owning the socket')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    if os.geteuid() != 0:
+        parser.error('the helper must run as root')
+
+    allowed = [int(user) if user.isdigit() else pwd.getpwnam(user).pw_uid for user in args.allow_user]
+    group = args.group
+    if group is None and args.allow_user:
+        group = grp.getgrgid(pwd.getpwuid(allowed[0]).pw_gid).gr_name
+
+    server = HelperServer(args.socket, allowed, group)
+    logger.info("Privileged helper listening on %s", args.socket)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        try:
+            os.unlink(args.socket)
+        except FileNotFoundError:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+"""Opt-in per-request profiling for Samba Manager.
+
+Enabled with SAMBA_MANAGER_PROFILING=1. Every response then carries a
+Server-Timing header splitting the request into
+
+- config:     reading and parsing configuration files (cache misses),
+- subprocess: external commands, with the number of commands run,
+- template:   rendering templates,
+- other:      everything else,
+
+which browser developer tools show next to the request. Requests slower
+than SAMBA_MANAGER_SLOW_REQUEST seconds (default 1) are logged with the
+commands they ran. Administrators can add ?profile=1 to any page to get a
+cProfile summary of that request instead of the page.
+
+Times are exclusive: a command run while loading a configuration counts as
+subprocess time, not config time.
+"""
+
+import cProfile
+import contextlib
+import io
+import logging
+import os
+import pstats
+import threading
+import time
+
+from flask import Response, g, has_request_context, request, before_render_template, template_rendered
+from flask_login import current_user
+
+from .executor import _command, add_command_hook
+from .samba_config import CONFIG_CACHE
+
+logger = logging.getLogger(__name__)
+
+PROFILING = os.environ.get('SAMBA_MANAGER_PROFILING', '0') == '1'
+SLOW_REQUEST = float(os.environ.get('SAMBA_MANAGER_SLOW_REQUEST', '1'))
+
+# Functions listed in a ?profile=1 summary
+PROFILE_LIMIT = 40
+# Longest command summary written to the log
+COMMAND_SUMMARY_LENGTH = 60
+
+PHASES = ('config', 'subprocess', 'template')
+
+_installed = False
+_install_lock = threading.Lock()
+
+
+class RequestProfile:
+    """Time spent in each phase of one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.totals = dict.fromkeys(PHASES, 0.0)
+        self.commands = []
+        # Open phases as [phase, started, time charged to nested phases]
+        self._stack = []
+
+    def enter(self, phase):
+        self._stack.append([phase, time.perf_counter(), 0.0])
+
+    def exit(self):
+        if not self._stack:
+            return
+        phase, started, nested = self._stack.pop()
+        elapsed = time.perf_counter() - started
+        self.totals[phase] += elapsed - nested
+        if self._stack:
+            self._stack[-1][2] += elapsed
+
+    def command(self, record):
+        self.commands.append(record)
+        self.totals['subprocess'] += record['duration']
+        if self._stack:
+            self._stack[-1][2] += record['duration']
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        total = self.elapsed()
+        other = max(0.0, total - sum(self.totals.values()))
+        parts = [
+            f'config;dur={self.totals["config"] * 1000:.1f}',
+            f'subprocess;dur={self.totals["subprocess"] * 1000:.1f};desc="{len(self.commands)} commands"',
+            f'template;dur={self.totals["template"] * 1000:.1f}',
+            f'other;dur={other * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ]
+        return ', '.join(parts)
+
+
+def _current():
+    if not has_request_context():
+        return None
+    return g.get('request_profile')
+
+
+@contextlib.contextmanager
+def _config_phase(name):
+    profile = _current()
+    if profile is None:
+        yield
+        return
+    profile.enter('config')
+    try:
+        yield
+    finally:
+        profile.exit()
+
+
+def _record_command(record):
+    profile = _current()
+    if profile is not None:
+        profile.command(record)
+
+
+def _template_started(sender, **extra):
+    profile = _current()
+    if profile is not None:
+        profile.enter('template')
+
+
+def _template_finished(sender, **extra):
+    profile = _current()
+    if profile is not None:
+        profile.exit()
+
+
+def _install_hooks():
+    # The hooks are process-wide; install them once however many apps exist
+    global _installed
+    with _install_lock:
+        if _installed:
+            return
+        CONFIG_CACHE.load_hooks.append(_config_phase)
+        add_command_hook(_record_command)
+        before_render_template.connect(_template_started)
+        template_rendered.connect(_template_finished)
+        _installed = True
+
+
+def command_summary(args):
+    """The tool and its options, with option values and the other arguments
+    (usernames, paths, inline scripts) left out, e.g. `smbpasswd -s -a +1 args`"""
+    args = _command(args)
+    if not args:
+        return ''
+    options = [arg.split('=', 1)[0] + ('=...' if '=' in arg else '')
+               for arg in args[1:] if arg.startswith('-')]
+    others = len(args) - 1 - len(options)
+    summary = ' '.join([os.path.basename(args[0])] + options + ([f'+{others} args'] if others else []))
+    if len(summary) > COMMAND_SUMMARY_LENGTH:
+        summary = summary[:COMMAND_SUMMARY_LENGTH - 3] + '...'
+    return summary
+
+
+def _wants_cprofile():
+    return (request.args.get('profile') == '1' and current_user.is_authenticated
+            and getattr(current_user, 'is_admin', False))
+
+
+def init_app(app):
+    """Add Server-Timing headers, slow request logging and ?profile=1 to app"""
+    _install_hooks()
+
+    @app.before_request
+    def _start_profile():
+        g.request_profile = RequestProfile()
+        if _wants_cprofile():
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another request is being profiled
+                logger.info("Not profiling %s, a profile is already running", request.path)
+            else:
+                g.cprofile = profiler
+
+    @app.after_request
+    def _finish_profile(response):
+        profile = g.pop('request_profile', None)
+        profiler = g.pop('cprofile', None)
+        if profiler is not None:
+            profiler.disable()
+            response = _profile_response(profiler, profile)
+        if profile is None:
+            return response
+
+        response.headers['Server-Timing'] = profile.server_timing()
+        elapsed = profile.elapsed()
+        if elapsed >= SLOW_REQUEST:
+            commands = ', '.join(f"{command_summary(record['args'])} ({record['duration'] * 1000:.0f} ms)"
+                                 for record in profile.commands)
+            logger.warning("Slow request %s %s took %.3fs (config %.3fs, subprocess %.3fs, template %.3fs); "
+                           "%s commands: %s", request.method, request.full_path.rstrip('?'), elapsed,
+                           profile.totals['config'], profile.totals['subprocess'],
+                           profile.totals['template'], len(profile.commands), commands or 'none')
+        return response
+
+
+def _profile_response(profiler, profile):
+    output = io.StringIO()
+    output.write(f"{request.method} {request.path}\n")
+    if profile is not None:
+        output.write(f"Server-Timing: {profile.server_timing()}\n")
+        for record in profile.commands:
+            output.write(f"  {record['duration'] * 1000:8.1f} ms  {command_summary(record['args'])}\n")
+    output.write('\n')
+    stats = pstats.Stats(profiler, stream=output)
+    stats.sort_stats('cumulative').print_stats(PROFILE_LIMIT)
+    return Response(output.getvalue(), mimetype='text/plain')
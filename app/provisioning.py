@@ -0,0 +1,483 @@
+"""Bulk import of Samba users from CSV or JSON.
+
+An import is planned before anything runs (plan_import): which system users
+and groups are missing, which groups gain members and which Samba accounts
+are created, updated or skipped. run_import then applies the plan in
+phases, batching wherever the tools allow it:
+
+1. groupadd for each missing group
+2. useradd for each missing system user, one at a time as they all lock
+   /etc/passwd, then a single chpasswd setting all of their passwords;
+   users whose password could not be set are removed again with userdel
+3. gpasswd -a for each user a group gains, so members added elsewhere
+   in the meantime are kept
+4. a single `pdbedit -i` creating every new Samba account
+5. smbpasswd, at most IMPORT_CONCURRENCY at a time, for password updates
+   and for any account the pdbedit import did not create
+
+run_import yields events (dicts) as the work progresses, including one per
+user as soon as its result is known, so callers can stream them.
+"""
+
+import csv
+import hashlib
+import io
+import json
+import logging
+import os
+import queue
+import re
+import struct
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .backends import get_backend
+from .nss import get_nss, invalidate_nss
+from .passdb import account_flags
+from .privileged_helper import IMPORT_FILE_PREFIX, IMPORT_FILE_SUFFIX
+from .samba_utils import DEV_MODE, get_samba_users, invalidate_samba_users, run_privileged
+
+logger = logging.getLogger(__name__)
+
+IMPORT_CONCURRENCY = int(os.environ.get('SAMBA_MANAGER_IMPORT_CONCURRENCY', '4'))
+MAX_IMPORT_USERS = 5000
+IMPORT_OPTIONS = ('create_system_users', 'update_existing', 'dry_run')
+# Every imported user joins this group, like users added one at a time
+SMB_USERS_GROUP = 'smbusers'
+
+USERNAME_RE = re.compile(r'^[a-z_][a-z0-9_.-]{0,31}$')
+GROUP_RE = re.compile(r'^[a-z][\w-]*$')
+GROUP_SEPARATOR_RE = re.compile(r'[;,\s]+')
+CHPASSWD_LINE_RE = re.compile(r'line (\d+)')
+TRUE_VALUES = ('1', 'true', 'yes', 'y', 'on')
+
+ACB_DISABLED = 0x0001
+ACB_NORMAL = 0x0010
+
+
+def parse_flag(value, default=False):
+    """Read a boolean from JSON, a CSV cell or a form field"""
+    if value is None or value == '':
+        return default
+    if isinstance(value, str):
+        return value.strip().lower() in TRUE_VALUES
+    return bool(value)
+
+
+def parse_import(content):
+    """Parse CSV or JSON import data into (entries, options).
+
+    JSON is a list of user objects, or an object with a "users" list and
+    any of IMPORT_OPTIONS. CSV needs a header row naming at least the
+    username column; the other columns are password, groups (separated by
+    ";", "," or spaces), create_system_user and enabled."""
+    text = content.lstrip('\ufeff').strip()
+    if not text:
+        raise ValueError("The import is empty")
+
+    options = {}
+    if text[0] in '[{':
+        try:
+            data = json.loads(text)
+        except ValueError as e:
+            raise ValueError(f"Invalid JSON: {e}") from e
+        if isinstance(data, dict):
+            options = {key: data[key] for key in IMPORT_OPTIONS if key in data}
+            data = data.get('users')
+        if not isinstance(data, list):
+            raise ValueError('Expected a list of users or an object with a "users" list')
+        entries = data
+    else:
+        reader = csv.DictReader(io.StringIO(text))
+        reader.fieldnames = [name.strip().lower() for name in reader.fieldnames or ()]
+        if 'username' not in reader.fieldnames:
+            raise ValueError("The CSV header must include a username column")
+        entries = [row for row in reader
+                   if any(isinstance(value, str) and value.strip() for value in row.values())]
+
+    if len(entries) > MAX_IMPORT_USERS:
+        raise ValueError(f"An import can add at most {MAX_IMPORT_USERS} users")
+    return entries, options
+
+
+def _entry(raw, create_system_users):
+    """Validate one imported user and return it with defaults filled in"""
+    if not isinstance(raw, dict):
+        raise ValueError("Expected an object with username and password")
+    username = str(raw.get('username') or '').strip()
+    if not USERNAME_RE.match(username):
+        raise ValueError(f"Invalid username '{username}'")
+    password = raw.get('password')
+    if not isinstance(password, str) or not password:
+        raise ValueError("Password is required")
+    if '\n' in password or '\r' in password:
+        raise ValueError("Password must not contain line breaks")
+
+    groups = raw.get('groups') or []
+    if isinstance(groups, str):
+        groups = GROUP_SEPARATOR_RE.split(groups)
+    if not isinstance(groups, list):
+        raise ValueError("Groups must be a list or a separated string")
+    groups = [str(group).strip() for group in groups if str(group).strip()]
+    for group in groups:
+        if not GROUP_RE.match(group):
+            raise ValueError(f"Invalid group name '{group}'")
+
+    return {
+        'username': username,
+        'password': password,
+        'groups': list(dict.fromkeys(groups)),
+        'create_system_user': parse_flag(raw.get('create_system_user'), create_system_users),
+        'enabled': parse_flag(raw.get('enabled'), True),
+    }
+
+
+def _result(username, status, message='', index=None):
+    result = {'event': 'user', 'username': username, 'status': status, 'message': message}
+    if index is not None:
+        result['index'] = index
+    return result
+
+
+class ImportPlan:
+    """What an import will change, worked out before anything runs"""
+
+    def __init__(self, update_existing=False):
+        self.update_existing = update_existing
+        self.entries = {}            # username -> valid entry, in input order
+        self.errors = []             # results of entries that cannot be imported
+        self.skipped = []            # results of users that already have an account
+        self.new_groups = []
+        self.new_system_users = []
+        self.group_members = {}      # group -> usernames it gains
+        self.new_accounts = []
+        self.password_updates = []
+
+    def to_dict(self):
+        return {
+            'users': len(self.entries) + len(self.errors),
+            'new_groups': self.new_groups,
+            'new_system_users': self.new_system_users,
+            'group_members': self.group_members,
+            'new_accounts': [entry['username'] for entry in self.new_accounts],
+            'password_updates': [entry['username'] for entry in self.password_updates],
+            'skipped': self.skipped,
+            'errors': self.errors,
+        }
+
+
+def plan_import(entries, create_system_users=False, update_existing=False):
+    """Validate entries against the current users and groups and return an
+    ImportPlan. Nothing is changed."""
+    plan = ImportPlan(update_existing)
+    nss = get_nss()
+    accounts = {user['username'] for user in get_samba_users()}
+
+    for index, raw in enumerate(entries):
+        try:
+            entry = _entry(raw, create_system_users)
+        except ValueError as e:
+            username = raw.get('username') if isinstance(raw, dict) else None
+            plan.errors.append(_result(str(username or ''), 'error', str(e), index))
+            continue
+        username = entry['username']
+        if username in plan.entries:
+            plan.errors.append(_result(username, 'error', "Duplicate username", index))
+            continue
+
+        if username in accounts:
+            if not update_existing:
+                plan.skipped.append(_result(username, 'skipped', "Samba account already exists", index))
+                continue
+            plan.password_updates.append(entry)
+        else:
+            if nss.user(username) is None:
+                if not entry['create_system_user']:
+                    plan.errors.append(_result(username, 'error', "System user does not exist", index))
+                    continue
+                plan.new_system_users.append(username)
+            plan.new_accounts.append(entry)
+        plan.entries[username] = entry
+
+        for group in [SMB_USERS_GROUP] + entry['groups']:
+            existing = nss.group(group)
+            if existing is not None and username in existing.gr_mem:
+                continue
+            if existing is None and group not in plan.new_groups:
+                plan.new_groups.append(group)
+            plan.group_members.setdefault(group, []).append(username)
+
+    return plan
+
+
+def _md4(message):
+    """MD4 digest (RFC 1320); hashlib only offers it when OpenSSL's legacy
+    provider is loaded"""
+    def rotate(value, bits):
+        value &= 0xffffffff
+        return ((value << bits) | (value >> (32 - bits))) & 0xffffffff
+
+    length = len(message) * 8
+    message += b'\x80' + b'\x00' * ((55 - len(message)) % 64) + struct.pack('<Q', length)
+    a, b, c, d = 0x67452301, 0xefcdab89, 0x98badcfe, 0x10325476
+    for offset in range(0, len(message), 64):
+        x = struct.unpack_from('<16I', message, offset)
+        aa, bb, cc, dd = a, b, c, d
+        for i in (0, 4, 8, 12):
+            a = rotate(a + ((b & c) | (~b & d)) + x[i], 3)
+            d = rotate(d + ((a & b) | (~a & c)) + x[i + 1], 7)
+            c = rotate(c + ((d & a) | (~d & b)) + x[i + 2], 11)
+            b = rotate(b + ((c & d) | (~c & a)) + x[i + 3], 19)
+        for i in (0, 1, 2, 3):
+            a = rotate(a + ((b & c) | (b & d) | (c & d)) + x[i] + 0x5a827999, 3)
+            d = rotate(d + ((a & b) | (a & c) | (b & c)) + x[i + 4] + 0x5a827999, 5)
+            c = rotate(c + ((d & a) | (d & b) | (a & b)) + x[i + 8] + 0x5a827999, 9)
+            b = rotate(b + ((c & d) | (c & a) | (d & a)) + x[i + 12] + 0x5a827999, 13)
+        for i in (0, 2, 1, 3):
+            a = rotate(a + (b ^ c ^ d) + x[i] + 0x6ed9eba1, 3)
+            d = rotate(d + (a ^ b ^ c) + x[i + 8] + 0x6ed9eba1, 9)
+            c = rotate(c + (d ^ a ^ b) + x[i + 4] + 0x6ed9eba1, 11)
+            b = rotate(b + (c ^ d ^ a) + x[i + 12] + 0x6ed9eba1, 15)
+        a, b, c, d = ((a + aa) & 0xffffffff, (b + bb) & 0xffffffff,
+                      (c + cc) & 0xffffffff, (d + dd) & 0xffffffff)
+    return struct.pack('<4I', a, b, c, d)
+
+
+def nt_hash(password):
+    """The NT hash Samba stores for a password, as upper-case hex"""
+    data = password.encode('utf-16-le')
+    try:
+        return hashlib.new('md4', data).hexdigest().upper()
+    except ValueError:
+        return _md4(data).hex().upper()
+
+
+def _smbpasswd_line(entry, uid, changed):
+    """One account in smbpasswd format; the LanMan hash is left unset"""
+    flags = account_flags(ACB_NORMAL | (0 if entry['enabled'] else ACB_DISABLED))
+    return f"{entry['username']}:{uid}:{'X' * 32}:{nt_hash(entry['password'])}:{flags}:LCT-{changed:08X}:\n"
+
+
+def _step(step, target, result=None, status=None, message=''):
+    if result is not None:
+        status = 'ok' if result.returncode == 0 else 'error'
+        message = message or (result.stderr or '').strip()
+    return {'event': 'step', 'step': step, 'target': target, 'status': status, 'message': message}
+
+
+def _parallel(tasks):
+    """Run (username, func) pairs IMPORT_CONCURRENCY at a time and yield the
+    result event of each as soon as it finishes"""
+    if not tasks:
+        return
+    with ThreadPoolExecutor(max_workers=IMPORT_CONCURRENCY, thread_name_prefix='user-import') as pool:
+        futures = {pool.submit(func): username for username, func in tasks}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as e:
+                logger.error("Error importing Samba user %s: %s", futures[future], e)
+                yield _result(futures[future], 'error', str(e))
+
+
+def _with_warnings(result, warnings):
+    notes = warnings.get(result['username'])
+    if notes and result['status'] != 'error':
+        result['message'] = '; '.join(filter(None, [result['message']] + notes))
+    return result
+
+
+def _run_system(plan):
+    """Apply a plan to the system's users, groups and passdb"""
+    failed = set()
+    warnings = {}
+
+    for group in plan.new_groups:
+        yield _step('groupadd', group, run_privileged(['groupadd', group]))
+    if plan.new_groups:
+        invalidate_nss()
+
+    created = []
+    for username in plan.new_system_users:
+        result = run_privileged(['useradd', '-m', '-s', '/bin/bash', username])
+        if result.returncode != 0:
+            failed.add(username)
+            yield _result(username, 'error', f"Failed to create system user: {result.stderr.strip()}")
+        else:
+            created.append(username)
+    if plan.new_system_users:
+        invalidate_nss()
+
+    if created:
+        result = run_privileged(['chpasswd'], input=''.join(
+            f"{username}:{plan.entries[username]['password']}\n" for username in created))
+        yield _step('chpasswd', f"{len(created)} users", result)
+        if result.returncode != 0:
+            # chpasswd sets the other lines and reports the failed ones by number
+            lines = {int(number) for number in CHPASSWD_LINE_RE.findall(result.stderr or '')}
+            for number, username in enumerate(created, 1):
+                if not lines or number in lines:
+                    failed.add(username)
+                    # Do not leave a new account behind without a password
+                    removed = run_privileged(['userdel', '-r', username])
+                    if removed.returncode == 0:
+                        message = "Failed to set system password; the new system user was removed"
+                    else:
+                        message = ("Failed to set system password; the new system user was left "
+                                   f"without a password: {removed.stderr.strip()}")
+                    yield _result(username, 'error', message)
+            invalidate_nss()
+
+    nss = get_nss()
+    for group, usernames in plan.group_members.items():
+        usernames = [username for username in usernames if username not in failed]
+        existing = nss.group(group)
+        if not usernames:
+            continue
+        if existing is None:
+            for username in usernames:
+                warnings.setdefault(username, []).append(f"group {group} does not exist")
+            continue
+        for username in usernames:
+            if username in existing.gr_mem:
+                continue
+            result = run_privileged(['gpasswd', '-a', username, group])
+            yield _step('gpasswd', group, result)
+            if result.returncode != 0:
+                warnings.setdefault(username, []).append(f"not added to group {group}")
+    if plan.group_members:
+        invalidate_nss()
+        nss = get_nss()
+
+    # Accounts of users the system does not know would be imported without
+    # a uid; smbpasswd reports why instead
+    retry = [entry for entry in plan.new_accounts
+             if entry['username'] not in failed and nss.user(entry['username']) is None]
+    accounts = [entry for entry in plan.new_accounts
+                if entry['username'] not in failed and nss.user(entry['username']) is not None]
+    if accounts:
+        changed = int(time.time())
+        fd, path = tempfile.mkstemp(prefix=IMPORT_FILE_PREFIX, suffix=IMPORT_FILE_SUFFIX)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                for entry in accounts:
+                    f.write(_smbpasswd_line(entry, nss.user(entry['username']).pw_uid, changed))
+            result = run_privileged(['pdbedit', '-i', f'smbpasswd:{path}'])
+        finally:
+            os.unlink(path)
+        yield _step('pdbedit', f"{len(accounts)} accounts", result)
+
+        invalidate_samba_users()
+        present = {user['username'] for user in get_samba_users()}
+        for entry in accounts:
+            if entry['username'] in present:
+                yield _with_warnings(_result(entry['username'], 'created'), warnings)
+            else:
+                retry.append(entry)
+
+    def add(entry):
+        username = entry['username']
+        result = run_privileged(['smbpasswd', '-s', '-a', username],
+                                input=f"{entry['password']}\n{entry['password']}\n")
+        if result.returncode != 0:
+            return _result(username, 'error', f"Failed to create Samba user: {result.stderr.strip()}")
+        if not entry['enabled']:
+            result = run_privileged(['smbpasswd', '-d', username])
+            if result.returncode != 0:
+                return _result(username, 'created', f"Failed to disable: {result.stderr.strip()}")
+        return _result(username, 'created')
+
+    def update(entry):
+        username = entry['username']
+        result = run_privileged(['smbpasswd', '-s', username],
+                                input=f"{entry['password']}\n{entry['password']}\n")
+        if result.returncode != 0:
+            return _result(username, 'error', f"Failed to set password: {result.stderr.strip()}")
+        return _result(username, 'updated')
+
+    tasks = [(entry['username'], lambda entry=entry: add(entry)) for entry in retry]
+    tasks += [(entry['username'], lambda entry=entry: update(entry)) for entry in plan.password_updates
+              if entry['username'] not in failed]
+    for result in _parallel(tasks):
+        yield _with_warnings(result, warnings)
+
+
+def _run_backend(plan, backend):
+    """Apply a plan through the backend one user at a time, in development
+    mode and for backends without system users and groups"""
+    if plan.new_groups or plan.new_system_users or plan.group_members:
+        reason = "development mode" if backend.name == 'system' else f"the {backend.name} backend"
+        yield _step('system', 'users and groups', status='skipped',
+                    message=f"System users and groups are not changed in {reason}")
+
+    def add(entry):
+        username = entry['username']
+        if not backend.add_user(username, entry['password'], entry['create_system_user']):
+            return _result(username, 'error', "Failed to create Samba user")
+        if not entry['enabled'] and not backend.set_user_enabled(username, False):
+            return _result(username, 'created', "Failed to disable")
+        return _result(username, 'created')
+
+    def update(entry):
+        if not backend.set_password(entry['username'], entry['password']):
+            return _result(entry['username'], 'error', "Failed to set password")
+        return _result(entry['username'], 'updated')
+
+    tasks = [(entry['username'], lambda entry=entry: add(entry)) for entry in plan.new_accounts]
+    tasks += [(entry['username'], lambda entry=entry: update(entry)) for entry in plan.password_updates]
+    yield from _parallel(tasks)
+
+
+def run_import(plan):
+    """Apply an ImportPlan, yielding progress events: the plan, one "step"
+    per batched command, one "user" per user and a final "done" summary"""
+    started = time.perf_counter()
+    counts = Counter()
+    yield {'event': 'plan', **plan.to_dict()}
+    for result in plan.errors + plan.skipped:
+        counts[result['status']] += 1
+        yield result
+
+    backend = get_backend()
+    if DEV_MODE or backend.name != 'system':
+        events = _run_backend(plan, backend)
+    else:
+        events = _run_system(plan)
+    try:
+        for event in events:
+            if event['event'] == 'user':
+                counts[event['status']] += 1
+            yield event
+    finally:
+        invalidate_samba_users()
+
+    elapsed = time.perf_counter() - started
+    logger.info("Imported Samba users in %.1fs: %s", elapsed, dict(counts))
+    yield {'event': 'done', 'created': counts['created'], 'updated': counts['updated'],
+           'skipped': counts['skipped'], 'failed': counts['error'], 'seconds': round(elapsed, 3)}
+
+
+def stream_import(plan):
+    """Run an import in a background thread and yield its events. The import
+    finishes even when the caller stops reading, e.g. a closed connection."""
+    events = queue.Queue()
+
+    def worker():
+        try:
+            for event in run_import(plan):
+                events.put(event)
+        except Exception as e:
+            logger.exception("User import failed")
+            events.put({'event': 'error', 'message': str(e)})
+        finally:
+            events.put(None)
+
+    threading.Thread(target=worker, name='user-import', daemon=True).start()
+    while True:
+        event = events.get()
+        if event is None:
+            return
+        yield event
@@ -1,4 +1,4 @@
-from flask import Blueprint, render_template, request, redirect, flash, send_file, url_for, jsonify
+from flask import Blueprint, render_template, request, redirect, flash, send_file, url_for, jsonify, Response
 from flask_login import login_required, current_user
 import io
 import os
@@ -6,11 +6,14 @@ import subprocess
 import tempfile
 import datetime
 from .samba_utils import *
+from .executor import COMMAND_STATS
+from .provisioning import IMPORT_OPTIONS, parse_flag, parse_import, plan_import, stream_import
 import json
+import logging
 import re
-import pwd, grp
 
 bp = Blueprint('main', __name__)
+logger = logging.getLogger(__name__)
 
 @bp.route('/')
 @login_required
@@ -74,7 +77,7 @@ def global_settings():
         result = write_global_settings(settings)
         
         if result:
-            flash('Settings saved and Samba service restarted', 'success')
+            flash('Settings saved and Samba configuration reloaded', 'success')
         else:
             flash('Failed to save settings. Check logs for details', 'error')
             
@@ -97,19 +100,21 @@ def shares():
     has_sudo = check_sudo_access()
     all_shares = load_shares()
     
-    # Debug logging
-    print(f"Loaded {len(all_shares)} shares from configuration")
-    for share in all_shares:
-        print(f"Share: {share.get('name', 'unknown')} - Path: {share.get('path', 'unknown')}")
-        print(f"  valid_users: '{share.get('valid_users', '<missing>')}', write_list: '{share.get('write_list', '<missing>')}'")
-        print(f"  create_mask: '{share.get('create_mask', '<missing>')}', directory_mask: '{share.get('directory_mask', '<missing>')}'")
+    # Debug logging, skipped entirely unless enabled
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Loaded %s shares from configuration", len(all_shares))
+        for share in all_shares:
+            logger.debug("Share: %s - Path: %s - valid_users: '%s', write_list: '%s', create_mask: '%s', directory_mask: '%s'",
+                         share.get('name', 'unknown'), share.get('path', 'unknown'),
+                         share.get('valid_users', '<missing>'), share.get('write_list', '<missing>'),
+                         share.get('create_mask', '<missing>'), share.get('directory_mask', '<missing>'))
     
     # Sort shares: system shares first, then local shares
     system_shares = [s for s in all_shares if s['name'] in ['secure-share', 'share']]
     local_shares = [s for s in all_shares if s['name'] not in ['secure-share', 'share']]
     sorted_shares = system_shares + local_shares
     
-    print(f"Sending {len(sorted_shares)} shares to template")
+    logger.debug("Sending %s shares to template", len(sorted_shares))
     
     return render_template('shares.html', 
                           shares=sorted_shares, 
@@ -145,7 +150,7 @@ def add_share():
         flash(f'Invalid path: {message}', 'error')
         return redirect('/shares')
     else:
-        print(f"Path validation successful: {message}")
+        logger.debug("Path validation successful: %s", message)
     
     # Process users and groups
     valid_users = request.form.get('valid_users', '')
@@ -186,13 +191,13 @@ def add_share():
     }
     
     # Debug log the share data
-    print(f"Adding share: {name}")
+    logger.debug("Adding share: %s", name)
     for key, value in share.items():
-        print(f"  {key}: {value}")
+        logger.debug("  %s: %s", key, value)
     
     result = add_or_update_share(share)
     if result:
-        flash('Share added successfully and Samba service restarted', 'success')
+        flash('Share added successfully, Samba will reload its configuration shortly', 'success')
     else:
         flash('Failed to add share', 'error')
     
@@ -228,7 +233,7 @@ def edit_share():
         flash(f'Invalid path: {message}', 'error')
         return redirect('/shares')
     else:
-        print(f"Path validation successful: {message}")
+        logger.debug("Path validation successful: %s", message)
     
     # Process users and groups
     valid_users = request.form.get('valid_users', '')
@@ -269,9 +274,9 @@ def edit_share():
     }
     
     # Debug log the share data
-    print(f"Updating share: {name}")
+    logger.debug("Updating share: %s", name)
     for key, value in share.items():
-        print(f"  {key}: {value}")
+        logger.debug("  %s: %s", key, value)
     
     # If name was changed, delete the old share first
     if original_name != name:
@@ -279,7 +284,7 @@ def edit_share():
     
     result = add_or_update_share(share)
     if result:
-        flash('Share updated successfully and Samba service restarted', 'success')
+        flash('Share updated successfully, Samba will reload its configuration shortly', 'success')
     else:
         flash('Failed to update share', 'error')
     
@@ -302,7 +307,7 @@ def delete_share_route():
     
     result = delete_share(share_name)
     if result:
-        flash('Share deleted successfully and Samba service restarted', 'success')
+        flash('Share deleted successfully, Samba will reload its configuration shortly', 'success')
     else:
         flash('Failed to delete share', 'error')
     
@@ -312,7 +317,8 @@ def delete_share_route():
 @bp.route('/users', methods=['GET'])
 @login_required
 def users():
-    if not check_sudo_access():
+    has_sudo = has_capability('manage_users')
+    if not has_sudo:
         flash('Error: Sudo access is required to manage Samba users', 'error')
         return redirect('/')
         
@@ -324,12 +330,12 @@ def users():
                           users=users, 
                           system_users=system_users,
                           groups=system_groups,
-                          has_sudo=check_sudo_access())
+                          has_sudo=has_sudo)
 
 @bp.route('/users/add', methods=['POST'])
 @login_required
 def add_user():
-    if not check_sudo_access():
+    if not has_capability('manage_users'):
         flash('Error: Sudo access is required to manage Samba users', 'error')
         return redirect('/users')
         
@@ -350,11 +356,56 @@ def add_user():
         
     return redirect('/users')
 
+@bp.route('/users/import', methods=['GET'])
+@login_required
+def import_users():
+    """Page to add many Samba users from a CSV or JSON file"""
+    if not has_capability('manage_users'):
+        flash('Error: Sudo access is required to manage Samba users', 'error')
+        return redirect('/users')
+    
+    return render_template('import_users.html')
+
+@bp.route('/api/users/import', methods=['POST'])
+@login_required
+def api_import_users():
+    """API endpoint to add many Samba users from CSV or JSON.
+    
+    Returns the plan with dry_run, otherwise streams the progress as one
+    JSON event per line while the import runs."""
+    if not has_capability('manage_users'):
+        return jsonify({"error": "Sudo access required to manage Samba users"}), 403
+    
+    upload = request.files.get('file')
+    if upload:
+        content = upload.read().decode('utf-8-sig', 'replace')
+    else:
+        content = request.form.get('data') or request.get_data(as_text=True)
+    
+    try:
+        entries, options = parse_import(content)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    for key in IMPORT_OPTIONS:
+        if key in request.values:
+            options[key] = request.values[key]
+    
+    plan = plan_import(entries,
+                       create_system_users=parse_flag(options.get('create_system_users')),
+                       update_existing=parse_flag(options.get('update_existing')))
+    if parse_flag(options.get('dry_run')):
+        return jsonify(plan.to_dict())
+    
+    logger.info("Importing %s Samba users for %s", len(entries), current_user.id)
+    events = (json.dumps(event) + '\n' for event in stream_import(plan))
+    return Response(events, mimetype='application/x-ndjson',
+                    headers={'X-Accel-Buffering': 'no', 'Cache-Control': 'no-cache'})
+
 @bp.route('/users/reset-password/<username>', methods=['POST'])
 @login_required
 def reset_samba_password(username):
     """Reset a Samba user's password"""
-    if not check_sudo_access():
+    if not has_capability('manage_users'):
         flash('Error: Sudo access is required to reset passwords', 'error')
         return redirect('/users')
     
@@ -364,18 +415,8 @@ def reset_samba_password(username):
         return redirect('/users')
     
     try:
-        # Use smbpasswd to reset the password
-        process = subprocess.Popen(['sudo', 'smbpasswd', '-s', username],
-                                   stdin=subprocess.PIPE,
-                                   stdout=subprocess.PIPE,
-                                   stderr=subprocess.PIPE,
-                                   text=True)
-        
-        # Send the password twice (for confirmation)
-        stdout, stderr = process.communicate(input=f"{password}\n{password}\n")
-        
-        if process.returncode != 0:
-            flash(f'Failed to reset password: {stderr}', 'error')
+        if not get_backend().set_password(username, password):
+            flash(f'Failed to reset password for {username}', 'error')
         else:
             flash(f'Password for {username} reset successfully', 'success')
     
@@ -388,17 +429,15 @@ def reset_samba_password(username):
 @login_required
 def disable_samba_user(username):
     """Disable a Samba user"""
-    if not check_sudo_access():
+    if not has_capability('manage_users'):
         flash('Error: Sudo access is required to disable users', 'error')
         return redirect('/users')
     
     try:
-        # Use smbpasswd to disable the user
-        result = subprocess.run(['sudo', 'smbpasswd', '-d', username],
-                               capture_output=True, text=True, check=False)
-        
-        if result.returncode != 0:
-            flash(f'Failed to disable user: {result.stderr}', 'error')
+        changed = get_backend().set_user_enabled(username, False)
+        invalidate_samba_users()
+        if not changed:
+            flash(f'Failed to disable user {username}', 'error')
         else:
             flash(f'User {username} disabled successfully', 'success')
     
@@ -411,17 +450,15 @@ def disable_samba_user(username):
 @login_required
 def enable_samba_user(username):
     """Enable a Samba user"""
-    if not check_sudo_access():
+    if not has_capability('manage_users'):
         flash('Error: Sudo access is required to enable users', 'error')
         return redirect('/users')
     
     try:
-        # Use smbpasswd to enable the user
-        result = subprocess.run(['sudo', 'smbpasswd', '-e', username],
-                               capture_output=True, text=True, check=False)
-        
-        if result.returncode != 0:
-            flash(f'Failed to enable user: {result.stderr}', 'error')
+        changed = get_backend().set_user_enabled(username, True)
+        invalidate_samba_users()
+        if not changed:
+            flash(f'Failed to enable user {username}', 'error')
         else:
             flash(f'User {username} enabled successfully', 'success')
     
@@ -434,17 +471,15 @@ def enable_samba_user(username):
 @login_required
 def delete_samba_user(username):
     """Delete a Samba user"""
-    if not check_sudo_access():
+    if not has_capability('manage_users'):
         flash('Error: Sudo access is required to delete users', 'error')
         return redirect('/users')
     
     try:
-        # Use smbpasswd to delete the user
-        result = subprocess.run(['sudo', 'smbpasswd', '-x', username],
-                               capture_output=True, text=True, check=False)
-        
-        if result.returncode != 0:
-            flash(f'Failed to delete user: {result.stderr}', 'error')
+        changed = get_backend().remove_user(username)
+        invalidate_samba_users()
+        if not changed:
+            flash(f'Failed to delete user {username}', 'error')
         else:
             flash(f'User {username} deleted successfully', 'success')
     
@@ -507,27 +542,26 @@ def import_conf():
             
             elif file_ext == '.conf':
                 # Handle direct .conf file import
-                # Copy the uploaded file to the Samba configuration
-                backup_path = '/etc/samba/smb_backup.conf'
+                # Keep the current config to put back if the new one is invalid
+                remember_service_params()
+                previous = read_privileged_bytes('/etc/samba/smb.conf')
                 
-                # Create a backup of the current config
-                subprocess.run(['sudo', 'cp', '/etc/samba/smb.conf', backup_path], check=False)
-                
-                # Copy the uploaded file to smb.conf
-                subprocess.run(['sudo', 'cp', temp_file.name, '/etc/samba/smb.conf'], check=False)
+                # Replace smb.conf with the uploaded file, keeping a .bak
+                with open(temp_file.name, 'rb') as f:
+                    write_config_file('/etc/samba/smb.conf', f.read(), backup=True)
                 
                 # Validate the configuration
-                validate_cmd = subprocess.run(['sudo', 'testparm', '-s', '/etc/samba/smb.conf'], 
-                                             capture_output=True, text=True, check=False)
+                validate_cmd = run_privileged(['testparm', '-s', '/etc/samba/smb.conf'])
                 
                 if validate_cmd.returncode != 0:
-                    # If validation fails, restore the backup
-                    subprocess.run(['sudo', 'cp', backup_path, '/etc/samba/smb.conf'], check=False)
+                    # If validation fails, restore the previous config
+                    write_config_file('/etc/samba/smb.conf', previous)
                     flash(f'Invalid configuration file: {validate_cmd.stderr}', 'error')
                 else:
-                    # Restart Samba services
-                    subprocess.run(['sudo', 'systemctl', 'restart', 'smbd', 'nmbd'], check=False)
-                    flash('Configuration file imported successfully', 'success')
+                    # Reload Samba services in the background, restarting only if required
+                    schedule_reload()
+                    flash('Configuration file imported successfully, Samba will reload its configuration shortly',
+                          'success')
             
             # Clean up the temporary file
             os.unlink(temp_file.name)
@@ -703,8 +737,8 @@ def start_service():
             flash('[DEV MODE] Would start Samba service in production', 'info')
             return redirect('/maintenance')
             
-        subprocess.run(['sudo', 'systemctl', 'start', 'smbd'], check=True)
-        subprocess.run(['sudo', 'systemctl', 'start', 'nmbd'], check=True)
+        run_privileged(['systemctl', 'start', 'smbd'], check=True)
+        run_privileged(['systemctl', 'start', 'nmbd'], check=True)
         flash('Samba service started successfully', 'success')
     except Exception as e:
         flash(f'Failed to start Samba service: {str(e)}', 'error')
@@ -724,8 +758,8 @@ def stop_service():
             flash('[DEV MODE] Would stop Samba service in production', 'info')
             return redirect('/maintenance')
             
-        subprocess.run(['sudo', 'systemctl', 'stop', 'smbd'], check=True)
-        subprocess.run(['sudo', 'systemctl', 'stop', 'nmbd'], check=True)
+        run_privileged(['systemctl', 'stop', 'smbd'], check=True)
+        run_privileged(['systemctl', 'stop', 'nmbd'], check=True)
         flash('Samba service stopped successfully', 'success')
     except Exception as e:
         flash(f'Failed to stop Samba service: {str(e)}', 'error')
@@ -744,19 +778,13 @@ def edit_config():
     share_file = SHARE_CONF
     
     if request.method == 'POST':
+        # Note restart-only parameters before they can change
+        remember_service_params()
+        
         if 'main_config' in request.form:
             try:
-                # Create a temporary file
-                with tempfile.NamedTemporaryFile(mode='w', delete=False) as temp_file:
-                    temp_file.write(request.form['main_config'])
-                    temp_path = temp_file.name
-                
-                # Use sudo to move the file to the correct location
-                result = subprocess.run(
-                    ['sudo', 'cp', temp_path, config_file],
-                    capture_output=True, text=True, check=True
-                )
-                os.unlink(temp_path)  # Remove the temp file
+                # Replace the file in one step, keeping the old one as .bak
+                write_config_file(config_file, request.form['main_config'], backup=True)
                 flash('Main configuration file updated successfully', 'success')
             except subprocess.CalledProcessError as e:
                 flash(f'Error updating main configuration: {e.stderr}', 'error')
@@ -765,28 +793,20 @@ def edit_config():
         
         if 'share_config' in request.form:
             try:
-                # Create a temporary file
-                with tempfile.NamedTemporaryFile(mode='w', delete=False) as temp_file:
-                    temp_file.write(request.form['share_config'])
-                    temp_path = temp_file.name
-                
-                # Use sudo to move the file to the correct location
-                result = subprocess.run(
-                    ['sudo', 'cp', temp_path, share_file],
-                    capture_output=True, text=True, check=True
-                )
-                os.unlink(temp_path)  # Remove the temp file
+                # Replace the file in one step, keeping the old one as .bak
+                write_config_file(share_file, request.form['share_config'], backup=True)
                 flash('Share configuration file updated successfully', 'success')
             except subprocess.CalledProcessError as e:
                 flash(f'Error updating share configuration: {e.stderr}', 'error')
             except Exception as e:
                 flash(f'Error updating share configuration: {str(e)}', 'error')
         
-        # Restart Samba service after config changes
-        if restart_samba_service():
-            flash('Samba service restarted successfully', 'success')
-        else:
-            flash('Failed to restart Samba service', 'error')
+        # Drop cached shares and settings read from the old files
+        invalidate_config_cache()
+        
+        # Reload Samba service after config changes, in the background
+        schedule_reload()
+        flash('Samba will reload its configuration shortly', 'success')
         
         return redirect('/edit-config')
     
@@ -796,25 +816,13 @@ def edit_config():
     
     try:
         if os.path.exists(config_file):
-            result = subprocess.run(
-                ['sudo', 'cat', config_file],
-                capture_output=True, text=True, check=True
-            )
-            main_config = result.stdout
-    except subprocess.CalledProcessError as e:
-        flash(f'Error reading main configuration: {e.stderr}', 'error')
+            main_config = read_privileged_file(config_file)
     except Exception as e:
         flash(f'Error reading main configuration: {str(e)}', 'error')
     
     try:
         if os.path.exists(share_file):
-            result = subprocess.run(
-                ['sudo', 'cat', share_file],
-                capture_output=True, text=True, check=True
-            )
-            share_config = result.stdout
-    except subprocess.CalledProcessError as e:
-        flash(f'Error reading share configuration: {e.stderr}', 'error')
+            share_config = read_privileged_file(share_file)
     except Exception as e:
         flash(f'Error reading share configuration: {str(e)}', 'error')
     
@@ -846,7 +854,7 @@ def view_logs(log_type):
     
     try:
         # Use sudo to read the log file
-        result = subprocess.run(['sudo', 'cat', log_file], capture_output=True, text=True, check=False)
+        result = run_privileged(['cat', log_file])
         
         if result.returncode != 0:
             if 'No such file or directory' in result.stderr:
@@ -886,12 +894,11 @@ def service_action(action):
             status = get_samba_status()
             return jsonify(status)
         elif action == 'enable':
-            subprocess.run(['sudo', 'systemctl', 'enable', 'smbd', 'nmbd'], 
-                          capture_output=True, text=True, check=False)
+            run_privileged(['systemctl', 'enable', 'smbd', 'nmbd'])
             flash('Samba services enabled to start on boot', 'success')
         else:
-            result = subprocess.run(['sudo', 'systemctl', action, 'smbd', 'nmbd'], 
-                                   capture_output=True, text=True, check=False)
+            result = run_privileged(['systemctl', action, 'smbd', 'nmbd'])
+            invalidate_service_status()
             
             if result.returncode != 0:
                 flash(f'Error {action} Samba services: {result.stderr}', 'error')
@@ -907,15 +914,16 @@ def service_action(action):
 @bp.route('/groups', methods=['GET'])
 @login_required
 def groups():
-    if not check_sudo_access():
+    has_sudo = check_sudo_access()
+    if not has_sudo:
         flash('Error: Sudo access is required to manage system groups', 'error')
         return redirect('/')
         
-    system_groups = list_system_groups()
+    system_groups = list_group_details()
     
     return render_template('groups.html', 
                           groups=system_groups,
-                          has_sudo=check_sudo_access())
+                          has_sudo=has_sudo)
 
 @bp.route('/groups/add', methods=['POST'])
 @login_required
@@ -931,8 +939,7 @@ def add_group():
         return redirect('/groups')
     
     # Check if the group already exists
-    existing_groups = list_system_groups()
-    if group_name in existing_groups:
+    if is_system_group(group_name):
         flash(f'Group {group_name} already exists', 'error')
         return redirect('/groups')
     
@@ -959,8 +966,7 @@ def delete_group(group_name):
         return redirect('/groups')
     
     # Check if the group exists
-    existing_groups = list_system_groups()
-    if group_name not in existing_groups:
+    if not is_system_group(group_name):
         flash(f'Group {group_name} does not exist', 'error')
         return redirect('/groups')
     
@@ -972,11 +978,7 @@ def delete_group(group_name):
     else:
         # Check if it's a primary group issue
         try:
-            import pwd
-            primary_users = []
-            for user in pwd.getpwall():
-                if user.pw_gid == grp.getgrnam(group_name).gr_gid:
-                    primary_users.append(user.pw_name)
+            primary_users = get_nss().primary_members(group_name)
             
             if primary_users:
                 flash(f'Failed to delete group {group_name}. It is the primary group for user(s): {", ".join(primary_users)}. Try changing their primary group first.', 'error')
@@ -1012,6 +1014,57 @@ def api_shares():
     
     return jsonify(shares_json)
 
+@bp.route('/api/shares/batch', methods=['POST'])
+@login_required
+def api_shares_batch():
+    """API endpoint to add, update and delete many shares with one write"""
+    if not check_sudo_access():
+        return jsonify({"error": "Sudo access required to modify shares"}), 403
+    
+    data = request.get_json(silent=True)
+    operations = data.get('operations') if isinstance(data, dict) else data
+    if not isinstance(operations, list) or not operations:
+        return jsonify({"error": "Expected a non-empty list of operations"}), 400
+    
+    atomic = isinstance(data, dict) and bool(data.get('atomic'))
+    wait = isinstance(data, dict) and bool(data.get('wait'))
+    success, results = apply_share_operations(operations, atomic=atomic, wait=wait)
+    
+    applied = sum(1 for result in results if result['status'] == 'ok')
+    if success:
+        status_code = 200
+    elif applied:
+        status_code = 207  # Some operations were applied
+    else:
+        status_code = 400
+    
+    return jsonify({"success": success, "applied": applied, "results": results}), status_code
+
+@bp.route('/api/shares/<name>/effective', methods=['GET'])
+@login_required
+def api_share_effective(name):
+    """API endpoint for the settings Samba actually applies to a share"""
+    if load_effective_config() is None:
+        return jsonify({"error": "Effective configuration is not available (testparm failed)"}), 503
+    
+    settings = get_effective_settings(name)
+    if settings is None:
+        return jsonify({"error": f"Share {name} not found"}), 404
+    return jsonify({"name": name, "parameters": settings})
+
+@bp.route('/api/effective-config', methods=['GET'])
+@login_required
+def api_effective_config():
+    """API endpoint for the effective global settings and share names"""
+    config = load_effective_config()
+    if config is None:
+        return jsonify({"error": "Effective configuration is not available (testparm failed)"}), 503
+    
+    return jsonify({
+        "global": get_effective_settings('global'),
+        "shares": [section.name for section in config.share_sections()]
+    })
+
 @bp.route('/api/status', methods=['GET'])
 @login_required
 def api_status():
@@ -1019,11 +1072,37 @@ def api_status():
     status = get_samba_status()
     return jsonify(status)
 
+@bp.route('/api/services', methods=['GET'])
+@login_required
+def api_services():
+    """API endpoint for detailed status of all Samba services"""
+    return jsonify(get_service_status())
+
+@bp.route('/api/reload-status', methods=['GET'])
+@login_required
+def api_reload_status():
+    """API endpoint for the state of the scheduled Samba reload"""
+    return jsonify(RELOAD_SCHEDULER.status())
+
+@bp.route('/api/admin/commands', methods=['GET', 'DELETE'])
+@login_required
+def api_command_stats():
+    """API endpoint for timings of the external commands run by the application"""
+    if not current_user.is_admin:
+        return jsonify({"error": "Administrator access required"}), 403
+    
+    if request.method == 'DELETE':
+        COMMAND_STATS.reset()
+    return jsonify({
+        'since': datetime.datetime.fromtimestamp(COMMAND_STATS.since).isoformat(timespec='seconds'),
+        'tools': COMMAND_STATS.snapshot()
+    })
+
 @bp.route('/api/connections', methods=['GET'])
 @login_required
 def api_connections():
     """API endpoint for active connections"""
-    if not check_sudo_access():
+    if not has_capability('signal_smbd'):
         return jsonify({"error": "Sudo access required to view connections"}), 403
         
     connections = get_active_connections()
@@ -1104,7 +1183,7 @@ def restore_backup_route(filename):
     success, message = restore_backup(backup_file)
     
     if success:
-        flash('Backup restored successfully', 'success')
+        flash('Backup restored successfully, Samba will reload its configuration shortly', 'success')
     else:
         flash(f'Failed to restore backup: {message}', 'error')
     
@@ -1143,17 +1222,18 @@ def delete_backup_route(filename):
 @login_required
 def connections():
     """View active Samba connections"""
-    if not check_sudo_access():
+    has_sudo = has_capability('signal_smbd')
+    if not has_sudo:
         flash('Error: Sudo access is required to view connections', 'error')
         return redirect('/')
     
-    return render_template('connections.html', has_sudo=check_sudo_access())
+    return render_template('connections.html', has_sudo=has_sudo)
 
 @bp.route('/api/connections/terminate/<pid>', methods=['POST'])
 @login_required
 def api_terminate_connection(pid):
     """API endpoint to terminate a connection by PID"""
-    if not check_sudo_access():
+    if not has_capability('signal_smbd'):
         return jsonify({"error": "Sudo access required to terminate connections"}), 403
     
     # Validate that PID is numeric
@@ -1176,7 +1256,7 @@ def api_terminate_connection(pid):
 @login_required
 def api_terminate_connection_by_machine(machine):
     """API endpoint to terminate all connections from a specific machine"""
-    if not check_sudo_access():
+    if not has_capability('signal_smbd'):
         return jsonify({"error": "Sudo access required to terminate connections"}), 403
     
     # Validate machine name
@@ -1222,8 +1302,8 @@ def enable_service():
         if DEV_MODE:
             flash('[DEV MODE] Would enable Samba services in production', 'info')
         else:
-            subprocess.run(['sudo', 'systemctl', 'enable', 'smbd'], check=True)
-            subprocess.run(['sudo', 'systemctl', 'enable', 'nmbd'], check=True)
+            run_privileged(['systemctl', 'enable', 'smbd'], check=True)
+            run_privileged(['systemctl', 'enable', 'nmbd'], check=True)
             flash('Samba services enabled to start on boot', 'success')
     except Exception as e:
         flash(f'Failed to enable Samba services: {str(e)}', 'error')
@@ -0,0 +1,665 @@
+"""Typed model of a Samba configuration.
+
+Every reader and writer in samba_utils goes through this module, so the
+configuration files are parsed exactly one way.  A parsed configuration is a
+SambaConfig holding Section objects with a case-insensitive name index; share
+sections can be turned into compact Share objects for the UI.
+"""
+
+import contextlib
+import io
+import os
+import threading
+
+# Sections that are never treated as user shares
+SPECIAL_SECTIONS = ('global', 'printers', 'print$')
+
+# Normalized share keys used throughout the UI, mapped to their Samba spelling
+SHARE_FIELDS = {
+    'path': 'path',
+    'comment': 'comment',
+    'browseable': 'browseable',
+    'read_only': 'read only',
+    'guest_ok': 'guest ok',
+    'valid_users': 'valid users',
+    'write_list': 'write list',
+    'create_mask': 'create mask',
+    'directory_mask': 'directory mask',
+    'force_group': 'force group',
+    'max_connections': 'max connections'
+}
+
+# Samba spelling (including aliases) mapped back to our normalized keys
+SAMBA_TO_FIELD = {samba_key: field for field, samba_key in SHARE_FIELDS.items()}
+SAMBA_TO_FIELD['browsable'] = 'browseable'  # Alternative spelling
+
+# Values applied when a share does not set the parameter itself
+SHARE_DEFAULTS = {
+    'path': '/tmp',
+    'comment': '',
+    'browseable': 'yes',
+    'read_only': 'no',
+    'guest_ok': 'no',
+    'valid_users': '',
+    'write_list': '',
+    'create_mask': '0775',
+    'directory_mask': '0775',
+    'force_group': 'smbusers',
+    'max_connections': '0'
+}
+
+# Fields that are always written first, even when empty
+REQUIRED_FIELDS = ('path', 'valid_users', 'write_list', 'create_mask', 'directory_mask')
+
+# Keys computed for the UI. Older versions leaked these (and the underscore
+# spelling of the share fields) into shares.conf; Samba ignores them, so they
+# are dropped when reading and never written back.
+DERIVED_FIELDS = ('valid_users_list', 'valid_groups_list', 'write_users_list', 'write_groups_list')
+LEGACY_KEYS = frozenset(DERIVED_FIELDS) | frozenset(
+    field for field, samba_key in SHARE_FIELDS.items() if field != samba_key)
+
+
+def normalize_key(key):
+    """Normalize a Samba parameter name (case and whitespace insensitive)"""
+    return ' '.join(key.lower().split())
+
+
+def parse_user_group_list(value):
+    """Parse a list of users and groups from a Samba config value.
+    Returns a tuple of (users_list, groups_list)."""
+    if not value:
+        return [], []
+
+    items = [item.strip() for item in value.split(',') if item.strip()]
+    users = [item for item in items if not item.startswith('@')]
+    groups = [item for item in items if item.startswith('@')]
+
+    return users, groups
+
+
+class Section:
+    """A single [section] of a Samba configuration"""
+
+    __slots__ = ('name', 'params', 'origins', 'source', 'lineno')
+
+    def __init__(self, name, params=None, source=None, lineno=0):
+        self.name = name
+        self.params = params if params is not None else {}
+        # (source file, line number) of every parameter read from a file
+        self.origins = {}
+        self.source = source
+        self.lineno = lineno
+
+    @property
+    def is_share(self):
+        return self.name.lower() not in SPECIAL_SECTIONS
+
+    def get(self, key, default=None):
+        return self.params.get(normalize_key(key), default)
+
+    def __contains__(self, key):
+        return normalize_key(key) in self.params
+
+    def set(self, key, value):
+        self.params[normalize_key(key)] = value
+
+    def remove(self, key):
+        self.params.pop(normalize_key(key), None)
+
+    def origin(self, key):
+        """Return (source file, line number) where a parameter was set"""
+        return self.origins.get(normalize_key(key), (None, 0))
+
+    def to_share(self):
+        return Share.from_section(self)
+
+    def render(self, indent='   '):
+        lines = [f'[{self.name}]']
+        lines.extend(f'{indent}{key} = {value}' for key, value in self.params.items())
+        return '\n'.join(lines) + '\n'
+
+    def __repr__(self):
+        return f'<Section [{self.name}] {len(self.params)} params>'
+
+
+class Share:
+    """A share section with its UI fields resolved.
+
+    Behaves like a read-only mapping of the normalized keys ('name', 'path',
+    'read_only', ...) so templates and routes can keep using share['path'] and
+    share.get('path'). Parameters without a UI field are kept in ``extra``
+    under their Samba spelling so they survive a round trip.
+    """
+
+    __slots__ = ('name',) + tuple(SHARE_FIELDS) + ('extra', 'source')
+
+    def __init__(self, name, source=None):
+        self.name = name
+        for field in SHARE_FIELDS:
+            setattr(self, field, None)
+        self.extra = {}
+        self.source = source
+
+    @classmethod
+    def from_section(cls, section):
+        share = cls(section.name, section.source)
+        share.update(section.params, samba_keys_only=True)
+        share.finalize()
+        return share
+
+    @classmethod
+    def from_mapping(cls, data):
+        """Build a share from a dict using normalized and/or Samba keys"""
+        share = cls(data['name'])
+        share.update((key, value) for key, value in data.items() if key != 'name')
+        share.finalize()
+        return share
+
+    def update(self, params, samba_keys_only=False):
+        """Apply parameters given with either normalized or Samba keys"""
+        items = params.items() if hasattr(params, 'items') else params
+        for key, value in items:
+            if key in SHARE_FIELDS and not samba_keys_only:
+                field = key
+            else:
+                samba_key = normalize_key(key)
+                field = SAMBA_TO_FIELD.get(samba_key)
+                if field is None:
+                    if key not in LEGACY_KEYS:
+                        self.extra[samba_key] = value
+                    continue
+            # An empty value never overrides one that was set explicitly
+            if value == '' and getattr(self, field):
+                continue
+            setattr(self, field, value)
+
+    def finalize(self):
+        """Fill defaults and make sure write_list users are also valid users"""
+        for field, value in SHARE_DEFAULTS.items():
+            if getattr(self, field) is None:
+                setattr(self, field, value)
+
+        if self.write_list:
+            if not self.valid_users:
+                self.valid_users = self.write_list
+            else:
+                valid = {u.strip() for u in self.valid_users.split(',') if u.strip()}
+                missing = [u.strip() for u in self.write_list.split(',')
+                           if u.strip() and u.strip() not in valid]
+                if missing:
+                    self.valid_users += ',' + ','.join(dict.fromkeys(missing))
+
+    # Lists used by the share editor
+
+    @property
+    def valid_users_list(self):
+        return parse_user_group_list(self.valid_users)[0]
+
+    @property
+    def valid_groups_list(self):
+        return parse_user_group_list(self.valid_users)[1]
+
+    @property
+    def write_users_list(self):
+        return parse_user_group_list(self.write_list)[0]
+
+    @property
+    def write_groups_list(self):
+        return parse_user_group_list(self.write_list)[1]
+
+    # Mapping protocol
+
+    def keys(self):
+        yield 'name'
+        for field in SHARE_FIELDS:
+            if getattr(self, field) is not None:
+                yield field
+        yield from self.extra
+
+    def items(self):
+        for key in self.keys():
+            yield key, self[key]
+
+    def __iter__(self):
+        return self.keys()
+
+    def __getitem__(self, key):
+        if key == 'name' or key in SHARE_FIELDS or key in DERIVED_FIELDS:
+            value = getattr(self, key)
+            if value is None:
+                raise KeyError(key)
+            return value
+        return self.extra[key]
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def samba_params(self):
+        """Yield (samba_key, value) pairs in the order they are written"""
+        for field in REQUIRED_FIELDS:
+            yield SHARE_FIELDS[field], getattr(self, field)
+        for field, samba_key in SHARE_FIELDS.items():
+            if field not in REQUIRED_FIELDS and getattr(self, field) is not None:
+                yield samba_key, getattr(self, field)
+        yield from self.extra.items()
+
+    def render(self, indent='   '):
+        lines = [f'[{self.name}]']
+        lines.extend(f'{indent}{key} = {value}' for key, value in self.samba_params())
+        return '\n'.join(lines) + '\n'
+
+    def __eq__(self, other):
+        if not isinstance(other, Share):
+            return NotImplemented
+        return self.name == other.name and list(self.samba_params()) == list(other.samba_params())
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f'<Share [{self.name}] path={self.path}>'
+
+
+class SambaConfig:
+    """An ordered collection of sections with a case-insensitive name index"""
+
+    __slots__ = ('sections', '_index', 'sources', 'includes')
+
+    def __init__(self, sections=()):
+        self.sections = []
+        self._index = {}
+        # Files read while parsing, in the order they were opened
+        self.sources = []
+        # Every include directive found, followed or not
+        self.includes = []
+        for section in sections:
+            self.add(section)
+
+    def add(self, section):
+        """Add a section; repeated section names are merged like Samba does"""
+        existing = self._index.get(section.name.lower())
+        if existing is not None:
+            existing.params.update(section.params)
+            existing.origins.update(section.origins)
+            return existing
+        self.sections.append(section)
+        self._index[section.name.lower()] = section
+        return section
+
+    def remove(self, name):
+        section = self._index.pop(name.lower(), None)
+        if section is not None:
+            self.sections.remove(section)
+        return section
+
+    def get(self, name):
+        return self._index.get(name.lower())
+
+    def __contains__(self, name):
+        return name.lower() in self._index
+
+    def __iter__(self):
+        return iter(self.sections)
+
+    def __len__(self):
+        return len(self.sections)
+
+    @property
+    def global_section(self):
+        return self.get('global')
+
+    def share_sections(self):
+        return [section for section in self.sections if section.is_share]
+
+    def shares(self):
+        return [section.to_share() for section in self.sections if section.is_share]
+
+    def merge(self, other):
+        for section in other:
+            self.add(section)
+        self.sources.extend(other.sources)
+        self.includes.extend(other.includes)
+        return self
+
+    def has_source(self, path):
+        real = os.path.realpath(path)
+        return any(os.path.realpath(source) == real for source in self.sources)
+
+    def include_paths(self):
+        return [include.path for include in self.includes]
+
+    def dynamic_includes(self):
+        """Includes using substitutions such as %m or %U, which are not expanded"""
+        return [include for include in self.includes if include.status == Include.DYNAMIC]
+
+    def dependencies(self):
+        """Files whose change (or creation) can change this configuration"""
+        paths = list(self.sources)
+        paths.extend(include.path for include in self.includes
+                     if include.status == Include.MISSING)
+        return paths
+
+    def to_dict(self):
+        return {section.name: dict(section.params) for section in self.sections}
+
+    def render(self, header='', indent='   '):
+        return header + '\n'.join(section.render(indent) for section in self.sections)
+
+
+class Include:
+    """An include directive and what happened when it was processed"""
+
+    LOADED = 'loaded'
+    DYNAMIC = 'dynamic'
+    MISSING = 'missing'
+    UNREADABLE = 'unreadable'
+    CYCLE = 'cycle'
+    TOO_DEEP = 'too deep'
+    NOT_FOLLOWED = 'not followed'
+
+    __slots__ = ('path', 'source', 'lineno', 'status')
+
+    def __init__(self, path, source=None, lineno=0, status=NOT_FOLLOWED):
+        self.path = path
+        self.source = source
+        self.lineno = lineno
+        self.status = status
+
+    def __repr__(self):
+        return f'<Include {self.path} ({self.status}) at {self.source}:{self.lineno}>'
+
+
+def logical_lines(lines):
+    """Yield (line number, line) for every non-comment line.
+    Lines ending with a backslash are joined with the following line, and
+    the reported line number is the one where the logical line starts."""
+    pending = None
+    start = 0
+    for lineno, line in enumerate(lines, 1):
+        line = line.strip()
+        if pending is not None:
+            line = pending + line
+            pending = None
+        else:
+            # Skip empty lines and comments
+            if not line or line[0] in '#;':
+                continue
+            start = lineno
+
+        if line.endswith('\\'):
+            pending = line[:-1]
+            continue
+        yield start, line
+
+    if pending is not None:
+        yield start, pending
+
+
+class ConfigParser:
+    """Streaming Samba configuration parser.
+
+    Files are read line by line, so memory use is bounded by the size of the
+    resulting model rather than the size of the input. Include directives are
+    followed in place like Samba does; includes using substitutions (%m, %U,
+    ...) depend on the connecting client and are recorded but not expanded.
+    """
+
+    MAX_INCLUDE_DEPTH = 16
+
+    def __init__(self, follow_includes=True, opener=None):
+        self.follow_includes = follow_includes
+        self.opener = opener or (lambda path: open(path, 'r'))
+        self.config = SambaConfig()
+        self._current = None
+        self._active = []
+
+    def parse_file(self, path):
+        with self.opener(path) as f:
+            self._parse_stream(f, path, 0)
+        return self.config
+
+    def parse_lines(self, lines, source=None):
+        self._parse_stream(lines, source, 0)
+        return self.config
+
+    def _parse_stream(self, lines, source, depth):
+        if source is not None:
+            self.config.sources.append(source)
+            self._active.append(os.path.realpath(source))
+        try:
+            for lineno, line in logical_lines(lines):
+                if line[0] == '[' and line[-1] == ']':
+                    section = Section(line[1:-1].strip(), source=source, lineno=lineno)
+                    self._current = self.config.add(section)
+                elif self._current is not None and '=' in line:
+                    key, value = line.split('=', 1)
+                    key = normalize_key(key)
+                    value = value.strip()
+                    self._current.params[key] = value
+                    self._current.origins[key] = (source, lineno)
+                    if key == 'include':
+                        self._include(value, source, lineno, depth)
+        finally:
+            if source is not None:
+                self._active.pop()
+
+    def _include(self, path, source, lineno, depth):
+        include = Include(path, source, lineno)
+        self.config.includes.append(include)
+
+        if not self.follow_includes:
+            return
+        if '%' in path:
+            include.status = Include.DYNAMIC
+            return
+        if os.path.realpath(path) in self._active:
+            include.status = Include.CYCLE
+            return
+        if depth >= self.MAX_INCLUDE_DEPTH:
+            include.status = Include.TOO_DEEP
+            return
+
+        try:
+            f = self.opener(path)
+        except FileNotFoundError:
+            include.status = Include.MISSING
+            return
+        except OSError:
+            include.status = Include.UNREADABLE
+            return
+
+        include.status = Include.LOADED
+        with f:
+            self._parse_stream(f, path, depth + 1)
+
+
+def parse_lines(lines, source=None):
+    """Parse an iterable of configuration lines into a SambaConfig.
+    Include directives are recorded but not followed."""
+    return ConfigParser(follow_includes=False).parse_lines(lines, source)
+
+
+def parse_config(content, source=None):
+    """Parse Samba configuration text into a SambaConfig"""
+    return parse_lines(io.StringIO(content), source)
+
+
+def load_config_file(path, follow_includes=True, opener=None):
+    """Parse a configuration file from disk, following its includes"""
+    return ConfigParser(follow_includes, opener).parse_file(path)
+
+
+def section_spans(text):
+    """Return (name, start, end) character ranges of every section in text.
+    A section runs from its header line up to the next header line."""
+    spans = []
+    name = None
+    start = pos = 0
+    continued = False
+    for line in text.splitlines(keepends=True):
+        stripped = line.strip()
+        if not continued and stripped[:1] == '[' and stripped[-1:] == ']':
+            if name is not None:
+                spans.append((name, start, pos))
+            name = stripped[1:-1].strip()
+            start = pos
+        continued = stripped.endswith('\\') and stripped[:1] not in ('#', ';')
+        pos += len(line)
+    if name is not None:
+        spans.append((name, start, pos))
+    return spans
+
+
+def _split_tail(block):
+    """Split a section's text into its body and the trailing blank and
+    comment lines, which usually introduce whatever follows"""
+    lines = block.splitlines(keepends=True)
+    cut = len(lines)
+    while cut > 1 and (not lines[cut - 1].strip() or lines[cut - 1].lstrip()[:1] in ('#', ';')):
+        cut -= 1
+    return ''.join(lines[:cut]), ''.join(lines[cut:])
+
+
+def patch_sections(text, changes):
+    """Apply share changes to configuration text, touching only the sections
+    that actually change.
+
+    changes maps share names to a Share, or to None to delete the share.
+    Untouched sections are preserved byte for byte and new shares are appended.
+    Returns the new text, or None when the result would be identical.
+    """
+    pending = {name.lower(): share for name, share in changes.items()}
+    seen = set()
+    pieces = []
+    last = 0
+    changed = False
+
+    for name, start, end in section_spans(text):
+        key = name.lower()
+        if key not in pending:
+            continue
+        share = pending[key]
+        block = text[start:end]
+        body, tail = _split_tail(block)
+
+        if key in seen:
+            # Samba merges repeated sections; the replacement written for the
+            # first occurrence already holds the complete share
+            replacement = tail if tail.strip() else ''
+        elif share is None:
+            seen.add(key)
+            replacement = tail if tail.strip() else ''
+        else:
+            seen.add(key)
+            current = parse_config(body).sections[0].to_share()
+            if current == share:
+                continue
+            replacement = share.render() + (tail or '\n')
+
+        pieces.append(text[last:start])
+        pieces.append(replacement)
+        last = end
+        changed = True
+
+    pieces.append(text[last:])
+    result = ''.join(pieces)
+
+    additions = [share.render() + '\n' for key, share in pending.items()
+                 if key not in seen and share is not None]
+    if additions:
+        # Keep one blank line between the existing content and new shares
+        if result and not result.endswith('\n\n'):
+            result += '\n' if result.endswith('\n') else '\n\n'
+        result += ''.join(additions)
+        changed = True
+
+    return result if changed else None
+
+
+def file_key(path):
+    """Identity of a file's current content: (path, inode, mtime_ns, size)"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return (path, None, None, None)
+    return (path, st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class ConfigCache:
+    """Process-wide cache of values derived from configuration files.
+
+    Each entry remembers the file_key() of every file it was built from. A
+    lookup costs one stat per file; the value is rebuilt only when one of
+    those files changed or the cache was invalidated after a write.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+        # Context manager factories entered around every loader call with
+        # the entry name, e.g. to time how long parsing takes
+        self.load_hooks = []
+
+    def get(self, name, paths, loader, depends_on=None):
+        """Return the cached value for name, calling loader() on a miss.
+
+        paths are the files the value is always built from. depends_on, if
+        given, is called with a freshly loaded value and returns further files
+        discovered while loading it (such as included files).
+        """
+        with self._lock:
+            entry = self._entries.get(name)
+        if entry is not None:
+            entry_paths, entry_keys, value = entry
+            if tuple(file_key(path) for path in entry_paths) == entry_keys:
+                with self._lock:
+                    self.hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+
+        # Keys are taken before loading, so a concurrent change is picked up
+        # by the next lookup rather than hidden behind a newer key
+        paths = list(paths)
+        keys = [file_key(path) for path in paths]
+        with contextlib.ExitStack() as stack:
+            for hook in self.load_hooks:
+                stack.enter_context(hook(name))
+            value = loader()
+        if depends_on is not None:
+            for path in depends_on(value):
+                if path not in paths:
+                    paths.append(path)
+                    keys.append(file_key(path))
+        with self._lock:
+            self._entries[name] = (tuple(paths), tuple(keys), value)
+        return value
+
+    def invalidate(self, name=None):
+        with self._lock:
+            if name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(name, None)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
+
+
+CONFIG_CACHE = ConfigCache()
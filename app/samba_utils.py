@@ -1,3 +1,5 @@
+import io
+import logging
 import os
 import re
 import subprocess
@@ -5,8 +7,29 @@ import shlex
 import grp
 import pwd
 import tempfile
+import threading
+import time
+import atexit
+import hashlib
+import signal
+from collections import OrderedDict
 from pathlib import Path
 
+from .samba_config import (
+    CONFIG_CACHE, SambaConfig, Section, Share, file_key, load_config_file, parse_config,
+    patch_sections
+)
+from .backends import BACKEND_NAME, SIMULATED_DIR, get_backend, human_size
+from .executor import execute
+from .nss import get_nss, invalidate_nss
+from .passdb import PassdbFormatError, parse_smbpasswd, parse_tdbsam
+from .privileged_helper import (
+    ALLOWED_TOOLS as HELPER_TOOLS, DEFAULT_SOCKET as DEFAULT_HELPER_SOCKET,
+    HelperClient, HelperError, HelperUnavailable, atomic_write_file
+)
+
+logger = logging.getLogger(__name__)
+
 # Use local configuration files for development
 DEV_MODE = os.environ.get('SAMBA_MANAGER_DEV_MODE', '0') == '1'  # Set by environment variable
 
@@ -19,67 +42,28 @@ else:
     SHARE_CONF = '/etc/samba/shares.conf'
     ACTUAL_SMB_CONF = SMB_CONF
 
+# The simulated backend (see backends.py) keeps its configuration in its own
+# directory and runs no Samba tools, so it always works like development mode
+if BACKEND_NAME == 'simulated':
+    DEV_MODE = True
+    SMB_CONF = os.path.join(SIMULATED_DIR, 'smb.conf')
+    SHARE_CONF = os.path.join(SIMULATED_DIR, 'shares.conf')
+    ACTUAL_SMB_CONF = SMB_CONF
+
 def parse_share_section(content):
     """Parse share sections from a Samba configuration file content"""
     shares = []
-    lines = content.split('\n')
-    
-    print(f"Parsing content with {len(lines)} lines")
-    
-    current_share = None
-    for line_num, line in enumerate(lines):
-        line = line.strip()
-        if not line or line.startswith('#') or line.startswith(';'):
-            continue
-            
-        # Check for share section
-        if line.startswith('[') and line.endswith(']') and not line == '[global]' and not line == '[printers]' and not line == '[print$]':
-            if current_share:
-                shares.append(current_share)
-                print(f"Added share: {current_share['name']}")
-            share_name = line[1:-1]
-            print(f"Found share section at line {line_num+1}: {share_name}")
-            current_share = {'name': share_name}
-        # Check for parameters within a share
-        elif current_share and '=' in line:
-            key, value = [x.strip() for x in line.split('=', 1)]
-            current_share[key] = value
-            print(f"  Parameter: {key} = {value}")
-            
-    # Add the last share if exists
-    if current_share:
-        shares.append(current_share)
-        print(f"Added final share: {current_share['name']}")
-        
-    print(f"Parsed {len(shares)} shares from content")
+    for section in parse_config(content).share_sections():
+        share = {'name': section.name}
+        share.update(section.params)
+        shares.append(share)
+
+    logger.debug("Parsed %s shares from content", len(shares))
     return shares
 
 def parse_config_content(content):
     """Parse Samba configuration content into sections"""
-    sections = {}
-    current_section = None
-    
-    for line in content.split('\n'):
-        line = line.strip()
-        
-        # Skip empty lines and comments
-        if not line or line.startswith('#') or line.startswith(';'):
-            continue
-        
-        # Check for section headers
-        if line.startswith('[') and line.endswith(']'):
-            section_name = line[1:-1].strip()
-            current_section = {}
-            sections[section_name] = current_section
-        
-        # Check for parameters
-        elif '=' in line and current_section is not None:
-            parts = line.split('=', 1)
-            param_name = parts[0].strip()
-            param_value = parts[1].strip()
-            current_section[param_name] = param_value
-    
-    return sections
+    return parse_config(content).to_dict()
 
 # Function to auto-detect share directories
 def detect_share_directories():
@@ -110,7 +94,7 @@ def detect_share_directories():
                     if os.path.exists(share['path']):
                         share_dirs[share['name']] = share['path']
         except Exception as e:
-            print(f"Error reading Samba config: {e}")
+            logger.error("Error reading Samba config: %s", e)
     
     # Check common locations for potential shares
     for location in potential_locations:
@@ -129,7 +113,7 @@ def detect_share_directories():
                         if item not in share_dirs:
                             share_dirs[item] = full_path
             except Exception as e:
-                print(f"Error checking location {location}: {e}")
+                logger.error("Error checking location %s: %s", location, e)
     
     # Add some default shares if none found
     if not share_dirs:
@@ -143,212 +127,650 @@ def detect_share_directories():
 # Get auto-detected share directories
 SHARE_DIRS = detect_share_directories()
 
-def check_sudo_access():
-    """Check if the application has sudo access to manage Samba"""
+# Privileged helper daemon (see privileged_helper.py). When it is not running
+# privileged operations use sudo, and the socket is looked for again after
+# HELPER_RETRY seconds.
+HELPER_SOCKET = os.environ.get('SAMBA_MANAGER_HELPER_SOCKET', DEFAULT_HELPER_SOCKET)
+HELPER_RETRY = 30
+_helper = None
+_helper_checked = None
+
+def get_helper():
+    """Return a client for the privileged helper, or None if it is not running"""
+    global _helper, _helper_checked
     if DEV_MODE:
-        return True  # In development mode, we don't need sudo
+        return None
+    if _helper is not None:
+        return _helper
+    
+    now = time.monotonic()
+    if _helper_checked is not None and now - _helper_checked < HELPER_RETRY:
+        return None
+    _helper_checked = now
+    if not os.path.exists(HELPER_SOCKET):
+        return None
+    
+    client = HelperClient(HELPER_SOCKET)
+    try:
+        client.ping()
+    except Exception as e:
+        logger.info("Privileged helper at %s is not answering: %s", HELPER_SOCKET, e)
+        return None
+    logger.info("Using privileged helper at %s", HELPER_SOCKET)
+    _helper = client
+    return client
+
+def _helper_failed(e):
+    """Stop using the helper after a connection failure, until it is back"""
+    global _helper, _helper_checked
+    logger.warning("Privileged helper unavailable, falling back to sudo: %s", e)
+    _helper = None
+    _helper_checked = time.monotonic()
+    invalidate_capabilities()
+
+# What the application is allowed to do, probed at most once per
+# PRIVILEGE_TTL seconds instead of forking `sudo -n true` for every check.
+# A privileged operation failing for lack of privileges drops the cached
+# result, so the next check probes again.
+PRIVILEGE_TTL = float(os.environ.get('SAMBA_MANAGER_PRIVILEGE_TTL', '60'))
+CAPABILITIES = ('sudo', 'read_config', 'manage_users', 'signal_smbd')
+_capabilities = None
+_capabilities_expire = 0
+_capabilities_lock = threading.Lock()
+
+def get_capabilities():
+    """Return a dict telling which privileged operations are available:
+    
+    sudo          full administrative access (sudo without a password, or root)
+    read_config   reading root-only Samba files
+    manage_users  creating and changing system and Samba users
+    signal_smbd   running Samba tools and signalling Samba processes"""
+    global _capabilities, _capabilities_expire
+    with _capabilities_lock:
+        if _capabilities is not None and time.monotonic() < _capabilities_expire:
+            return _capabilities
+        
+        capabilities = _probe_capabilities()
+        logger.debug("Privilege capabilities: %s", capabilities)
+        _capabilities = capabilities
+        _capabilities_expire = time.monotonic() + PRIVILEGE_TTL
+        return capabilities
+
+def _probe_capabilities():
+    if DEV_MODE or os.geteuid() == 0:
+        # In development mode, we don't need sudo
+        return dict.fromkeys(CAPABILITIES, True)
+    
     try:
-        result = subprocess.run(['sudo', '-n', 'true'], capture_output=True)
-        return result.returncode == 0
+        result = execute(['sudo', '-n', 'true'], text=False)
+        sudo = result.returncode == 0
     except Exception:
-        return False
+        sudo = False
+    helper = get_helper() is not None
+    return {
+        'sudo': sudo,
+        'read_config': sudo or helper or os.access(SMB_CONF, os.R_OK),
+        'manage_users': sudo,
+        'signal_smbd': sudo or helper,
+    }
+
+def has_capability(name):
+    return get_capabilities().get(name, False)
+
+def invalidate_capabilities():
+    """Forget the probed capabilities, e.g. after a privileged operation failed"""
+    global _capabilities
+    with _capabilities_lock:
+        _capabilities = None
+
+def check_sudo_access():
+    """Check if the application has sudo access to manage Samba"""
+    return has_capability('sudo')
+
+def _sudo_refused(stderr):
+    """Whether sudo itself refused to run a command (rather than the command failing)"""
+    if isinstance(stderr, bytes):
+        stderr = stderr.decode(errors='replace')
+    return bool(stderr) and stderr.lstrip().startswith('sudo:')
+
+def _completed(args, returncode=0, stdout='', stderr=''):
+    return subprocess.CompletedProcess(['sudo'] + list(args), returncode, stdout, stderr)
+
+def _run_with_helper(helper, args, input=None, timeout=None):
+    """Run the equivalent of `sudo args` through the helper. Returns a
+    CompletedProcess, or None when the helper cannot run this command."""
+    tool, rest = args[0], list(args[1:])
+    flags = [arg for arg in rest if arg.startswith('-')]
+    operands = [arg for arg in rest if not arg.startswith('-')]
+    
+    if tool in HELPER_TOOLS:
+        return helper.run_allowed_tool(args, input=input, timeout=timeout)
+    
+    if tool == 'cat' and not flags and len(operands) == 1:
+        return _completed(args, stdout=helper.read_file(operands[0]).decode('utf-8', 'replace'))
+    
+    if tool == 'test' and len(flags) == 1 and flags[0] in ('-e', '-d', '-r', '-w') and len(operands) == 1:
+        st = helper.stat(operands[0])
+        ok = st is not None and {'-e': True, '-d': st['is_dir'],
+                                 '-r': st['readable'], '-w': st['writable']}[flags[0]]
+        return _completed(args, returncode=0 if ok else 1)
+    
+    if tool == 'mkdir' and flags in ([], ['-p']) and len(operands) == 1:
+        helper.mkdir(operands[0], parents=bool(flags))
+        return _completed(args)
+    
+    if tool == 'chown' and flags in ([], ['-R']) and len(operands) == 2:
+        user, _, group = operands[0].partition(':')
+        helper.chown(operands[1], user or None, group or None, recursive=bool(flags))
+        return _completed(args)
+    
+    if tool == 'chmod' and flags in ([], ['-R']) and len(operands) == 2 and operands[0].isdigit():
+        helper.chmod(operands[1], operands[0], recursive=bool(flags))
+        return _completed(args)
+    
+    if tool == 'kill' and len(flags) <= 1 and len(operands) == 1:
+        sig = getattr(signal, 'SIG' + flags[0][1:], None) if flags else signal.SIGTERM
+        if not isinstance(sig, signal.Signals):
+            return None
+        comm = helper.signal(operands[0], sig)
+        return _completed(args, returncode=0 if comm else 1)
+    
+    if tool == 'ps' and rest[:1] == ['-p'] and len(rest) >= 2 and rest[2:] in ([], ['-o', 'comm=']):
+        pid = rest[1]
+        comm = helper.signal(pid, 0)
+        if not comm:
+            return _completed(args, returncode=1)
+        return _completed(args, stdout=f"{comm}\n" if rest[2:] else f"{pid} {comm}\n")
+    
+    if tool == 'cp' and flags in ([], ['-f']) and len(operands) == 2:
+        source, dest = operands
+        try:
+            with open(source, 'rb') as f:
+                data = f.read()
+        except PermissionError:
+            data = helper.read_file(source)
+        helper.atomic_write(dest, data)
+        return _completed(args)
+    
+    return None
+
+def run_privileged(args, input=None, check=False, timeout=None):
+    """Run a command as root, like execute(['sudo', '-n'] + args).
+    
+    File, process and Samba tool operations go through the privileged helper
+    when it is running; anything it does not offer or refuses uses sudo,
+    which fails instead of prompting when it needs a password."""
+    return execute(['sudo', '-n'] + list(args), input=input, check=check, timeout=timeout,
+                   runner=_run_privileged)
+
+def _run_privileged(argv, input, timeout, text, env):
+    args = argv[2:]
+    helper = get_helper()
+    if helper is not None:
+        try:
+            result = _run_with_helper(helper, args, input=input, timeout=timeout)
+        except HelperUnavailable as e:
+            _helper_failed(e)
+            result = None
+        except PermissionError as e:
+            logger.debug("Helper did not run %s, using sudo: %s", args[0], e)
+            result = None
+        except (OSError, HelperError, ValueError) as e:
+            result = _completed(args, returncode=1, stderr=str(e))
+        
+        if result is not None:
+            return result
+    
+    result = subprocess.run(argv, input=input, capture_output=True, text=text,
+                            timeout=timeout, env=env, check=False)
+    if result.returncode != 0 and _sudo_refused(result.stderr):
+        invalidate_capabilities()
+    return result
 
 def run_command(cmd, input_str=None):
     """Run a shell command and return the result"""
     try:
-        if input_str:
-            result = subprocess.run(
-                cmd, 
-                input=input_str.encode(), 
-                capture_output=True, 
-                text=True, 
-                check=True
-            )
+        if cmd and cmd[0] == 'sudo':
+            result = run_privileged(cmd[1:], input=input_str, check=True)
         else:
-            result = subprocess.run(
-                cmd, 
-                capture_output=True, 
-                text=True, 
-                check=True
-            )
+            result = execute(cmd, input=input_str, check=True)
         return True, result.stdout
     except subprocess.CalledProcessError as e:
         return False, e.stderr
     except Exception as e:
         return False, str(e)
 
+# Global parameters that smbd and nmbd only read at startup. Changing one of
+# them needs a full restart; anything else is applied by a reload.
+RESTART_REQUIRED_PARAMS = ('interfaces', 'bind interfaces only', 'smb ports', 'disable netbios')
+
+# Values of RESTART_REQUIRED_PARAMS the running daemons were started with
+_service_params = None
+
+def service_params(config):
+    """Return the restart-only global parameters of a configuration"""
+    global_section = config.global_section
+    if global_section is None:
+        return {}
+    return {param: ' '.join((global_section.get(param) or '').lower().split())
+            for param in RESTART_REQUIRED_PARAMS}
+
+def _services_started_at():
+    """When the earliest of the running smbd and nmbd started (epoch seconds),
+    or None when that is not known"""
+    services = get_service_status()
+    uptimes = [services.get(unit, {}).get('uptime') for unit in ('smbd', 'nmbd')
+               if services.get(unit, {}).get('state') == 'active']
+    if not uptimes or None in uptimes:
+        return None
+    return time.time() - max(uptimes)
+
+def remember_service_params():
+    """Record the restart-only parameters the running daemons use, unless
+    already known. Call this before rewriting the main configuration file so a
+    later reload can tell whether those parameters changed.
+    
+    The configuration on disk is only what the daemons run with when none of
+    its files changed after they started; otherwise the baseline stays
+    unknown and the next reload restarts the services."""
+    global _service_params
+    if _service_params is None:
+        try:
+            config = load_samba_config()
+            started = _services_started_at()
+            if started is None:
+                logger.debug("Samba start time unknown, not recording restart-only parameters")
+                return
+            for path in config.sources:
+                if os.path.getmtime(path) > started:
+                    logger.debug("%s changed after Samba started, not recording restart-only parameters", path)
+                    return
+            _service_params = service_params(config)
+        except Exception as e:
+            logger.debug("Could not read restart-only parameters: %s", e)
+
+def reload_samba_service():
+    """Apply configuration changes without disconnecting clients.
+    
+    Tries `smbcontrol all reload-config` and then `systemctl reload`. Falls
+    back to a full restart when a parameter in RESTART_REQUIRED_PARAMS changed,
+    when the values the daemons run with are not known, or when neither reload
+    method works."""
+    global _service_params
+    try:
+        current = service_params(load_samba_config())
+    except Exception as e:
+        logger.warning("Could not read configuration before reload: %s", e)
+        current = None
+    
+    remember_service_params()
+    if _service_params is None:
+        logger.info("Restarting Samba services, the restart-only parameters they run with are not known")
+        return restart_samba_service()
+    if current is not None and current != _service_params:
+        changed = [param for param in RESTART_REQUIRED_PARAMS
+                   if current.get(param) != _service_params.get(param)]
+        logger.info("Restarting Samba services, changed parameters require it: %s", ', '.join(changed))
+        return restart_samba_service()
+    
+    if get_backend().reload_config():
+        if current is not None:
+            _service_params = current
+        return True
+    
+    logger.info("Reloading Samba configuration failed, restarting services instead")
+    return restart_samba_service()
+
 def restart_samba_service():
     """Restart Samba service with proper error handling"""
+    global _service_params
+    restarted = get_backend().restart_services()
+    invalidate_service_status()
+    if restarted:
+        # The daemons now run with whatever the files currently say
+        try:
+            _service_params = service_params(load_samba_config())
+        except Exception as e:
+            _service_params = None
+            logger.debug("Could not read restart-only parameters: %s", e)
+        return True
+    return False
+
+def _system_testparm(path=None, verbose=False):
+    args = ['testparm', '-s'] + (['-v'] if verbose else []) + ([path] if path else [])
+    if DEV_MODE and path:
+        # Local development copies are readable without sudo
+        return execute(args)
+    return run_privileged(args)
+
+def _system_reload_config():
+    reload_cmds = [
+        ['smbcontrol', 'all', 'reload-config'],
+        ['systemctl', 'reload', 'smbd.service', 'nmbd.service'],
+    ]
+    for cmd in reload_cmds:
+        try:
+            result = run_privileged(cmd)
+        except Exception as e:
+            logger.info("%s failed: %s", cmd[0], e)
+            continue
+        if result.returncode == 0:
+            logger.info("Reloaded Samba configuration with %s", cmd[0])
+            return True
+        logger.info("%s failed: %s", cmd[0], result.stderr.strip())
+    return False
+
+def _system_restart_services():
     try:
         # First try systemctl
-        print("Attempting to restart Samba services with systemctl")
-        systemctl_cmd = ['sudo', 'systemctl', 'restart', 'smbd.service', 'nmbd.service']
-        result = subprocess.run(systemctl_cmd, capture_output=True, text=True, check=False)
+        logger.info("Attempting to restart Samba services with systemctl")
+        systemctl_cmd = ['systemctl', 'restart', 'smbd.service', 'nmbd.service']
+        result = run_privileged(systemctl_cmd)
         
         if result.returncode == 0:
-            print("Successfully restarted Samba services with systemctl")
+            logger.info("Successfully restarted Samba services with systemctl")
             return True
         
         # If systemctl fails, try service command
-        print("systemctl failed, trying service command")
-        service_cmd1 = ['sudo', 'service', 'smbd', 'restart']
-        service_cmd2 = ['sudo', 'service', 'nmbd', 'restart']
+        logger.info("systemctl failed, trying service command")
+        service_cmd1 = ['service', 'smbd', 'restart']
+        service_cmd2 = ['service', 'nmbd', 'restart']
         
-        result1 = subprocess.run(service_cmd1, capture_output=True, text=True, check=False)
-        result2 = subprocess.run(service_cmd2, capture_output=True, text=True, check=False)
+        result1 = run_privileged(service_cmd1)
+        result2 = run_privileged(service_cmd2)
         
         if result1.returncode == 0 and result2.returncode == 0:
-            print("Successfully restarted Samba services with service command")
+            logger.info("Successfully restarted Samba services with service command")
             return True
         
         # If both methods fail, try init.d scripts
-        print("service command failed, trying init.d scripts")
-        init_cmd1 = ['sudo', '/etc/init.d/smbd', 'restart']
-        init_cmd2 = ['sudo', '/etc/init.d/nmbd', 'restart']
+        logger.info("service command failed, trying init.d scripts")
+        init_cmd1 = ['/etc/init.d/smbd', 'restart']
+        init_cmd2 = ['/etc/init.d/nmbd', 'restart']
         
-        result1 = subprocess.run(init_cmd1, capture_output=True, text=True, check=False)
-        result2 = subprocess.run(init_cmd2, capture_output=True, text=True, check=False)
+        result1 = run_privileged(init_cmd1)
+        result2 = run_privileged(init_cmd2)
         
         if result1.returncode == 0 and result2.returncode == 0:
-            print("Successfully restarted Samba services with init.d scripts")
+            logger.info("Successfully restarted Samba services with init.d scripts")
             return True
         
-        print("All methods to restart Samba services failed")
+        logger.error("All methods to restart Samba services failed")
         return False
     except Exception as e:
-        print(f"Error restarting Samba service: {e}")
+        logger.error("Error restarting Samba service: %s", e)
         return False
 
+# Samba units reported on the status pages and their process names
+SERVICE_UNITS = OrderedDict([
+    ('smbd', 'smbd'),
+    ('nmbd', 'nmbd'),
+    ('winbind', 'winbindd'),
+    ('samba-ad-dc', 'samba'),
+])
+SERVICE_PROPERTIES = ('Id', 'LoadState', 'ActiveState', 'SubState', 'MainPID',
+                      'ActiveEnterTimestampMonotonic', 'MemoryCurrent', 'TasksCurrent')
+SERVICE_STATUS_TTL = float(os.environ.get('SAMBA_MANAGER_STATUS_TTL', '5'))
+_service_status = None
+_service_status_expire = 0
+_service_status_lock = threading.Lock()
+
 def get_samba_status():
     """Get the status of the Samba service"""
+    services = get_service_status()
+    return {
+        'smbd': services['smbd']['state'],
+        'nmbd': services['nmbd']['state']
+    }
+
+def get_service_status():
+    """Return a dict per Samba unit (see SERVICE_UNITS) with its state, main
+    PID, uptime in seconds, memory in bytes and task count. Values that are
+    not known are None.
+    
+    All units are queried with a single systemctl call, or from /proc when
+    systemd is not available, and the result is reused for SERVICE_STATUS_TTL
+    seconds."""
+    global _service_status, _service_status_expire
+    with _service_status_lock:
+        if _service_status is not None and time.monotonic() < _service_status_expire:
+            return _service_status
+        
+        services = get_backend().service_status()
+        _service_status = services
+        _service_status_expire = time.monotonic() + SERVICE_STATUS_TTL
+        return services
+
+def _system_service_status():
     if DEV_MODE:
-        return {'smbd': 'active (dev)', 'nmbd': 'active (dev)'}
+        return {unit: _service_entry('active (dev)') for unit in SERVICE_UNITS}
+    services = _systemd_service_status()
+    if services is None:
+        services = _proc_service_status()
+    return services
+
+def invalidate_service_status():
+    """Forget the cached service status, e.g. after starting or stopping a service"""
+    global _service_status
+    with _service_status_lock:
+        _service_status = None
+
+def _service_entry(state, sub_state=None, main_pid=None, uptime=None, memory=None, tasks=None):
+    return {
+        'state': state,
+        'sub_state': sub_state,
+        'main_pid': main_pid,
+        'uptime': uptime,
+        'memory': memory,
+        'tasks': tasks
+    }
+
+def _systemd_number(value):
+    # systemd prints "[not set]" or UINT64_MAX for values it does not track
     try:
-        smbd = subprocess.run(['systemctl', 'is-active', 'smbd'], capture_output=True, text=True)
-        nmbd = subprocess.run(['systemctl', 'is-active', 'nmbd'], capture_output=True, text=True)
-        return {
-            'smbd': smbd.stdout.strip(),
-            'nmbd': nmbd.stdout.strip()
-        }
-    except Exception:
-        return {'smbd': 'unknown', 'nmbd': 'unknown'}
+        number = int(value)
+    except (TypeError, ValueError):
+        return None
+    if number < 0 or number >= 2 ** 64 - 1:
+        return None
+    return number
 
-def read_global_settings():
+def _systemd_service_status():
+    units = [f'{unit}.service' for unit in SERVICE_UNITS]
     try:
-        # Try to read from the system configuration file first
-        system_conf = '/etc/samba/smb.conf'
-        data = ""
-        
-        # Check if we can read the system config
+        result = execute(['systemctl', 'show', '--property=' + ','.join(SERVICE_PROPERTIES)] + units)
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.debug("systemctl show failed: %s", e)
+        return None
+    if result.returncode != 0:
+        logger.debug("systemctl show failed: %s", result.stderr.strip())
+        return None
+    
+    # One block of Key=Value lines per unit, separated by blank lines
+    blocks = {}
+    for block in result.stdout.split('\n\n'):
+        properties = dict(line.split('=', 1) for line in block.splitlines() if '=' in line)
+        if 'Id' in properties:
+            blocks[properties['Id']] = properties
+    
+    now = time.monotonic()
+    services = {}
+    for unit in SERVICE_UNITS:
+        properties = blocks.get(f'{unit}.service')
+        if properties is None or properties.get('LoadState') == 'not-found':
+            services[unit] = _service_entry('inactive', 'not-found')
+            continue
+        state = properties.get('ActiveState', 'unknown')
+        main_pid = _systemd_number(properties.get('MainPID')) or None
+        uptime = None
+        started = _systemd_number(properties.get('ActiveEnterTimestampMonotonic'))
+        if state == 'active' and started:
+            uptime = max(0, int(now - started / 1000000))
+        services[unit] = _service_entry(
+            state, properties.get('SubState'), main_pid, uptime,
+            _systemd_number(properties.get('MemoryCurrent')),
+            _systemd_number(properties.get('TasksCurrent'))
+        )
+    return services
+
+def _proc_service_status():
+    """Build the service status from /proc for systems without systemd"""
+    try:
+        clock_ticks = os.sysconf('SC_CLK_TCK')
+        page_size = os.sysconf('SC_PAGE_SIZE')
+        with open('/proc/uptime') as f:
+            boot_uptime = float(f.read().split()[0])
+        pids = [int(entry) for entry in os.listdir('/proc') if entry.isdigit()]
+    except (OSError, ValueError) as e:
+        logger.debug("Could not read /proc: %s", e)
+        return {unit: _service_entry('unknown') for unit in SERVICE_UNITS}
+    
+    processes = {name: [] for name in SERVICE_UNITS.values()}
+    for pid in pids:
         try:
-            # Try to read the system config with sudo if possible
-            sudo_check = subprocess.run(['sudo', '-n', 'true'], 
-                                      capture_output=True, text=True, check=False)
-            
-            if sudo_check.returncode == 0:
-                # We have sudo access, read the system config
-                cat_result = subprocess.run(['sudo', 'cat', system_conf], 
-                                          capture_output=True, text=True, check=False)
-                
-                if cat_result.returncode == 0:
-                    print("Reading settings from system configuration file")
-                    data = cat_result.stdout
-        except Exception as e:
-            print(f"Error reading system config: {e}")
-        
-        # If we couldn't read the system config, fall back to the local config
-        if not data:
-            print("Reading settings from local configuration file")
-            with open(SMB_CONF, 'r') as f:
-                data = f.read()
-            
-        # Define default values for all settings
-        settings = {
-            'server_string': 'Samba Server',
-            'workgroup': 'WORKGROUP',
-            'log_level': '1',
-            'server_role': 'standalone',
-            'log_file': '/var/log/samba/log.%m',
-            'max_log_size': '1000',
-            'security': 'user',
-            'encrypt_passwords': 'yes',
-            'guest_account': 'nobody',
-            'map_to_guest': 'Bad User',
-            'interfaces': '',
-            'bind_interfaces_only': 'no',
-            'hosts_allow': '',
-            'hosts_deny': '',
-            'unix_charset': 'UTF-8',
-            'dos_charset': 'CP850',
-            'deadtime': '15',
-            'keepalive': '300',
-            'max_connections': '0',
-            'socket_options': 'TCP_NODELAY IPTOS_LOWDELAY',
-            'dns_proxy': 'no',
-            'usershare_allow_guests': 'yes'
-        }
-        
-        # Define mappings between our keys and Samba config keys
-        mappings = {
-            'server_string': r'server string\s*=\s*(.*)',
-            'workgroup': r'workgroup\s*=\s*(.*)',
-            'log_level': r'log level\s*=\s*(.*)',
-            'server_role': r'server role\s*=\s*(.*)',
-            'log_file': r'log file\s*=\s*(.*)',
-            'max_log_size': r'max log size\s*=\s*(.*)',
-            'security': r'security\s*=\s*(.*)',
-            'encrypt_passwords': r'encrypt passwords\s*=\s*(.*)',
-            'guest_account': r'guest account\s*=\s*(.*)',
-            'map_to_guest': r'map to guest\s*=\s*(.*)',
-            'interfaces': r'interfaces\s*=\s*(.*)',
-            'bind_interfaces_only': r'bind interfaces only\s*=\s*(.*)',
-            'hosts_allow': r'hosts allow\s*=\s*(.*)',
-            'hosts_deny': r'hosts deny\s*=\s*(.*)',
-            'unix_charset': r'unix charset\s*=\s*(.*)',
-            'dos_charset': r'dos charset\s*=\s*(.*)',
-            'deadtime': r'deadtime\s*=\s*(.*)',
-            'keepalive': r'keepalive\s*=\s*(.*)',
-            'max_connections': r'max connections\s*=\s*(.*)',
-            'socket_options': r'socket options\s*=\s*(.*)',
-            'dns_proxy': r'dns proxy\s*=\s*(.*)',
-            'usershare_allow_guests': r'usershare allow guests\s*=\s*(.*)'
-        }
-        
-        # Extract values from the config file
-        for key, pattern in mappings.items():
-            match = re.search(pattern, data)
-            if match:
-                settings[key] = match.group(1).strip()
-                
-        return settings
+            with open(f'/proc/{pid}/stat') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The command name is in parentheses and may itself contain spaces
+        name = stat[stat.index('(') + 1:stat.rindex(')')]
+        if name in processes:
+            fields = stat[stat.rindex(')') + 2:].split()
+            # Fields after the name start at field 3 (state) in proc(5)
+            processes[name].append({
+                'pid': pid,
+                'ppid': int(fields[1]),
+                'threads': int(fields[17]),
+                'start': int(fields[19]),
+                'rss': int(fields[21]) * page_size
+            })
+    
+    services = {}
+    for unit, name in SERVICE_UNITS.items():
+        found = processes[name]
+        if not found:
+            services[unit] = _service_entry('inactive')
+            continue
+        # The main process is the one whose parent is not another copy
+        pids = {process['pid'] for process in found}
+        main = min((process for process in found if process['ppid'] not in pids),
+                   key=lambda process: process['pid'], default=found[0])
+        services[unit] = _service_entry(
+            'active', 'running', main['pid'],
+            max(0, int(boot_uptime - main['start'] / clock_ticks)),
+            sum(process['rss'] for process in found),
+            sum(process['threads'] for process in found)
+        )
+    return services
+
+# Global settings shown on the settings page and their defaults. The Samba
+# parameter name is the key with underscores replaced by spaces.
+GLOBAL_SETTINGS_DEFAULTS = {
+    'server_string': 'Samba Server',
+    'workgroup': 'WORKGROUP',
+    'log_level': '1',
+    'server_role': 'standalone',
+    'log_file': '/var/log/samba/log.%m',
+    'max_log_size': '1000',
+    'security': 'user',
+    'encrypt_passwords': 'yes',
+    'guest_account': 'nobody',
+    'map_to_guest': 'Bad User',
+    'interfaces': '',
+    'bind_interfaces_only': 'no',
+    'hosts_allow': '',
+    'hosts_deny': '',
+    'unix_charset': 'UTF-8',
+    'dos_charset': 'CP850',
+    'deadtime': '15',
+    'keepalive': '300',
+    'max_connections': '0',
+    'socket_options': 'TCP_NODELAY IPTOS_LOWDELAY',
+    'dns_proxy': 'no',
+    'usershare_allow_guests': 'yes'
+}
+
+def global_settings_from_config(config):
+    """Extract the settings page values from the [global] section of a config"""
+    settings = dict(GLOBAL_SETTINGS_DEFAULTS)
+    section = config.global_section
+    if section is not None:
+        for key in settings:
+            value = section.get(key.replace('_', ' '))
+            if value is not None:
+                settings[key] = value
+    return settings
+
+def read_global_settings():
+    try:
+        # Try to read from the system configuration file first; the result is
+        # reused until either configuration file changes
+        settings = CONFIG_CACHE.get('global_settings', (ACTUAL_SMB_CONF, SMB_CONF),
+                                    _read_global_settings)
+        return dict(settings)
         
     except Exception as e:
-        print(f"Error reading global settings: {str(e)}")
-        return {
-            'error': str(e),
-            'server_string': 'Samba Server',
-            'workgroup': 'WORKGROUP',
-            'log_level': '1',
-            'server_role': 'standalone',
-            'log_file': '/var/log/samba/log.%m',
-            'max_log_size': '1000',
-            'security': 'user',
-            'encrypt_passwords': 'yes',
-            'guest_account': 'nobody',
-            'map_to_guest': 'Bad User',
-            'interfaces': '',
-            'bind_interfaces_only': 'no',
-            'hosts_allow': '',
-            'hosts_deny': '',
-            'unix_charset': 'UTF-8',
-            'dos_charset': 'CP850',
-            'deadtime': '15',
-            'keepalive': '300',
-            'max_connections': '0',
-            'socket_options': 'TCP_NODELAY IPTOS_LOWDELAY',
-            'dns_proxy': 'no',
-            'usershare_allow_guests': 'yes'
-        }
+        logger.error("Error reading global settings: %s", e)
+        settings = dict(GLOBAL_SETTINGS_DEFAULTS)
+        settings['error'] = str(e)
+        return settings
+
+def _read_global_settings():
+    # Prefer the system configuration; the privileged read only spawns sudo
+    # when the file changed and is not readable by this process
+    for path in (ACTUAL_SMB_CONF, SMB_CONF):
+        try:
+            data = read_privileged_file(path)
+        except OSError as e:
+            logger.debug("Could not read %s: %s", path, e)
+            continue
+        logger.debug("Reading settings from %s", path)
+        return global_settings_from_config(parse_config(data))
+    
+    raise FileNotFoundError(f"No readable Samba configuration found at {SMB_CONF}")
+
+def read_privileged_file(path):
+    """Read a file that may only be readable by root.
+    The content is cached against the file's identity, so reading an
+    unchanged file costs one stat and never spawns a process."""
+    return CONFIG_CACHE.get(('file', path), (path,), lambda: _read_privileged_file(path))
+
+def _read_privileged_file(path):
+    return get_backend().read_file(path).decode('utf-8', 'replace')
+
+def read_privileged_bytes(path):
+    """Read the raw bytes of a file that may only be readable by root"""
+    return get_backend().read_file(path)
+
+def _system_read_file(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except PermissionError:
+        if DEV_MODE:
+            raise
+    
+    return _read_as_root(path)
+
+def _read_as_root(path):
+    helper = get_helper()
+    if helper is not None:
+        try:
+            return helper.read_file(path)
+        except HelperUnavailable as e:
+            _helper_failed(e)
+        except PermissionError as e:
+            logger.debug("Helper did not read %s, using sudo: %s", path, e)
+    
+    if not has_capability('sudo'):
+        raise PermissionError(f"Cannot read {path} without sudo access")
+    
+    result = execute(['sudo', '-n', 'cat', path], text=False)
+    if result.returncode != 0:
+        if _sudo_refused(result.stderr):
+            invalidate_capabilities()
+        raise PermissionError(result.stderr.decode(errors='replace').strip() or f"Cannot read {path}")
+    return result.stdout
 
 def read_samba_config():
     """Read the content of the Samba configuration file"""
@@ -356,199 +778,117 @@ def read_samba_config():
         with open(SMB_CONF, 'r') as f:
             return f.read()
     except Exception as e:
-        print(f"Error reading Samba config: {e}")
+        logger.error("Error reading Samba config: %s", e)
         return ""
 
 def write_global_settings(settings):
     """Write global settings to the Samba configuration file"""
+    remember_service_params()
     try:
         # Get the current configuration
         config_content = read_samba_config()
         
-        # Create a backup of the current config
-        backup_path = SMB_CONF + '.bak'
-        with open(backup_path, 'w') as f:
-            f.write(config_content)
-        
         # Parse the configuration into sections
-        sections = parse_config_content(config_content)
-        
-        # Update the global section
-        if 'global' in sections:
-            global_section = sections['global']
-            
-            # Update the settings
-            for key, value in settings.items():
-                if value:  # Only update if value is not empty
-                    global_section[key] = value
-                else:
-                    # For empty values, remove the setting from the configuration
-                    if key in global_section:
-                        del global_section[key]
-            
-            # Make sure the include statement is present
-            if DEV_MODE:
-                global_section['include'] = './shares.conf'
+        config = parse_config(config_content)
+        
+        # Update the global section, creating it first in the file if needed
+        global_section = config.global_section
+        if global_section is None:
+            global_section = Section('global')
+            config = SambaConfig([global_section] + config.sections)
+        
+        # Update the settings
+        for key, value in settings.items():
+            if value:  # Only update if value is not empty
+                global_section.set(key, value)
             else:
-                global_section['include'] = '/etc/samba/shares.conf'
+                # For empty values, remove the setting from the configuration
+                global_section.remove(key)
+        
+        # Make sure the include statement is present
+        if BACKEND_NAME == 'simulated':
+            global_section.set('include', SHARE_CONF)
+        elif DEV_MODE:
+            global_section.set('include', './shares.conf')
         else:
-            # Create a new global section if it doesn't exist
-            sections['global'] = settings
-            
-            # Add the include statement
-            if DEV_MODE:
-                sections['global']['include'] = './shares.conf'
-            else:
-                sections['global']['include'] = '/etc/samba/shares.conf'
+            global_section.set('include', '/etc/samba/shares.conf')
         
         # Convert the sections back to a configuration string
-        new_config = ''
-        for section_name, section_params in sections.items():
-            new_config += f'[{section_name}]\n'
-            for param_name, param_value in section_params.items():
-                new_config += f'    {param_name} = {param_value}\n'
-            new_config += '\n'
-        
-        # Write the configuration to a temporary file
-        with tempfile.NamedTemporaryFile(mode='w', delete=False) as temp_file:
-            temp_file.write(new_config)
-            temp_path = temp_file.name
+        new_config = config.render(indent='    ')
         
         success = True
         
         if DEV_MODE:
             # In dev mode, first update the local configuration file
-            local_result = subprocess.run(['cp', temp_path, SMB_CONF], 
-                                  capture_output=True, text=True, check=False)
-            
-            if local_result.returncode != 0:
-                print(f"Error writing to local config: {local_result.stderr}")
+            try:
+                write_config_file(SMB_CONF, new_config, backup=True)
+            except Exception as e:
+                logger.error("Error writing to local config: %s", e)
                 success = False
             
             # Also try to update the system config if we have sudo access
             try:
-                # Check if we have sudo access
-                sudo_check = subprocess.run(['sudo', '-n', 'true'], 
-                                          capture_output=True, text=True, check=False)
-                
-                if sudo_check.returncode == 0:
+                # Check if we have sudo access (the simulated backend has no system config)
+                if BACKEND_NAME == 'system' and has_capability('sudo'):
                     # We have sudo access, update the system config
-                    system_result = subprocess.run(['sudo', 'cp', temp_path, '/etc/samba/smb.conf'], 
-                                                 capture_output=True, text=True, check=False)
+                    write_config_file('/etc/samba/smb.conf', new_config, backup=True)
+                    logger.info("Updated system Samba configuration")
                     
-                    if system_result.returncode == 0:
-                        print("Updated system Samba configuration")
-                        
-                        # Also update the system shares.conf
-                        with open('./shares.conf', 'r') as local_shares:
-                            local_shares_content = local_shares.read()
-                            
-                        with tempfile.NamedTemporaryFile(mode='w', delete=False) as shares_temp:
-                            shares_temp.write(local_shares_content)
-                            shares_temp_path = shares_temp.name
-                        
-                        shares_result = subprocess.run(['sudo', 'cp', shares_temp_path, '/etc/samba/shares.conf'], 
-                                                     capture_output=True, text=True, check=False)
-                        
-                        os.unlink(shares_temp_path)
-                        
-                        if shares_result.returncode == 0:
-                            print("Updated system shares configuration")
-                            
-                            # Restart the system services
-                            restart_result = subprocess.run(['sudo', 'systemctl', 'restart', 'smbd', 'nmbd'], 
-                                                         capture_output=True, text=True, check=False)
-                            
-                            if restart_result.returncode == 0:
-                                print("Restarted system Samba services")
-                            else:
-                                print(f"Failed to restart system services: {restart_result.stderr}")
-                    else:
-                        print(f"Failed to update system config: {system_result.stderr}")
+                    # Also update the system shares.conf
+                    with open('./shares.conf', 'r') as local_shares:
+                        local_shares_content = local_shares.read()
+                    write_config_file('/etc/samba/shares.conf', local_shares_content, backup=True)
+                    logger.info("Updated system shares configuration")
+                    
+                    # Reload the system services in the background
+                    schedule_reload()
+                    logger.info("Scheduled a reload of the system Samba services")
                 else:
-                    print("No sudo access available, skipping system config update")
+                    logger.info("No sudo access available, skipping system config update")
             except Exception as sudo_error:
-                print(f"Error updating system config: {str(sudo_error)}")
+                logger.error("Error updating system config: %s", sudo_error)
                 # Continue with local config only
         else:
-            # In production mode, use sudo for the system config
-            system_result = subprocess.run(['sudo', 'cp', temp_path, '/etc/samba/smb.conf'], 
-                                  capture_output=True, text=True, check=False)
-            
-            if system_result.returncode != 0:
-                print(f"Error writing config: {system_result.stderr}")
+            # In production mode, replace the system config (and the local copy)
+            try:
+                write_main_config(new_config)
+                logger.info("Updated system Samba configuration")
+            except Exception as e:
+                logger.error("Error writing config: %s", e)
                 success = False
-            else:
-                print("Updated system Samba configuration")
-                
-                # Also update the local copy for reference
-                try:
-                    local_result = subprocess.run(['cp', temp_path, './smb.conf'], 
-                                      capture_output=True, text=True, check=False)
-                    if local_result.returncode == 0:
-                        print("Updated local copy of Samba configuration")
-                except Exception as e:
-                    print(f"Error updating local copy: {str(e)}")
-        
-        # Clean up the temporary file
-        os.unlink(temp_path)
         
         if not success:
             return False
         
-        # Validate the configuration
-        if DEV_MODE:
-            # In dev mode, validate the local config
-            validate_cmd = subprocess.run(['testparm', '-s', SMB_CONF], 
-                                         capture_output=True, text=True, check=False)
-        else:
-            # In production mode, validate the system config
-            validate_cmd = subprocess.run(['sudo', 'testparm', '-s', '/etc/samba/smb.conf'], 
-                                         capture_output=True, text=True, check=False)
+        # Validate the configuration (the local config in dev mode)
+        validate_cmd = get_backend().testparm(SMB_CONF)
         
         if validate_cmd.returncode != 0:
-            # If validation fails, restore the backup
+            # If validation fails, put the previous configuration back
             if DEV_MODE:
-                subprocess.run(['cp', backup_path, SMB_CONF], check=False)
+                write_config_file(SMB_CONF, config_content)
             else:
-                subprocess.run(['sudo', 'cp', backup_path, '/etc/samba/smb.conf'], check=False)
-            print(f"Invalid configuration: {validate_cmd.stderr}")
+                write_main_config(config_content, backup=False)
+            logger.error("Invalid configuration: %s", validate_cmd.stderr)
             return False
         
-        # Restart Samba services
+        # Reload Samba services
         if DEV_MODE:
-            # In development mode, we already tried to restart the system services if we had sudo access
-            print("Development mode: Local configuration updated successfully")
+            # In development mode, we already tried to reload the system services if we had sudo access
+            logger.info("Development mode: Local configuration updated successfully")
         else:
-            # In production mode, restart the services
-            restart_cmd = subprocess.run(['sudo', 'systemctl', 'restart', 'smbd', 'nmbd'], 
-                                        capture_output=True, text=True, check=False)
-            
-            if restart_cmd.returncode != 0:
-                print(f"Error restarting services: {restart_cmd.stderr}")
+            # In production mode, reload the services (restarting only if required)
+            if not schedule_reload(wait=True):
+                logger.error("Error reloading services")
                 return False
             else:
-                print("Restarted system Samba services")
+                logger.info("Reloaded system Samba services")
         
         return True
     except Exception as e:
-        print(f"Exception in write_global_settings: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Exception in write_global_settings: %s", e)
         return False
 
-def parse_user_group_list(value):
-    """Parse a list of users and groups from a Samba config value.
-    Returns a tuple of (users_list, groups_list)."""
-    if not value:
-        return [], []
-    
-    items = [item.strip() for item in value.split(',') if item.strip()]
-    users = [item for item in items if not item.startswith('@')]
-    groups = [item for item in items if item.startswith('@')]
-    
-    return users, groups
-
 def format_user_group_list(users, groups):
     """Format users and groups into a single comma-separated string."""
     all_items = []
@@ -566,697 +906,898 @@ def format_user_group_list(users, groups):
     
     return ','.join(all_items) if all_items else ''
 
-def load_shares():
-    """Load Samba shares from the configuration files"""
-    shares = []
-    
-    # First read from the main configuration file
+def load_samba_config():
+    """Parse the main configuration file and every file it includes into a
+    single SambaConfig. The result is cached until one of those files changes
+    and must not be modified."""
+    return CONFIG_CACHE.get('samba_config', (SMB_CONF, SHARE_CONF), _load_samba_config,
+                            depends_on=SambaConfig.dependencies)
+
+def _load_samba_config():
+    config = SambaConfig()
     if os.path.exists(SMB_CONF):
-        print(f"Reading shares from main config {SMB_CONF}")
+        logger.debug("Reading configuration from %s", SMB_CONF)
         try:
-            with open(SMB_CONF, 'r') as f:
-                content = f.read()
-            
-            # Parse shares from content
-            sections = parse_config_content(content)
-            for name, section in sections.items():
-                # Skip non-share sections and special shares
-                if name in ['global', 'printers', 'print$']:
-                    continue
-                    
-                # Create share dictionary with normalized keys
-                share = {'name': name}
-                
-                # Map Samba config keys to our normalized keys
-                key_mapping = {
-                    'path': 'path',
-                    'comment': 'comment',
-                    'browseable': 'browseable',
-                    'browsable': 'browseable',  # Alternative spelling
-                    'read only': 'read_only',
-                    'guest ok': 'guest_ok',
-                    'valid users': 'valid_users',
-                    'write list': 'write_list',
-                    'create mask': 'create_mask',
-                    'directory mask': 'directory_mask',
-                    'force group': 'force_group',
-                    'max connections': 'max_connections'
-                }
-                
-                # Copy values using the mapping
-                for samba_key, our_key in key_mapping.items():
-                    if samba_key in section:
-                        share[our_key] = section[samba_key]
-                
-                # Add default values if not present
-                defaults = {
-                    'path': '/tmp',
-                    'comment': '',
-                    'browseable': 'yes',
-                    'read_only': 'no',
-                    'guest_ok': 'no',
-                    'valid_users': '',
-                    'write_list': '',
-                    'create_mask': '0775',
-                    'directory_mask': '0775',
-                    'force_group': 'smbusers',
-                    'max_connections': '0'
-                }
-                
-                for key, value in defaults.items():
-                    if key not in share:
-                        share[key] = value
-                
-                # If valid_users is empty but write_list has values, use write_list for valid_users
-                if not share.get('valid_users') and share.get('write_list'):
-                    share['valid_users'] = share['write_list']
-                    print(f"Using write_list as valid_users for share {name}: {share['valid_users']}")
-                
-                # Debug output for valid_users and write_list
-                print(f"Share {name} from main config - valid_users: '{share.get('valid_users', '')}', write_list: '{share.get('write_list', '')}'")
-                
-                shares.append(share)
+            config = load_config_file(SMB_CONF, opener=open_config_file)
         except Exception as e:
-            print(f"Error reading shares from main config: {e}")
+            logger.error("Error reading configuration from %s: %s", SMB_CONF, e)
     
-    # Then read from the shares configuration file
-    if os.path.exists(SHARE_CONF):
-        print(f"Reading shares from shares config {SHARE_CONF}")
+    # Shares are always written to SHARE_CONF, so read it even when the main
+    # file does not include it under that path (e.g. in development mode)
+    if not config.has_source(SHARE_CONF) and os.path.exists(SHARE_CONF):
+        logger.debug("Reading configuration from %s", SHARE_CONF)
         try:
-            with open(SHARE_CONF, 'r') as f:
-                content = f.read()
-            
-            # Parse shares from content
-            sections = parse_config_content(content)
-            for name, section in sections.items():
-                # Skip non-share sections
-                if name == 'global':
-                    continue
-                    
-                # Check if this share already exists (from main config)
-                existing_share = next((s for s in shares if s['name'] == name), None)
-                if existing_share:
-                    print(f"Share {name} already exists from main config, updating from shares config")
-                    
-                    # Map Samba config keys to our normalized keys
-                    key_mapping = {
-                        'path': 'path',
-                        'comment': 'comment',
-                        'browseable': 'browseable',
-                        'browsable': 'browseable',  # Alternative spelling
-                        'read only': 'read_only',
-                        'guest ok': 'guest_ok',
-                        'valid users': 'valid_users',
-                        'write list': 'write_list',
-                        'create mask': 'create_mask',
-                        'directory mask': 'directory_mask',
-                        'force group': 'force_group',
-                        'max connections': 'max_connections'
-                    }
-                    
-                    # Update values using the mapping
-                    for samba_key, our_key in key_mapping.items():
-                        if samba_key in section:
-                            existing_share[our_key] = section[samba_key]
-                    
-                    # If valid_users is empty but write_list has values, use write_list for valid_users
-                    if not existing_share.get('valid_users') and existing_share.get('write_list'):
-                        existing_share['valid_users'] = existing_share['write_list']
-                        print(f"Using write_list as valid_users for existing share {name}: {existing_share['valid_users']}")
-                    
-                    # Debug output for valid_users and write_list
-                    print(f"Updated share {name} - valid_users: '{existing_share.get('valid_users', '')}', write_list: '{existing_share.get('write_list', '')}'")
-                else:
-                    # Create new share dictionary with normalized keys
-                    share = {'name': name}
-                    
-                    # Map Samba config keys to our normalized keys
-                    key_mapping = {
-                        'path': 'path',
-                        'comment': 'comment',
-                        'browseable': 'browseable',
-                        'browsable': 'browseable',  # Alternative spelling
-                        'read only': 'read_only',
-                        'guest ok': 'guest_ok',
-                        'valid users': 'valid_users',
-                        'write list': 'write_list',
-                        'create mask': 'create_mask',
-                        'directory mask': 'directory_mask',
-                        'force group': 'force_group',
-                        'max connections': 'max_connections'
-                    }
-                    
-                    # Copy values using the mapping
-                    for samba_key, our_key in key_mapping.items():
-                        if samba_key in section:
-                            share[our_key] = section[samba_key]
-                    
-                    # Add default values if not present
-                    defaults = {
-                        'path': '/tmp',
-                        'comment': '',
-                        'browseable': 'yes',
-                        'read_only': 'no',
-                        'guest_ok': 'no',
-                        'valid_users': '',
-                        'write_list': '',
-                        'create_mask': '0775',
-                        'directory_mask': '0775',
-                        'force_group': 'smbusers',
-                        'max_connections': '0'
-                    }
-                    
-                    for key, value in defaults.items():
-                        if key not in share:
-                            share[key] = value
-                    
-                    # If valid_users is empty but write_list has values, use write_list for valid_users
-                    if not share.get('valid_users') and share.get('write_list'):
-                        share['valid_users'] = share['write_list']
-                        print(f"Using write_list as valid_users for new share {name}: {share['valid_users']}")
-                    
-                    # Debug output for valid_users and write_list
-                    print(f"Share {name} from shares config - valid_users: '{share.get('valid_users', '')}', write_list: '{share.get('write_list', '')}'")
-                    
-                    shares.append(share)
+            config.merge(load_config_file(SHARE_CONF, opener=open_config_file))
         except Exception as e:
-            print(f"Error reading shares from shares config: {e}")
-    
-    print(f"Total shares loaded: {len(shares)}")
+            logger.error("Error reading configuration from %s: %s", SHARE_CONF, e)
     
-    # Final check for all shares: ensure valid_users includes write_list users
-    for share in shares:
-        if share.get('write_list') and not share.get('valid_users'):
-            share['valid_users'] = share['write_list']
-            print(f"Final check: Using write_list as valid_users for share {share['name']}: {share['valid_users']}")
-        elif share.get('write_list') and share.get('valid_users'):
-            # Make sure all write_list users are in valid_users
-            valid_users_set = set(user.strip() for user in share['valid_users'].split(',') if user.strip())
-            write_list_set = set(user.strip() for user in share['write_list'].split(',') if user.strip())
-            
-            # If there are users in write_list not in valid_users, add them
-            missing_users = write_list_set - valid_users_set
-            if missing_users:
-                if share['valid_users']:
-                    share['valid_users'] += ',' + ','.join(missing_users)
-                else:
-                    share['valid_users'] = ','.join(missing_users)
-                print(f"Added missing write_list users to valid_users for share {share['name']}: {missing_users}")
-        
-        # Debug output for max_connections
-        print(f"Share {share['name']} - max_connections: '{share.get('max_connections', '0')}'")
-        
-        # Parse and store user and group lists separately for UI display
-        if 'valid_users' in share:
-            users, groups = parse_user_group_list(share['valid_users'])
-            share['valid_users_list'] = users
-            share['valid_groups_list'] = groups
-        
-        if 'write_list' in share:
-            users, groups = parse_user_group_list(share['write_list'])
-            share['write_users_list'] = users
-            share['write_groups_list'] = groups
+    for include in config.dynamic_includes():
+        logger.debug("Not expanding per-client include %s (%s:%s)", include.path, include.source, include.lineno)
+    return config
+
+def open_config_file(path):
+    """Open a configuration file for streaming, using the privileged read
+    path when the file is not readable by this process"""
+    try:
+        return open(path, 'r')
+    except PermissionError:
+        if DEV_MODE:
+            raise
+        return io.StringIO(read_privileged_file(path))
+
+def invalidate_config_cache():
+    """Drop cached configuration after the manager wrote a configuration file"""
+    CONFIG_CACHE.invalidate()
+
+def load_shares():
+    """Load Samba shares from the configuration files"""
+    shares = CONFIG_CACHE.get('shares', (SMB_CONF, SHARE_CONF), _build_shares,
+                              depends_on=lambda _: load_samba_config().dependencies())
+    # Callers may reorder or replace entries, so hand out a copy of the list
+    return list(shares)
+
+def _build_shares():
+    shares = load_samba_config().shares()
+    logger.debug("Loaded %s shares from configuration", len(shares))
+    return shares
+
+# Parsed `testparm -s -v` output keyed by the checksum of the configuration
+# files it was produced from. A few versions are kept, so reverting a change
+# does not run testparm again.
+EFFECTIVE_CONFIG_VERSIONS = 4
+_effective_configs = OrderedDict()
+_effective_lock = threading.Lock()
+
+def config_checksum():
+    """Return a checksum of every configuration file Samba reads"""
+    digest = hashlib.sha256()
+    for path in sorted(set(load_samba_config().dependencies())):
+        digest.update(path.encode() + b'\0')
+        try:
+            digest.update(read_privileged_bytes(path))
+        except (OSError, PermissionError):
+            digest.update(b'\0missing')
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def load_effective_config():
+    """Return the configuration as Samba applies it, with every parameter
+    including defaults, or None when testparm is not available.
     
-    # Print final share information for debugging
-    print(f"Loaded {len(shares)} shares from configuration")
+    testparm runs once per configuration version; lookups in between only
+    stat the configuration files."""
+    return CONFIG_CACHE.get('effective_config', (SMB_CONF, SHARE_CONF), _load_effective_config,
+                            depends_on=lambda _: load_samba_config().dependencies())
+
+def _load_effective_config():
+    # Held while testparm runs, so concurrent requests share one run
+    with _effective_lock:
+        checksum = config_checksum()
+        if checksum in _effective_configs:
+            _effective_configs.move_to_end(checksum)
+            return _effective_configs[checksum]
+        
+        config = _run_testparm_verbose()
+        if config is not None:
+            _effective_configs[checksum] = config
+            while len(_effective_configs) > EFFECTIVE_CONFIG_VERSIONS:
+                _effective_configs.popitem(last=False)
+        return config
+
+def _run_testparm_verbose():
+    logger.info("Reading effective configuration with testparm")
+    try:
+        result = get_backend().testparm(SMB_CONF, verbose=True)
+    except Exception as e:
+        logger.warning("Could not run testparm: %s", e)
+        return None
+    if result.returncode != 0 or not result.stdout.strip():
+        logger.warning("testparm failed: %s", result.stderr.strip())
+        return None
+    return parse_config(result.stdout, source='testparm')
+
+def get_effective_settings(name='global'):
+    """Return every parameter Samba applies to a share (or to [global]) as a
+    dict sorted by parameter name, or None if it is not known"""
+    config = load_effective_config()
+    if config is None:
+        return None
+    section = config.get(name)
+    if section is None:
+        return None
+    return dict(sorted(section.params.items()))
+
+def render_shares_config(shares):
+    """Render the content of the shares configuration file"""
+    parts = ["# Samba shares configuration\n\n"]
     for share in shares:
-        print(f"Share: {share['name']} - Path: {share['path']}")
-        print(f"  valid_users: '{share.get('valid_users', '')}', write_list: '{share.get('write_list', '')}'")
-        print(f"  create_mask: '{share.get('create_mask', '')}', directory_mask: '{share.get('directory_mask', '')}'")
-    
-    return shares
+        if not isinstance(share, Share):
+            share = Share.from_mapping(share)
+        parts.append(share.render())
+        parts.append('\n')
+    return ''.join(parts)
 
-def save_shares(shares):
+def save_shares(shares, wait=False):
     try:
-        print(f"Saving {len(shares)} shares to {SHARE_CONF}")
-        
-        # Map our normalized keys back to Samba config keys
-        reverse_key_mapping = {
-            'path': 'path',
-            'comment': 'comment',
-            'browseable': 'browseable',
-            'read_only': 'read only',
-            'guest ok': 'guest ok',
-            'valid_users': 'valid users',
-            'write list': 'write list',
-            'create_mask': 'create mask',
-            'directory mask': 'directory mask',
-            'force_group': 'force group',
-            'max_connections': 'max connections'
-        }
+        logger.info("Saving %s shares to %s", len(shares), SHARE_CONF)
         
-        # These fields should always be included in the config, even if empty
-        required_fields = ['path', 'valid_users', 'write_list', 'create_mask', 'directory_mask']
+        # Render every share through the config model so keys are always
+        # written with their Samba spelling
+        content = render_shares_config(shares)
         
-        # Create temporary file with new configuration
-        import tempfile
-        with tempfile.NamedTemporaryFile(mode='w', delete=False) as temp_file:
-            temp_file.write("# Samba shares configuration\n\n")
-            for s in shares:
-                temp_file.write(f"[{s['name']}]\n")
-                
-                # First write required fields
-                for our_key in required_fields:
-                    if our_key in s:
-                        samba_key = reverse_key_mapping.get(our_key, our_key)
-                        temp_file.write(f"   {samba_key} = {s[our_key]}\n")
-                
-                # Then write the rest of the fields
-                for our_key, value in s.items():
-                    if our_key != 'name' and our_key not in required_fields:  # Skip the name and required fields
-                        if our_key in reverse_key_mapping:
-                            samba_key = reverse_key_mapping[our_key]
-                            temp_file.write(f"   {samba_key} = {value}\n")
-                        else:
-                            # For any keys not in our mapping, write them as-is
-                            temp_file.write(f"   {our_key} = {value}\n")
-                
-                temp_file.write('\n')
-            temp_path = temp_file.name
-            print(f"Created temporary file at {temp_path}")
+        if not install_shares_file(content):
+            return False
         
-        # Backup original shares file if it exists
-        if os.path.exists(SHARE_CONF):
+        # If in production mode, also update the local copy for reference
+        if not DEV_MODE:
             try:
-                subprocess.run(['sudo', 'cp', SHARE_CONF, f"{SHARE_CONF}.bak"], check=True)
-                print(f"Backed up {SHARE_CONF} to {SHARE_CONF}.bak")
+                local_path = './shares.conf'
+                write_config_file(local_path, content)
+                logger.debug("Updated local copy at %s", local_path)
             except Exception as e:
-                print(f"Warning: Could not backup shares file: {e}")
+                logger.warning("Could not update local copy: %s", e)
         
-        # Use sudo to copy the temporary file to the correct location
-        try:
-            print(f"Copying temporary file to {SHARE_CONF}")
-            subprocess.run(['sudo', 'cp', temp_path, SHARE_CONF], check=True)
-            # Set proper permissions
-            subprocess.run(['sudo', 'chmod', '644', SHARE_CONF], check=True)
-            
-            # If in production mode, also update the local copy for reference
-            if not DEV_MODE:
-                try:
-                    local_path = './shares.conf'
-                    subprocess.run(['cp', temp_path, local_path], check=True)
-                    print(f"Updated local copy at {local_path}")
-                except Exception as e:
-                    print(f"Warning: Could not update local copy: {e}")
-            
-            os.unlink(temp_path)  # Remove the temp file
-            print(f"Successfully copied configuration to {SHARE_CONF}")
-        except Exception as e:
-            print(f"Error copying shares file: {e}")
+        remove_shares_from_main_config()
+        ensure_shares_include()
+        return apply_config_changes(wait=wait)
+    except Exception as e:
+        logger.error("Error saving shares: %s", e)
+        return False
+
+def write_share_changes(changes, wait=False):
+    """Add, update or delete shares by rewriting only the affected sections.
+    
+    changes maps share names to the new share (a dict or Share) or to None to
+    delete the share. Untouched sections of the shares file are preserved byte
+    for byte, and nothing is written or reloaded when no share changed.
+    The reload is scheduled; pass wait=True to wait for it.
+    Returns True on success."""
+    try:
+        changes = {name: (share if share is None or isinstance(share, Share) else Share.from_mapping(share))
+                   for name, share in changes.items()}
+        
+        # Shares still defined in another file (usually smb.conf) are moved
+        # into the shares file by the full rewrite
+        config = load_samba_config()
+        for name in changes:
+            section = config.get(name)
+            if section is not None and section.source and not same_file(section.source, SHARE_CONF):
+                logger.info("Share %s is defined in %s, rewriting all shares", name, section.source)
+                shares = [s for s in load_shares() if s['name'] not in changes]
+                shares.extend(share for share in changes.values() if share is not None)
+                return save_shares(shares, wait=wait)
+        
+        if os.path.exists(SHARE_CONF):
+            content = read_privileged_bytes(SHARE_CONF).decode('utf-8', 'surrogateescape')
+        else:
+            content = "# Samba shares configuration\n\n"
+        
+        new_content = patch_sections(content, changes)
+        if new_content is None:
+            logger.info("Shares %s unchanged, nothing to write", ', '.join(changes))
+            return True
+        
+        logger.info("Writing %s changed share(s) to %s", len(changes), SHARE_CONF)
+        if not install_shares_file(new_content):
             return False
         
-        # Check if there are any shares defined directly in the main config
+        ensure_shares_include()
+        return apply_config_changes(wait=wait)
+    except Exception as e:
+        logger.error("Error writing share changes: %s", e)
+        return False
+
+def same_file(path, other):
+    return os.path.realpath(path) == os.path.realpath(other)
+
+def install_shares_file(content):
+    """Install new content for the shares file, keeping a .bak of the old one"""
+    try:
+        write_config_file(SHARE_CONF, content, backup=True)
+        logger.debug("Wrote %s", SHARE_CONF)
+        return True
+    except Exception as e:
+        logger.error("Error writing shares file: %s", e)
+        return False
+
+# Run as root by write_config_file when neither the helper nor this process
+# can write the target: copy the staged file next to the target, fsync it,
+# link the old file to .bak and rename the new one into place
+ATOMIC_INSTALL_SCRIPT = r'''
+set -e
+src=$1 dest=$2 mode=$3 backup=$4
+dir=$(dirname "$dest")
+tmp=$(mktemp "$dir/.$(basename "$dest").XXXXXX")
+trap 'rm -f "$tmp" "$dest.bak.$$"' EXIT
+cat "$src" > "$tmp"
+if [ -e "$dest" ]; then
+    chown --reference="$dest" "$tmp"
+    chmod --reference="$dest" "$tmp"
+else
+    chmod 644 "$tmp"
+fi
+[ -z "$mode" ] || chmod "$mode" "$tmp"
+sync "$tmp"
+if [ -n "$backup" ] && [ -e "$dest" ]; then
+    ln "$dest" "$dest.bak.$$" 2>/dev/null || cp -p "$dest" "$dest.bak.$$"
+    mv -f "$dest.bak.$$" "$dest.bak"
+fi
+mv -f "$tmp" "$dest"
+sync "$dir"
+'''
+
+def write_config_file(path, content, mode='644', backup=False):
+    """Atomically replace a configuration file.
+    
+    The new content is written and fsynced to a temporary file in the
+    target directory and renamed over the file, so smbd never sees a half
+    written file. With backup=True the old file is kept as path.bak (a
+    hardlink where possible). The system backend uses the privileged helper,
+    a direct write when this process may write the directory, or else a
+    single sudo step.
+    Raises OSError or subprocess.CalledProcessError on failure."""
+    if isinstance(content, str):
+        content = content.encode('utf-8', 'surrogateescape')
+    # Record what the daemons run with while the files still match it
+    remember_service_params()
+    try:
+        get_backend().write_file(path, content, mode=mode, backup=backup)
+    finally:
+        invalidate_config_cache()
+
+def _system_write_file(path, content, mode='644', backup=False):
+    helper = get_helper()
+    if helper is not None:
         try:
-            if os.path.exists(SMB_CONF):
-                print(f"Checking for shares in main config {SMB_CONF}")
-                
-                # In production mode, we need to read from the system config
-                if not DEV_MODE:
-                    system_conf = '/etc/samba/smb.conf'
-                    result = subprocess.run(['sudo', 'cat', system_conf], 
-                                          capture_output=True, text=True, check=True)
-                    content = result.stdout
-                else:
-                    with open(SMB_CONF, 'r') as f:
-                        content = f.read()
-                
-                # Parse the main config
-                sections = parse_config_content(content)
-                share_sections = [name for name in sections.keys() if name not in ['global', 'printers', 'print$']]
-                
-                if share_sections:
-                    print(f"Found {len(share_sections)} shares in main config: {', '.join(share_sections)}")
-                    
-                    # Create a new main config without the share sections
-                    with tempfile.NamedTemporaryFile(mode='w', delete=False) as temp_file:
-                        # First write the global section
-                        if 'global' in sections:
-                            temp_file.write("[global]\n")
-                            for key, value in sections['global'].items():
-                                temp_file.write(f"   {key} = {value}\n")
-                            temp_file.write("\n")
-                        
-                        # Then write any other special sections
-                        for section_name in ['printers', 'print$']:
-                            if section_name in sections:
-                                temp_file.write(f"[{section_name}]\n")
-                                for key, value in sections[section_name].items():
-                                    temp_file.write(f"   {key} = {value}\n")
-                                temp_file.write("\n")
-                        
-                        temp_path = temp_file.name
-                        print(f"Created temporary main config at {temp_path}")
-                    
-                    # Backup original main config
-                    try:
-                        if not DEV_MODE:
-                            system_conf = '/etc/samba/smb.conf'
-                            subprocess.run(['sudo', 'cp', system_conf, f"{system_conf}.bak"], check=True)
-                            print(f"Backed up {system_conf} to {system_conf}.bak")
-                        else:
-                            subprocess.run(['sudo', 'cp', SMB_CONF, f"{SMB_CONF}.bak"], check=True)
-                            print(f"Backed up {SMB_CONF} to {SMB_CONF}.bak")
-                    except Exception as e:
-                        print(f"Warning: Could not backup main config: {e}")
-                    
-                    # Use sudo to copy the temporary file to the correct location
-                    if not DEV_MODE:
-                        system_conf = '/etc/samba/smb.conf'
-                        subprocess.run(['sudo', 'cp', temp_path, system_conf], check=True)
-                        # Also update local copy
-                        try:
-                            subprocess.run(['cp', temp_path, './smb.conf'], check=True)
-                            print(f"Updated local copy of main config")
-                        except Exception as e:
-                            print(f"Warning: Could not update local copy of main config: {e}")
-                    else:
-                        subprocess.run(['sudo', 'cp', temp_path, SMB_CONF], check=True)
-                    
-                    # Set proper permissions
-                    if not DEV_MODE:
-                        subprocess.run(['sudo', 'chmod', '644', system_conf], check=True)
-                    else:
-                        subprocess.run(['sudo', 'chmod', '644', SMB_CONF], check=True)
-                    
-                    os.unlink(temp_path)  # Remove the temp file
-                    print(f"Successfully removed shares from main config")
-        except Exception as e:
-            print(f"Warning: Could not check/update main config: {e}")
-        
-        # Ensure the include directive exists in the main config
+            helper.atomic_write(path, content, mode=mode, backup=backup)
+            return
+        except HelperUnavailable as e:
+            _helper_failed(e)
+        except (HelperError, OSError) as e:
+            logger.debug("Helper did not write %s, trying without it: %s", path, e)
+    
+    directory = os.path.dirname(os.path.abspath(path))
+    if os.access(directory, os.W_OK) and (not os.path.exists(path) or os.access(path, os.W_OK)):
+        atomic_write_file(path, content, mode=mode, backup=backup)
+        return
+    
+    # Stage the content where this process can write it; root copies it
+    # next to the target and renames it into place
+    with tempfile.NamedTemporaryFile(delete=False) as temp_file:
+        temp_file.write(content)
+        temp_file.flush()
+        os.fsync(temp_file.fileno())
+        temp_path = temp_file.name
+    try:
+        run_privileged(['sh', '-c', ATOMIC_INSTALL_SCRIPT, 'sh', temp_path, path,
+                        mode or '', 'backup' if backup else ''], check=True)
+    finally:
+        os.unlink(temp_path)
+
+def write_main_config(content, backup=True):
+    """Replace the main Samba configuration. In production the local
+    ./smb.conf reference copy is updated as well."""
+    write_config_file(SMB_CONF, content, backup=backup)
+    if not DEV_MODE:
         try:
+            write_config_file('./smb.conf', content)
+            logger.debug("Updated local copy of main config")
+        except Exception as e:
+            logger.warning("Could not update local copy of main config: %s", e)
+
+def remove_shares_from_main_config():
+    """Drop share sections from the main config once they live in the shares file"""
+    try:
+        if os.path.exists(SMB_CONF):
+            logger.debug("Checking for shares in main config %s", SMB_CONF)
+            
             # In production mode, we need to read from the system config
             if not DEV_MODE:
-                system_conf = '/etc/samba/smb.conf'
-                result = subprocess.run(['sudo', 'cat', system_conf], 
-                                      capture_output=True, text=True, check=True)
-                content = result.stdout
-                include_path = '/etc/samba/shares.conf'
+                content = read_privileged_file('/etc/samba/smb.conf')
             else:
                 with open(SMB_CONF, 'r') as f:
                     content = f.read()
-                include_path = SHARE_CONF
             
-            if f"include = {include_path}" not in content:
-                print(f"Adding include directive to main config")
-                # Create a temporary file with updated content
-                with tempfile.NamedTemporaryFile(mode='w', delete=False) as temp_file:
-                    if '[global]' in content:
-                        new_content = content.replace('[global]', f'[global]\n   include = {include_path}')
-                    else:
-                        new_content = f"[global]\n   include = {include_path}\n\n{content}"
-                    temp_file.write(new_content)
-                    temp_path = temp_file.name
-                
-                # Use sudo to copy the temporary file to the correct location
-                if not DEV_MODE:
-                    system_conf = '/etc/samba/smb.conf'
-                    subprocess.run(['sudo', 'cp', temp_path, system_conf], check=True)
-                    # Also update local copy
-                    try:
-                        subprocess.run(['cp', temp_path, './smb.conf'], check=True)
-                        print(f"Updated local copy of main config with include directive")
-                    except Exception as e:
-                        print(f"Warning: Could not update local copy of main config: {e}")
-                else:
-                    subprocess.run(['sudo', 'cp', temp_path, SMB_CONF], check=True)
-                
-                # Set proper permissions
-                if not DEV_MODE:
-                    subprocess.run(['sudo', 'chmod', '644', system_conf], check=True)
-                else:
-                    subprocess.run(['sudo', 'chmod', '644', SMB_CONF], check=True)
+            # Parse the main config
+            config = parse_config(content)
+            share_sections = [section.name for section in config.share_sections()]
+            
+            if share_sections:
+                logger.debug("Found %s shares in main config: %s", len(share_sections), ', '.join(share_sections))
                 
-                os.unlink(temp_path)  # Remove the temp file
-                print(f"Added include directive to main config")
-        except Exception as e:
-            print(f"Warning: Could not update include directive: {e}")
+                # Create a new main config without the share sections,
+                # keeping the global section and the special sections
+                special = SambaConfig(section for section in config if not section.is_share)
+                write_main_config(special.render() + '\n')
+                logger.debug("Successfully removed shares from main config")
+    except Exception as e:
+        logger.warning("Could not check/update main config: %s", e)
+
+def ensure_shares_include():
+    """Make sure the main config includes the shares file"""
+    try:
+        # The cached model already knows every include of the main config
+        if SHARE_CONF in load_samba_config().include_paths():
+            return
+        
+        # In production mode, we need to read from the system config
+        if not DEV_MODE:
+            content = read_privileged_file('/etc/samba/smb.conf')
+            include_path = '/etc/samba/shares.conf'
+        else:
+            with open(SMB_CONF, 'r') as f:
+                content = f.read()
+            include_path = SHARE_CONF
         
-        # Validate configuration before restarting
+        if include_path not in parse_config(content).include_paths():
+            logger.debug("Adding include directive to main config")
+            if '[global]' in content:
+                new_content = content.replace('[global]', f'[global]\n   include = {include_path}')
+            else:
+                new_content = f"[global]\n   include = {include_path}\n\n{content}"
+            write_main_config(new_content)
+            logger.debug("Added include directive to main config")
+    except Exception as e:
+        logger.warning("Could not update include directive: %s", e)
+
+def apply_config_changes(wait=False):
+    """Mark the configuration as changed after a write and schedule a reload.
+    
+    With wait=True, block until the reload covering this change has run and
+    return its result."""
+    # Cached shares and settings no longer match the files on disk
+    invalidate_config_cache()
+    return schedule_reload(wait=wait)
+
+def _validate_and_reload():
+    """Validate the configuration and reload Samba"""
+    # Validate configuration before reloading
+    try:
+        validate_result = get_backend().testparm()
+        if validate_result.returncode != 0:
+            logger.warning("Samba configuration validation failed: %s", validate_result.stderr)
+            # Continue anyway as testparm might have warnings but still be valid
+    except Exception as e:
+        logger.warning("Could not validate configuration: %s", e)
+    
+    # Reload Samba, restarting only when a changed parameter requires it
+    logger.info("Reloading Samba configuration")
+    result = reload_samba_service()
+    logger.debug("Samba configuration reload %s", 'successful' if result else 'failed')
+    return result
+
+class ReloadScheduler:
+    """Coalesce bursts of configuration changes into a single Samba reload.
+    
+    request() marks the configuration dirty. A background worker runs the
+    reload `window` seconds after the configuration first became dirty, so
+    every change made in the meantime is covered by that one reload and at
+    most one reload runs per window. A caller that waits for the result while
+    no other reload is pending or running gets its reload right away instead
+    of at the end of the window. A window of 0 reloads synchronously."""
+    
+    def __init__(self, reload_func, window=2.0):
+        self.reload_func = reload_func
+        self.window = window
+        self.reloads = 0
+        self._cond = threading.Condition()
+        self._requested = 0
+        self._started = 0
+        self._completed = 0
+        self._result = True
+        self._dirty_since = None
+        self._thread = None
+    
+    def request(self, wait=False, timeout=None):
+        """Mark the configuration dirty. Returns True once scheduled, or with
+        wait=True the result of the reload covering this request (False if it
+        did not finish within timeout)."""
+        if self.window <= 0:
+            return self._run_inline()
+        
+        with self._cond:
+            idle = self._requested == self._completed
+            self._requested += 1
+            generation = self._requested
+            if self._dirty_since is None:
+                self._dirty_since = time.monotonic()
+            if wait and idle:
+                # Nothing to coalesce with, so do not hold the caller for the window
+                self._dirty_since = time.monotonic() - self.window
+            self._start_worker()
+            self._cond.notify_all()
+            if not wait:
+                return True
+            if not self._cond.wait_for(lambda: self._completed >= generation, timeout):
+                return False
+            return self._result
+    
+    def flush(self, timeout=None):
+        """Run a pending reload now instead of at the end of its window"""
+        with self._cond:
+            if self._requested == self._completed:
+                return True
+            self._dirty_since = time.monotonic() - self.window
+            generation = self._requested
+            self._cond.notify_all()
+            if not self._cond.wait_for(lambda: self._completed >= generation, timeout):
+                return False
+            return self._result
+    
+    def pending(self):
+        with self._cond:
+            return self._requested > self._started
+    
+    def status(self):
+        """Return whether a reload is pending or running, how many ran and
+        the result of the last one (None before the first)"""
+        with self._cond:
+            return {
+                'pending': self._requested > self._started,
+                'running': self._started > self._completed,
+                'reloads': self.reloads,
+                'last_result': self._result if self._completed else None
+            }
+    
+    def _run_inline(self):
+        with self._cond:
+            self._requested += 1
+            self._started = self._requested
+        result = self._reload()
+        with self._cond:
+            self._completed = self._started
+            self._result = result
+        return result
+    
+    def _start_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='samba-reload', daemon=True)
+            self._thread.start()
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._requested > self._started)
+                while True:
+                    remaining = self._dirty_since + self.window - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                # Changes requested from here on need another reload
+                self._started = self._requested
+                self._dirty_since = None
+            
+            result = self._reload()
+            
+            with self._cond:
+                self._completed = self._started
+                self._result = result
+                self._cond.notify_all()
+    
+    def _reload(self):
+        self.reloads += 1
         try:
-            validate_cmd = ['sudo', 'testparm', '-s']
-            validate_result = subprocess.run(validate_cmd, capture_output=True, text=True, check=False)
-            if validate_result.returncode != 0:
-                print(f"Warning: Samba configuration validation failed: {validate_result.stderr}")
-                # Continue anyway as testparm might have warnings but still be valid
+            return self.reload_func()
         except Exception as e:
-            print(f"Warning: Could not validate configuration: {e}")
-        
-        # Restart Samba service
-        print("Restarting Samba service")
-        result = restart_samba_service()
-        print(f"Samba service restart {'successful' if result else 'failed'}")
-        return result
-    except Exception as e:
-        print(f"Error saving shares: {e}")
-        return False
+            logger.exception("Error reloading Samba configuration: %s", e)
+            return False
+
+RELOAD_SCHEDULER = ReloadScheduler(_validate_and_reload,
+                                   window=float(os.environ.get('SAMBA_MANAGER_RELOAD_WINDOW', '2')))
+
+# Do not lose a reload that is still waiting for its window on shutdown
+atexit.register(RELOAD_SCHEDULER.flush, 30)
+
+def schedule_reload(wait=False, timeout=None):
+    """Request a coalesced Samba reload, see ReloadScheduler.request()"""
+    return RELOAD_SCHEDULER.request(wait=wait, timeout=timeout)
+
+# Defaults for fields left empty when a share is added or updated
+NEW_SHARE_DEFAULTS = {
+    'comment': '',
+    'browseable': 'yes',
+    'read_only': 'no',
+    'guest_ok': 'no',
+    'valid_users': '',
+    'write_list': '',
+    'create_mask': '0775',
+    'directory_mask': '0775',
+    'max_connections': '0'
+}
+
+# Shares managed directly in smb.conf that the web interface must not change
+SYSTEM_SHARES = ('secure-share', 'share')
+# Characters that would end a line of smb.conf or start a new section
+CONTROL_CHARS_RE = re.compile(r'[\x00-\x1f\x7f]')
+
+def share_text_error(name, params):
+    """Return why a share name or parameters cannot be written to smb.conf
+    as given, or None. Line breaks in a value would inject further lines."""
+    if CONTROL_CHARS_RE.search(name) or '[' in name or ']' in name:
+        return f'Invalid share name "{name}"'
+    for key, value in params.items():
+        if not isinstance(key, str) or CONTROL_CHARS_RE.search(key) or any(c in key for c in '=[]'):
+            return f'Invalid parameter name "{key}"'
+        if isinstance(value, str) and CONTROL_CHARS_RE.search(value):
+            return f'Value of "{key}" must not contain control characters'
+    return None
 
 def add_or_update_share(new_share):
     """Add or update a Samba share"""
     try:
-        print(f"Adding or updating share: {new_share['name']}")
-        
-        # Ensure we have all required keys with normalized names
-        required_keys = ['name', 'path', 'browseable', 'read_only', 'guest_ok', 
-                         'valid_users', 'write_list', 'create_mask', 'directory_mask', 'max_connections']
+        logger.debug("Adding or updating share: %s", new_share['name'])
+        error = share_text_error(new_share['name'], new_share)
+        if error:
+            logger.error("Not saving share: %s", error)
+            return False
         
         # Add default values for missing keys
-        defaults = {
-            'comment': '',
-            'browseable': 'yes',
-            'read_only': 'no',
-            'guest_ok': 'no',
-            'valid_users': '',
-            'write_list': '',
-            'create_mask': '0775',
-            'directory_mask': '0775',
-            'max_connections': '0'
-        }
-        
-        for key, value in defaults.items():
+        for key, value in NEW_SHARE_DEFAULTS.items():
             if key not in new_share or not new_share[key]:
                 new_share[key] = value
-                print(f"Using default value for {key}: {value}")
+                logger.debug("Using default value for %s: %s", key, value)
         
-        print(f"Processing share with path: {new_share['path']}")
+        logger.debug("Processing share with path: %s", new_share['path'])
         
         # Ensure the share directory exists with proper permissions
         if not create_share_directory(new_share['name'], new_share['path']):
-            print(f"Failed to create or set permissions on share directory: {new_share['path']}")
+            logger.error("Failed to create or set permissions on share directory: %s", new_share['path'])
             return False
         
-        # Load existing shares
-        shares = load_shares()
-        
-        # Check if we're updating an existing share
-        for idx, s in enumerate(shares):
-            if s['name'] == new_share['name']:
-                print(f"Updating existing share: {new_share['name']}")
-                shares[idx] = new_share
-                break
-        else:
-            # Share doesn't exist, add it
-            print(f"Adding new share: {new_share['name']}")
-            shares.append(new_share)
-        
-        # Save the updated shares
-        result = save_shares(shares)
+        # Rewrite only this share's section of the shares file
+        result = write_share_changes({new_share['name']: new_share})
         if result:
-            print(f"Successfully saved share: {new_share['name']}")
+            logger.info("Successfully saved share: %s", new_share['name'])
         else:
-            print(f"Failed to save share: {new_share['name']}")
+            logger.error("Failed to save share: %s", new_share['name'])
         
         return result
     except Exception as e:
-        print(f"Error adding or updating share: {e}")
+        logger.error("Error adding or updating share: %s", e)
         return False
 
+def apply_share_operations(operations, atomic=False, wait=False):
+    """Validate and apply a batch of share operations with a single write of
+    the shares file and a single scheduled Samba reload (see schedule_reload;
+    services are only restarted when a RESTART_REQUIRED_PARAMS value changed).
+    
+    Each operation is a dict with an 'action' ('add', 'update' or 'delete')
+    and either a 'share' dict of share fields or a 'name'. Updates only change
+    the fields they provide. Invalid operations are reported and skipped; with
+    atomic=True any invalid operation cancels the whole batch, and with
+    wait=True the call returns after Samba reloaded the new configuration.
+    Returns (success, results) with one result dict per operation."""
+    existing = {share.name.lower(): share for share in load_shares()}
+    results = []
+    planned = []
+    seen = set()
+    
+    # First pass: validate every operation without touching the system
+    for index, op in enumerate(operations):
+        result = {'index': index, 'action': None, 'name': None, 'status': 'error', 'message': ''}
+        results.append(result)
+        
+        if not isinstance(op, dict):
+            result['message'] = 'Operation must be an object'
+            continue
+        
+        action = op.get('action')
+        data = op.get('share') or {}
+        name = op.get('name') or (data.get('name') if isinstance(data, dict) else None)
+        result['action'] = action
+        result['name'] = name
+        text_error = (share_text_error(name, data)
+                      if isinstance(data, dict) and name and isinstance(name, str) else None)
+        
+        if action not in ('add', 'update', 'delete'):
+            result['message'] = f'Unknown action: {action}'
+        elif not isinstance(data, dict):
+            result['message'] = 'Share must be an object'
+        elif not name or not isinstance(name, str):
+            result['message'] = 'Share name is required'
+        elif text_error:
+            result['message'] = text_error
+        elif name.lower() in seen:
+            result['message'] = f'Share "{name}" appears more than once in the batch'
+        elif name.lower() in SYSTEM_SHARES:
+            result['message'] = f'Cannot modify system share "{name}"'
+        elif action == 'add' and name.lower() in existing:
+            result['message'] = f'A share with the name "{name}" already exists'
+        elif action != 'add' and name.lower() not in existing:
+            result['message'] = f'Share "{name}" not found'
+        else:
+            share = None
+            if action != 'delete':
+                share = existing[name.lower()].to_dict() if action == 'update' else {}
+                for key, value in data.items():
+                    if isinstance(value, bool):
+                        value = 'yes' if value else 'no'
+                    share[key] = str(value) if value is not None else ''
+                share['name'] = name
+                for key, value in NEW_SHARE_DEFAULTS.items():
+                    if not share.get(key):
+                        share[key] = value
+                if not share.get('path'):
+                    result['message'] = 'Share path is required'
+                    continue
+            seen.add(name.lower())
+            result['status'] = 'ok'
+            planned.append((result, name, share))
+    
+    failed = any(result['status'] == 'error' for result in results)
+    if atomic and failed:
+        for result, name, share in planned:
+            result['status'] = 'skipped'
+            result['message'] = 'Batch cancelled because another operation is invalid'
+        return False, results
+    
+    # Second pass: create share directories, once per distinct path
+    changes = {}
+    prepared_paths = {}
+    for result, name, share in planned:
+        if share is not None:
+            path = share['path']
+            if path not in prepared_paths:
+                prepared_paths[path] = create_share_directory(name, path)
+            if not prepared_paths[path]:
+                result['status'] = 'error'
+                result['message'] = f'Could not create or access path {path}'
+                failed = True
+                continue
+        changes[name] = share
+    
+    if not changes:
+        return not failed, results
+    
+    if not write_share_changes(changes, wait=wait):
+        for result, name, share in planned:
+            if name in changes:
+                result['status'] = 'error'
+                result['message'] = 'Failed to write the shares configuration'
+        return False, results
+    
+    return not failed, results
+
 def delete_share(name):
     """Delete a Samba share by name and restart the service"""
     try:
-        print(f"Deleting share: {name}")
-        shares = load_shares()
-        original_count = len(shares)
-        
-        # Filter out the share to delete
-        new_shares = [s for s in shares if s['name'] != name]
+        logger.debug("Deleting share: %s", name)
+        section = load_samba_config().get(name)
         
-        if len(new_shares) == original_count:
-            print(f"Warning: Share '{name}' not found in configuration")
+        if section is None or not section.is_share:
+            logger.warning("Share '%s' not found in configuration", name)
             return False
         
-        print(f"Removed share '{name}' from configuration")
-        
-        # Save the updated shares and restart Samba
-        result = save_shares(new_shares)
+        # Remove only this share's section and restart Samba
+        result = write_share_changes({name: None})
         if result:
-            print(f"Successfully deleted share '{name}' and restarted Samba")
+            logger.info("Successfully deleted share '%s' and restarted Samba", name)
         else:
-            print(f"Failed to save configuration after deleting share '{name}'")
+            logger.error("Failed to save configuration after deleting share '%s'", name)
         
         return result
     except Exception as e:
-        print(f"Error deleting share: {e}")
+        logger.error("Error deleting share: %s", e)
         return False
 
+# Users and groups with lower ids belong to the system and are not offered
+FIRST_REGULAR_ID = 1000
+
 def list_system_users():
     try:
-        output = subprocess.check_output(['getent', 'passwd']).decode()
-        return [line.split(':')[0] for line in output.strip().split('\n') if int(line.split(':')[2]) >= 1000]
+        return [user.pw_name for user in get_nss().users if user.pw_uid >= FIRST_REGULAR_ID]
     except Exception:
         return []
 
 def list_system_groups():
     try:
-        output = subprocess.check_output(['getent', 'group']).decode()
-        return [line.split(':')[0] for line in output.strip().split('\n') if int(line.split(':')[2]) >= 1000]
+        return [group.gr_name for group in get_nss().groups if group.gr_gid >= FIRST_REGULAR_ID]
     except Exception:
         return []
 
+# Share parameters listing users and groups; groups are written @group,
+# +group, &group or a combination of those prefixes
+GROUP_LIST_PARAMS = ('valid_users', 'invalid users', 'write_list', 'read list', 'admin users')
+
+def group_share_index():
+    """Return {group name: [share names]} of the shares whose user lists or
+    force group name the group. Rebuilt only when the configuration changes."""
+    return CONFIG_CACHE.get('group_shares', (SMB_CONF, SHARE_CONF), _build_group_share_index,
+                            depends_on=lambda _: load_samba_config().dependencies())
+
+def _build_group_share_index():
+    index = {}
+    for share in load_shares():
+        groups = set()
+        for param in GROUP_LIST_PARAMS:
+            for item in re.split(r'[\s,]+', share.get(param) or ''):
+                item = item.strip('"')
+                if item[:1] in ('@', '+', '&'):
+                    groups.add(item.lstrip('@+&'))
+        force_group = (share.get('force_group') or '').strip().lstrip('+')
+        if force_group:
+            groups.add(force_group)
+        for group in groups:
+            index.setdefault(group, []).append(share['name'])
+    return index
+
+def list_group_details():
+    """Return list_system_groups() as dicts with the gid, supplementary
+    members, users having it as primary group and the shares using it.
+    Every value comes from a prebuilt index, so this is linear in the
+    number of groups."""
+    nss = get_nss()
+    shares = group_share_index()
+    return [{
+        'name': group.gr_name,
+        'gid': group.gr_gid,
+        'members': list(group.gr_mem),
+        'primary_users': nss.primary_users.get(group.gr_gid, []),
+        'shares': shares.get(group.gr_name, []),
+    } for group in nss.groups if group.gr_gid >= FIRST_REGULAR_ID]
+
+def is_system_group(group_name):
+    """Whether group_name is one of list_system_groups()"""
+    group = get_nss().group(group_name)
+    return group is not None and group.gr_gid >= FIRST_REGULAR_ID
+
 def validate_share_path(path):
     """Validate if a share path exists and is accessible by Samba.
     If the path doesn't exist, attempt to create it."""
+    return get_backend().validate_path(path)
+
+def _system_validate_share_path(path):
     try:
-        print(f"Validating share path: {path}")
+        logger.debug("Validating share path: %s", path)
         
         # Special handling for home directories
         if path.startswith('/home/'):
             parts = path.split('/')
             if len(parts) >= 3:
                 username = parts[2]
-                print(f"Path is in home directory of user: {username}")
+                logger.debug("Path is in home directory of user: %s", username)
                 
                 # Check if the user exists
                 try:
                     import pwd
                     pwd.getpwnam(username)
-                    print(f"User {username} exists")
+                    logger.debug("User %s exists", username)
                     
                     # If the path doesn't exist but the user does, we can create it
                     if not os.path.exists(path):
-                        print(f"Creating directory in user's home: {path}")
+                        logger.debug("Creating directory in user's home: %s", path)
                         # Create the directory with the user as owner
-                        mkdir_result = subprocess.run(['sudo', 'mkdir', '-p', path], 
-                                                    capture_output=True, text=True, check=False)
+                        mkdir_result = run_privileged(['mkdir', '-p', path])
                         if mkdir_result.returncode != 0:
                             error_msg = f"Could not create directory: {mkdir_result.stderr}"
-                            print(error_msg)
+                            logger.error(error_msg)
                             return False, error_msg
                         
                         # Set ownership to the user
-                        chown_result = subprocess.run(['sudo', 'chown', '-R', f"{username}:{username}", path], 
-                                                    capture_output=True, text=True, check=False)
+                        chown_result = run_privileged(['chown', '-R', f"{username}:{username}", path])
                         if chown_result.returncode != 0:
-                            print(f"Warning: Could not set ownership to {username}: {chown_result.stderr}")
+                            logger.warning("Could not set ownership to %s: %s", username, chown_result.stderr)
                         
                         # Set permissions
-                        chmod_result = subprocess.run(['sudo', 'chmod', '-R', '0755', path], 
-                                                    capture_output=True, text=True, check=False)
+                        chmod_result = run_privileged(['chmod', '-R', '0755', path])
                         if chmod_result.returncode != 0:
-                            print(f"Warning: Could not set permissions: {chmod_result.stderr}")
+                            logger.warning("Could not set permissions: %s", chmod_result.stderr)
                         
-                        print(f"Successfully created directory in user's home: {path}")
+                        logger.debug("Successfully created directory in user's home: %s", path)
                         return True, "Path created successfully in user's home directory"
                 except KeyError:
-                    print(f"User {username} does not exist")
+                    logger.warning("User %s does not exist", username)
                     return False, f"User {username} does not exist"
         
         # Check if path exists
         if not os.path.exists(path):
-            print(f"Path {path} does not exist, attempting to create it")
+            logger.info("Path %s does not exist, attempting to create it", path)
             
             # Create parent directories first if they don't exist
             parent_dir = os.path.dirname(path)
             if parent_dir and not os.path.exists(parent_dir):
-                print(f"Parent directory {parent_dir} does not exist, creating it first")
-                parent_result = subprocess.run(['sudo', 'mkdir', '-p', parent_dir], 
-                                             capture_output=True, text=True, check=False)
+                logger.info("Parent directory %s does not exist, creating it first", parent_dir)
+                parent_result = run_privileged(['mkdir', '-p', parent_dir])
                 if parent_result.returncode != 0:
                     error_msg = f"Could not create parent directory: {parent_result.stderr}"
-                    print(error_msg)
+                    logger.error(error_msg)
                     return False, error_msg
             
             # Try to create the directory with sudo
-            result = subprocess.run(['sudo', 'mkdir', '-p', path], 
-                                   capture_output=True, text=True, check=False)
+            result = run_privileged(['mkdir', '-p', path])
             if result.returncode != 0:
                 error_msg = f"Path does not exist and could not be created: {result.stderr}"
-                print(error_msg)
+                logger.error(error_msg)
                 return False, error_msg
             
             # Verify the directory was created
             if not os.path.exists(path):
                 error_msg = f"Directory creation command completed but path still doesn't exist: {path}"
-                print(error_msg)
+                logger.error(error_msg)
                 return False, "Path could not be created"
             
-            print(f"Successfully created directory: {path}")
+            logger.debug("Successfully created directory: %s", path)
             
             # Create smbusers group if it doesn't exist
             try:
                 grp.getgrnam('smbusers')
-                print("smbusers group exists")
+                logger.debug("smbusers group exists")
             except KeyError:
-                print("Creating smbusers group")
-                group_result = subprocess.run(['sudo', 'groupadd', 'smbusers'], 
-                                            capture_output=True, text=True, check=False)
+                logger.debug("Creating smbusers group")
+                group_result = run_privileged(['groupadd', 'smbusers'])
                 if group_result.returncode != 0:
-                    print(f"Warning: Could not create smbusers group: {group_result.stderr}")
+                    logger.warning("Could not create smbusers group: %s", group_result.stderr)
             
             # Set proper permissions on the new directory
-            print(f"Setting ownership for {path}")
-            chown_result = subprocess.run(['sudo', 'chown', '-R', 'root:smbusers', path], 
-                                        capture_output=True, text=True, check=False)
+            logger.debug("Setting ownership for %s", path)
+            chown_result = run_privileged(['chown', '-R', 'root:smbusers', path])
             if chown_result.returncode != 0:
-                print(f"Warning: Could not set ownership: {chown_result.stderr}")
+                logger.warning("Could not set ownership: %s", chown_result.stderr)
             
-            print(f"Setting permissions for {path}")
-            chmod_result = subprocess.run(['sudo', 'chmod', '-R', '2775', path], 
-                                        capture_output=True, text=True, check=False)
+            logger.debug("Setting permissions for %s", path)
+            chmod_result = run_privileged(['chmod', '-R', '2775', path])
             if chmod_result.returncode != 0:
-                print(f"Warning: Could not set permissions: {chmod_result.stderr}")
+                logger.warning("Could not set permissions: %s", chmod_result.stderr)
         else:
-            print(f"Path {path} already exists")
+            logger.debug("Path %s already exists", path)
         
         # Check if path is readable
         try:
             # Use sudo to check if the path is readable
-            read_result = subprocess.run(['sudo', 'test', '-r', path], 
-                                       capture_output=True, text=True, check=False)
+            read_result = run_privileged(['test', '-r', path])
             if read_result.returncode != 0:
                 error_msg = f"Path is not readable: {path}"
-                print(error_msg)
+                logger.error(error_msg)
                 return False, "Path is not readable"
         except Exception as e:
-            print(f"Error checking read access: {e}")
+            logger.error("Error checking read access: %s", e)
             # Fall back to direct check if sudo test fails
             if not os.access(path, os.R_OK):
                 error_msg = f"Path is not readable (direct check): {path}"
-                print(error_msg)
+                logger.error(error_msg)
                 return False, "Path is not readable"
         
         # Check if path is writable
         try:
             # Use sudo to check if the path is writable
-            write_result = subprocess.run(['sudo', 'test', '-w', path], 
-                                        capture_output=True, text=True, check=False)
+            write_result = run_privileged(['test', '-w', path])
             if write_result.returncode != 0:
                 error_msg = f"Path is not writable: {path}"
-                print(error_msg)
+                logger.error(error_msg)
                 return False, "Path is not writable"
         except Exception as e:
-            print(f"Error checking write access: {e}")
+            logger.error("Error checking write access: %s", e)
             # Fall back to direct check if sudo test fails
             if not os.access(path, os.W_OK):
                 error_msg = f"Path is not writable (direct check): {path}"
-                print(error_msg)
+                logger.error(error_msg)
                 return False, "Path is not writable"
         
-        print(f"Path validation successful for {path}")
+        logger.debug("Path validation successful for %s", path)
         return True, "Path is valid and accessible"
     except Exception as e:
         error_msg = f"Error validating share path: {e}"
-        print(error_msg)
+        logger.error(error_msg)
         return False, f"Error validating path: {str(e)}"
 
 def export_config():
@@ -1267,74 +1808,129 @@ def export_config():
         return f"Error exporting configuration: {str(e)}"
 
 def import_config(data):
+    remember_service_params()
     try:
         parts = data.split('[global]')
         if len(parts) >= 2:
             global_conf = '[global]' + parts[1].split('[', 1)[0]
             rest = '[' + parts[1].split('[', 1)[1]
             
-            # Backup original files
-            if os.path.exists(SMB_CONF):
-                with open(f"{SMB_CONF}.bak", 'w') as f_bak:
-                    with open(SMB_CONF, 'r') as f_orig:
-                        f_bak.write(f_orig.read())
+            # Write new configuration, keeping the original files as .bak
+            write_config_file(SMB_CONF, global_conf.strip() + '\n', backup=True)
+            write_config_file(SHARE_CONF, rest.strip() + '\n', backup=True)
             
-            if os.path.exists(SHARE_CONF):
-                with open(f"{SHARE_CONF}.bak", 'w') as f_bak:
-                    with open(SHARE_CONF, 'r') as f_orig:
-                        f_bak.write(f_orig.read())
-            
-            # Write new configuration
-            with open(SMB_CONF, 'w') as f1:
-                f1.write(global_conf.strip() + '\n')
-            with open(SHARE_CONF, 'w') as f2:
-                f2.write(rest.strip() + '\n')
-            
-            # Restart Samba service
-            return restart_samba_service()
+            # Reload Samba service
+            return schedule_reload(wait=True)
         return False
     except Exception as e:
-        print(f"Error importing configuration: {e}")
+        logger.error("Error importing configuration: %s", e)
         return False
 
 # User Management Functions
 
+# Default location of passdb.tdb and smbpasswd ("private dir")
+PRIVATE_DIR = '/var/lib/samba/private'
+# Files holding the Samba account database (tdbsam or smbpasswd backend).
+# The user list is cached until one of them changes.
+PASSDB_FILES = (
+    '/var/lib/samba/private/passdb.tdb',
+    '/var/lib/samba/passdb.tdb',
+    '/etc/samba/private/passdb.tdb',
+    '/etc/samba/smbpasswd',
+    '/var/lib/samba/private/smbpasswd',
+)
+# How long the user list is reused when no passdb file can be stat'ed, for
+# example because the private directory is only accessible to root
+SAMBA_USERS_TTL = float(os.environ.get('SAMBA_MANAGER_USERS_TTL', '30'))
+_samba_users = None
+_samba_users_lock = threading.Lock()
+
 def get_samba_users():
-    """Get list of Samba users with their status"""
+    """Get list of Samba users with their status.
+    
+    The list is reused until a passdb file (see passdb_files()) changes, or for
+    SAMBA_USERS_TTL seconds when none of them can be stat'ed. Changes made
+    through the manager refresh it immediately."""
+    global _samba_users
+    keys = tuple(file_key(path) for path in passdb_files())
+    with _samba_users_lock:
+        if _samba_users is not None:
+            cached_keys, expire, users = _samba_users
+            known = any(key[1] is not None for key in keys)
+            if cached_keys == keys and (known or time.monotonic() < expire):
+                return users
+        
+        users = get_backend().list_users()
+        _samba_users = (keys, time.monotonic() + SAMBA_USERS_TTL, users)
+        return users
+
+def invalidate_samba_users():
+    """Forget the cached user list after adding, removing or changing a user"""
+    global _samba_users
+    with _samba_users_lock:
+        _samba_users = None
+
+def passdb_source():
+    """Return (backend, path) of the account database configured in
+    smb.conf. backend is 'tdbsam' or 'smbpasswd' with the file holding it, or
+    the name of another backend (such as ldapsam) with path None."""
+    try:
+        section = load_samba_config().global_section
+    except Exception as e:
+        logger.debug("Could not read the passdb backend from the configuration: %s", e)
+        section = None
+    
+    def param(name):
+        value = section.get(name) if section is not None else None
+        return value.strip() if value else None
+    
+    name, _, location = (param('passdb backend') or 'tdbsam').partition(':')
+    name = name.strip().lower()
+    private_dir = param('private dir') or PRIVATE_DIR
+    if name == 'tdbsam':
+        return name, location.strip() or os.path.join(private_dir, 'passdb.tdb')
+    if name == 'smbpasswd':
+        return name, location.strip() or param('smb passwd file') or os.path.join(private_dir, 'smbpasswd')
+    return name, None
+
+def passdb_files():
+    """Files whose changes invalidate the cached user list"""
+    _, path = passdb_source()
+    if path is None or path in PASSDB_FILES:
+        return PASSDB_FILES
+    return (path,) + PASSDB_FILES
+
+def _read_passdb():
+    # Decode the account database file itself: one read, no pdbedit run
+    backend, path = passdb_source()
+    if path is None:
+        return None
+    try:
+        data = _system_read_file(path)
+        if backend == 'tdbsam':
+            return parse_tdbsam(data)
+        return parse_smbpasswd(data.decode('utf-8', 'replace'))
+    except (OSError, PassdbFormatError) as e:
+        logger.debug("Not reading %s directly, using pdbedit: %s", path, e)
+        return None
+
+def _system_samba_users():
+    users = _read_passdb()
+    if users is not None:
+        return users
+    
     if DEV_MODE:
         # Try to get real users even in dev mode if possible
         try:
-            # Try pdbedit first
-            success, output = run_command(['pdbedit', '-L'])
+            # Try pdbedit first; -w lists every user with its flags at once
+            success, output = run_command(['pdbedit', '-L', '-w'])
             if success and output.strip():
-                users = []
-                for line in output.strip().split('\n'):
-                    if line.strip():
-                        parts = line.split(':')
-                        if len(parts) >= 1:
-                            username = parts[0].strip()
-                            users.append({
-                                'username': username,
-                                'enabled': True,  # Assume enabled by default
-                                'flags': 'U'
-                            })
-                return users
+                return parse_smbpasswd(output)
                 
             # Try smbpasswd -s command
             success, output = run_command(['cat', '/etc/samba/smbpasswd'])
             if success and output.strip():
-                users = []
-                for line in output.strip().split('\n'):
-                    if line.strip() and not line.startswith('#'):
-                        parts = line.split(':')
-                        if len(parts) >= 1:
-                            username = parts[0].strip()
-                            users.append({
-                                'username': username,
-                                'enabled': True,
-                                'flags': 'U'
-                            })
-                return users
+                return parse_smbpasswd(output)
                 
             # Return mock data if all else fails
             return [
@@ -1349,193 +1945,185 @@ def get_samba_users():
             ]
     
     try:
-        # First try pdbedit with sudo
-        success, output = run_command(['sudo', 'pdbedit', '-L'])
+        # One pdbedit call lists every user with its account flags
+        success, output = run_command(['sudo', 'pdbedit', '-L', '-w'])
         if success and output.strip():
-            users = []
-            for line in output.strip().split('\n'):
-                if line.strip():
-                    parts = line.split(':')
-                    if len(parts) >= 1:
-                        username = parts[0].strip()
-                        # Get detailed info for this user
-                        detail_success, detail_output = run_command(['sudo', 'pdbedit', '-v', '-u', username])
-                        enabled = True
-                        flags = 'U'
-                        if detail_success:
-                            for detail_line in detail_output.split('\n'):
-                                if 'Account Flags:' in detail_line:
-                                    flags = detail_line.split(':', 1)[1].strip()
-                                    enabled = 'D' not in flags
-                        users.append({
-                            'username': username,
-                            'enabled': enabled,
-                            'flags': flags
-                        })
-            return users
+            return parse_smbpasswd(output)
         
         # If pdbedit fails, try reading smbpasswd file directly
         success, output = run_command(['sudo', 'cat', '/etc/samba/smbpasswd'])
         if success and output.strip():
-            users = []
-            for line in output.strip().split('\n'):
-                if line.strip() and not line.startswith('#'):
-                    parts = line.split(':')
-                    if len(parts) >= 1:
-                        username = parts[0].strip()
-                        # Check if user is disabled (has 'D' flag)
-                        disabled = len(parts) > 4 and 'D' in parts[4]
-                        users.append({
-                            'username': username,
-                            'enabled': not disabled,
-                            'flags': parts[4] if len(parts) > 4 else 'U'
-                        })
-            return users
+            return parse_smbpasswd(output)
             
         # If all else fails, try to get system users that might be Samba users
         system_users = list_system_users()
         return [{'username': user, 'enabled': True, 'flags': 'U'} for user in system_users]
     except Exception as e:
-        print(f"Error getting Samba users: {e}")
+        logger.error("Error getting Samba users: %s", e)
         return []
 
 def add_samba_user(username, password, create_system_user=False):
     """Add a new Samba user"""
+    try:
+        return get_backend().add_user(username, password, create_system_user)
+    finally:
+        invalidate_samba_users()
+
+def _system_add_samba_user(username, password, create_system_user=False):
     if DEV_MODE:
-        print(f"[DEV MODE] Would add Samba user: {username}")
+        logger.info("[DEV MODE] Would add Samba user: %s", username)
         return True
     
     try:
         # Check if system user exists
-        check_user = subprocess.run(['id', username], capture_output=True, text=True, check=False)
+        check_user = execute(['id', username])
         user_exists = check_user.returncode == 0
         
         # Create system user if requested and doesn't exist
         if not user_exists and create_system_user:
-            print(f"Creating system user: {username}")
-            create_user = subprocess.run(['sudo', 'useradd', '-m', '-s', '/bin/bash', username], 
-                                        capture_output=True, text=True, check=False)
+            logger.info("Creating system user: %s", username)
+            create_user = run_privileged(['useradd', '-m', '-s', '/bin/bash', username])
+            invalidate_nss()
             if create_user.returncode != 0:
-                print(f"Failed to create system user: {create_user.stderr}")
+                logger.error("Failed to create system user: %s", create_user.stderr)
                 return False
                 
             # Set system password
-            set_pass = subprocess.Popen(['sudo', 'chpasswd'], 
-                                       stdin=subprocess.PIPE,
-                                       stdout=subprocess.PIPE,
-                                       stderr=subprocess.PIPE,
-                                       text=True)
-            stdout, stderr = set_pass.communicate(input=f"{username}:{password}")
+            set_pass = run_privileged(['chpasswd'], input=f"{username}:{password}")
             if set_pass.returncode != 0:
-                print(f"Failed to set system password: {stderr}")
+                logger.error("Failed to set system password: %s", set_pass.stderr)
                 return False
         
         # Create smbusers group if it doesn't exist
-        check_group = subprocess.run(['getent', 'group', 'smbusers'], 
-                                    capture_output=True, text=True, check=False)
+        check_group = execute(['getent', 'group', 'smbusers'])
         if check_group.returncode != 0:
-            print("Creating smbusers group")
-            create_group = subprocess.run(['sudo', 'groupadd', 'smbusers'], 
-                                        capture_output=True, text=True, check=False)
+            logger.info("Creating smbusers group")
+            create_group = run_privileged(['groupadd', 'smbusers'])
             if create_group.returncode != 0:
-                print(f"Failed to create smbusers group: {create_group.stderr}")
+                logger.error("Failed to create smbusers group: %s", create_group.stderr)
         
         # If the user exists, add them to smbusers group
         if user_exists or create_system_user:
-            print(f"Adding {username} to smbusers group")
-            add_to_group = subprocess.run(['sudo', 'usermod', '-aG', 'smbusers', username], 
-                                        capture_output=True, text=True, check=False)
+            logger.info("Adding %s to smbusers group", username)
+            add_to_group = run_privileged(['usermod', '-aG', 'smbusers', username])
             if add_to_group.returncode != 0:
-                print(f"Failed to add user to smbusers group: {add_to_group.stderr}")
+                logger.error("Failed to add user to smbusers group: %s", add_to_group.stderr)
         
         # Add Samba user
-        print(f"Creating Samba user: {username}")
-        process = subprocess.Popen(['sudo', 'smbpasswd', '-s', '-a', username],
-                                  stdin=subprocess.PIPE,
-                                  stdout=subprocess.PIPE,
-                                  stderr=subprocess.PIPE,
-                                  text=True)
-        
-        stdout, stderr = process.communicate(input=f"{password}\n{password}\n")
+        logger.info("Creating Samba user: %s", username)
+        process = run_privileged(['smbpasswd', '-s', '-a', username], input=f"{password}\n{password}\n")
         
         if process.returncode != 0:
-            print(f"Failed to create Samba user: {stderr}")
+            logger.error("Failed to create Samba user: %s", process.stderr)
             return False
         
         # Enable the Samba user
-        print("Enabling Samba user")
-        enable = subprocess.run(['sudo', 'smbpasswd', '-e', username], 
-                               capture_output=True, text=True, check=False)
+        logger.info("Enabling Samba user")
+        enable = run_privileged(['smbpasswd', '-e', username])
         
         if enable.returncode != 0:
-            print(f"Failed to enable Samba user: {enable.stderr}")
+            logger.error("Failed to enable Samba user: %s", enable.stderr)
             return False
             
         return True
     except Exception as e:
-        print(f"Error adding Samba user: {e}")
+        logger.error("Error adding Samba user: %s", e)
         return False
 
 def remove_samba_user(username, delete_system_user=False):
     """Remove a Samba user"""
+    try:
+        return get_backend().remove_user(username, delete_system_user)
+    finally:
+        invalidate_samba_users()
+
+def _system_remove_samba_user(username, delete_system_user=False):
     if DEV_MODE:
-        print(f"[DEV MODE] Would remove Samba user: {username}")
+        logger.info("[DEV MODE] Would remove Samba user: %s", username)
         return True
     
     try:
         # Delete Samba user
-        success, _ = run_command(['sudo', 'smbpasswd', '-x', username])
+        success, output = run_command(['sudo', 'smbpasswd', '-x', username])
+        if not success:
+            logger.error("Failed to remove Samba user %s: %s", username, output)
         
         # Delete system user if requested
         if delete_system_user:
             run_command(['sudo', 'userdel', '-r', username])
+            invalidate_nss()
             
         return success
     except Exception as e:
-        print(f"Error removing Samba user: {e}")
+        logger.error("Error removing Samba user: %s", e)
         return False
 
 def enable_samba_user(username):
     """Enable a Samba user"""
+    try:
+        return get_backend().set_user_enabled(username, True)
+    finally:
+        invalidate_samba_users()
+
+def _system_enable_samba_user(username):
     if DEV_MODE:
-        print(f"[DEV MODE] Would enable Samba user: {username}")
+        logger.info("[DEV MODE] Would enable Samba user: %s", username)
         return True
     
     try:
-        success, _ = run_command(['sudo', 'smbpasswd', '-e', username])
+        success, output = run_command(['sudo', 'smbpasswd', '-e', username])
+        if not success:
+            logger.error("Failed to enable Samba user %s: %s", username, output)
         return success
     except Exception as e:
-        print(f"Error enabling Samba user: {e}")
+        logger.error("Error enabling Samba user: %s", e)
         return False
 
 def disable_samba_user(username):
     """Disable a Samba user"""
+    try:
+        return get_backend().set_user_enabled(username, False)
+    finally:
+        invalidate_samba_users()
+
+def _system_disable_samba_user(username):
     if DEV_MODE:
-        print(f"[DEV MODE] Would disable Samba user: {username}")
+        logger.info("[DEV MODE] Would disable Samba user: %s", username)
         return True
     
     try:
-        success, _ = run_command(['sudo', 'smbpasswd', '-d', username])
+        success, output = run_command(['sudo', 'smbpasswd', '-d', username])
+        if not success:
+            logger.error("Failed to disable Samba user %s: %s", username, output)
         return success
     except Exception as e:
-        print(f"Error disabling Samba user: {e}")
+        logger.error("Error disabling Samba user: %s", e)
         return False
 
 def reset_samba_password(username, password):
     """Reset a Samba user's password"""
+    return get_backend().set_password(username, password)
+
+def _system_reset_samba_password(username, password):
     if DEV_MODE:
-        print(f"[DEV MODE] Would reset password for Samba user: {username}")
+        logger.info("[DEV MODE] Would reset password for Samba user: %s", username)
         return True
     
     try:
-        success, _ = run_command(['sudo', 'smbpasswd', '-s', username], f"{password}\n{password}\n")
+        success, output = run_command(['sudo', 'smbpasswd', '-s', username], f"{password}\n{password}\n")
+        if not success:
+            logger.error("Failed to reset password for Samba user %s: %s", username, output)
         return success
     except Exception as e:
-        print(f"Error resetting Samba password: {e}")
+        logger.error("Error resetting Samba password: %s", e)
         return False
 
 # Setup and Maintenance Functions
 
+def _system_samba_installed():
+    success, _ = run_command(['which', 'smbd'])
+    return success
+
 def ensure_samba_installed():
     """Ensure Samba is installed"""
     if DEV_MODE:
@@ -1555,40 +2143,43 @@ def ensure_samba_installed():
         success, _ = run_command(['sudo', 'apt-get', 'install', '-y', 'samba', 'samba-common-bin'])
         return success
     except Exception as e:
-        print(f"Error installing Samba: {e}")
+        logger.error("Error installing Samba: %s", e)
         return False
 
 def create_share_directory(name, path):
     """Create a share directory with proper permissions"""
+    return get_backend().create_directory(name, path)
+
+def _system_create_share_directory(name, path):
     if DEV_MODE:
         # In dev mode, just create the directory locally
         os.makedirs(path, exist_ok=True)
         return True
         
     try:
-        print(f"Creating or ensuring share directory exists: {path}")
+        logger.debug("Creating or ensuring share directory exists: %s", path)
         
         # First validate the path - this will create it if needed
-        valid, message = validate_share_path(path)
+        valid, message = _system_validate_share_path(path)
         if not valid:
-            print(f"Failed to validate/create share path: {message}")
+            logger.error("Failed to validate/create share path: %s", message)
             return False
         
-        print(f"Path validation successful: {message}")
+        logger.debug("Path validation successful: %s", message)
         
         # Double-check that the directory exists after validation
         if not os.path.exists(path):
-            print(f"Error: Path {path} still doesn't exist after validation")
+            logger.error("Path %s still doesn't exist after validation", path)
             return False
         
         # Set additional share-specific permissions if needed
         # For example, you might want to set specific ACLs or extended attributes
         
         # Verify the directory is properly set up
-        print(f"Successfully created/updated share directory: {path}")
+        logger.debug("Successfully created/updated share directory: %s", path)
         return True
     except Exception as e:
-        print(f"Error creating share directory: {e}")
+        logger.error("Error creating share directory: %s", e)
         return False
 
 def add_users_to_smbusers_group():
@@ -1612,7 +2203,7 @@ def add_users_to_smbusers_group():
             
         return True
     except Exception as e:
-        print(f"Error adding users to smbusers group: {e}")
+        logger.error("Error adding users to smbusers group: %s", e)
         return False
 
 def fix_share_permissions():
@@ -1636,13 +2227,13 @@ def fix_share_permissions():
             
         return True
     except Exception as e:
-        print(f"Error fixing share permissions: {e}")
+        logger.error("Error fixing share permissions: %s", e)
         return False
 
 def setup_samba():
     """Complete Samba setup"""
     if DEV_MODE:
-        print("[DEV MODE] Would set up Samba")
+        logger.info("[DEV MODE] Would set up Samba")
         return True
         
     try:
@@ -1695,7 +2286,7 @@ def setup_samba():
         
         return True
     except Exception as e:
-        print(f"Error setting up Samba: {e}")
+        logger.error("Error setting up Samba: %s", e)
         return False
 
 def get_samba_installation_status():
@@ -1710,7 +2301,7 @@ def get_samba_installation_status():
     
     try:
         # Check if Samba is installed
-        success, _ = run_command(['which', 'smbd'])
+        success = get_backend().samba_installed()
         status['installed'] = success
         
         if not success:
@@ -1731,128 +2322,106 @@ def get_samba_installation_status():
         
         return status
     except Exception as e:
-        print(f"Error getting Samba installation status: {e}")
+        logger.error("Error getting Samba installation status: %s", e)
         return status
 
 def create_system_group(group_name):
     """Create a system group"""
     if DEV_MODE:
-        print(f"[DEV MODE] Would create system group: {group_name}")
+        logger.info("[DEV MODE] Would create system group: %s", group_name)
         return True
         
     try:
         # Validate group name - must start with a letter and contain only letters, numbers, and underscore
         import re
         if not re.match(r'^[a-z][\w-]*$', group_name):
-            print(f"Invalid group name: {group_name} - Group names must start with a letter and contain only letters, numbers, hyphens, and underscores")
+            logger.error("Invalid group name: %s - Group names must start with a letter and contain only letters, numbers, hyphens, and underscores", group_name)
             return False
             
         # Check if the group already exists
         try:
             grp.getgrnam(group_name)
-            print(f"Group {group_name} already exists")
+            logger.info("Group %s already exists", group_name)
             return True
         except KeyError:
             pass  # Group doesn't exist, continue
         
         # Create the group
-        print(f"Creating system group: {group_name}")
-        result = subprocess.run(['sudo', 'groupadd', group_name], 
-                               capture_output=True, text=True, check=False)
+        logger.info("Creating system group: %s", group_name)
+        result = run_privileged(['groupadd', group_name])
         
         if result.returncode != 0:
-            print(f"Error creating group: {result.stderr}")
+            logger.error("Error creating group: %s", result.stderr)
             return False
         
-        print(f"Successfully created group: {group_name}")
+        invalidate_nss()
+        logger.info("Successfully created group: %s", group_name)
         return True
     except Exception as e:
-        print(f"Error creating system group: {e}")
+        logger.error("Error creating system group: %s", e)
         return False
 
 def delete_system_group(group_name):
     """Delete a system group"""
     if DEV_MODE:
-        print(f"[DEV MODE] Would delete system group: {group_name}")
+        logger.info("[DEV MODE] Would delete system group: %s", group_name)
         return True
         
     try:
         # Check if the group exists
-        try:
-            grp.getgrnam(group_name)
-        except KeyError:
-            print(f"Group {group_name} does not exist")
+        nss = get_nss()
+        if nss.group(group_name) is None:
+            logger.warning("Group %s does not exist", group_name)
             return False
         
         # Check if the group is a primary group for any user
-        import pwd
-        primary_users = []
-        for user in pwd.getpwall():
-            if user.pw_gid == grp.getgrnam(group_name).gr_gid:
-                primary_users.append(user.pw_name)
+        primary_users = nss.primary_members(group_name)
         
         if primary_users:
-            print(f"Group {group_name} is the primary group for user(s): {', '.join(primary_users)}")
+            logger.info("Group %s is the primary group for user(s): %s", group_name, ', '.join(primary_users))
             
-            # Try to find a suitable alternative group
-            try:
-                # Try to use 'users' group if it exists
-                alt_group = 'users'
-                grp.getgrnam(alt_group)
-                
-                # Change primary group for each user
-                for username in primary_users:
-                    print(f"Changing primary group for user {username} from {group_name} to {alt_group}")
-                    result = subprocess.run(['sudo', 'usermod', '-g', alt_group, username], 
-                                          capture_output=True, text=True, check=False)
-                    if result.returncode != 0:
-                        print(f"Error changing primary group for user {username}: {result.stderr}")
-                        return False
-                    print(f"Successfully changed primary group for user {username}")
-            except KeyError:
-                # If 'users' group doesn't exist, create it
-                print(f"Creating alternative group 'users'")
-                create_result = subprocess.run(['sudo', 'groupadd', 'users'], 
-                                             capture_output=True, text=True, check=False)
+            # Move them to the 'users' group, creating it if needed
+            alt_group = 'users'
+            if nss.group(alt_group) is None:
+                logger.info("Creating alternative group 'users'")
+                create_result = run_privileged(['groupadd', alt_group])
+                invalidate_nss()
                 if create_result.returncode != 0:
-                    print(f"Error creating alternative group: {create_result.stderr}")
+                    logger.error("Error creating alternative group: %s", create_result.stderr)
                     return False
-                
-                # Change primary group for each user
-                for username in primary_users:
-                    print(f"Changing primary group for user {username} from {group_name} to users")
-                    result = subprocess.run(['sudo', 'usermod', '-g', 'users', username], 
-                                          capture_output=True, text=True, check=False)
-                    if result.returncode != 0:
-                        print(f"Error changing primary group for user {username}: {result.stderr}")
-                        return False
-                    print(f"Successfully changed primary group for user {username}")
+            
+            # Change primary group for each user
+            for username in primary_users:
+                logger.info("Changing primary group for user %s from %s to %s", username, group_name, alt_group)
+                result = run_privileged(['usermod', '-g', alt_group, username])
+                if result.returncode != 0:
+                    logger.error("Error changing primary group for user %s: %s", username, result.stderr)
+                    return False
+                logger.info("Successfully changed primary group for user %s", username)
         
         # Delete the group
-        print(f"Deleting system group: {group_name}")
-        result = subprocess.run(['sudo', 'groupdel', group_name], 
-                               capture_output=True, text=True, check=False)
+        logger.info("Deleting system group: %s", group_name)
+        result = run_privileged(['groupdel', group_name])
+        invalidate_nss()
         
         if result.returncode != 0:
-            print(f"Error deleting group: {result.stderr}")
+            logger.error("Error deleting group: %s", result.stderr)
             return False
         
-        print(f"Successfully deleted group: {group_name}")
+        logger.info("Successfully deleted group: %s", group_name)
         return True
     except Exception as e:
-        print(f"Error deleting system group: {e}")
+        logger.error("Error deleting system group: %s", e)
         return False
 
 def get_disk_usage(share_path):
     """Get disk usage information for a share path"""
+    return get_backend().disk_usage(share_path)
+
+def _system_disk_usage(share_path):
     try:
         # Use subprocess to run df command
-        result = subprocess.run(
-            ['df', '-h', share_path],
-            capture_output=True, 
-            text=True,
-            check=True
-        )
+        result = execute(['df', '-h', share_path], check=True)
         
         # Parse the output
         lines = result.stdout.strip().split('\n')
@@ -1875,30 +2444,79 @@ def get_disk_usage(share_path):
         
         return usage_info
     except Exception as e:
-        print(f"Error getting disk usage for {share_path}: {str(e)}")
+        logger.error("Error getting disk usage for %s: %s", share_path, e)
         return None
 
+MOUNTS_FILE = '/proc/self/mounts'
+
+def _mount_table():
+    """Return (mount point, device) pairs, longest mount point first"""
+    mounts = []
+    try:
+        with open(MOUNTS_FILE) as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 2:
+                    # Spaces and tabs in names are written as octal escapes
+                    device, mount_point = (re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), field)
+                                           for field in fields[:2])
+                    mounts.append((mount_point, device))
+    except OSError:
+        pass
+    mounts.sort(key=lambda mount: len(mount[0]), reverse=True)
+    return mounts
+
+def _statvfs_usage(path, mounts):
+    st = os.statvfs(path)
+    size = st.f_blocks * st.f_frsize
+    used = (st.f_blocks - st.f_bfree) * st.f_frsize
+    available = st.f_bavail * st.f_frsize
+    real = os.path.realpath(path)
+    mount_point, device = next(((point, device) for point, device in mounts
+                                if real == point or real.startswith(point.rstrip('/') + '/')), ('', ''))
+    return {
+        'filesystem': device,
+        'size': human_size(size),
+        'used': human_size(used),
+        'available': human_size(available),
+        # Rounded up like df, relative to the space usable by non-root users
+        'use_percent': f'{-(-used * 100 // (used + available)) if used + available else 0}%',
+        'mounted_on': mount_point,
+        'size_bytes': size,
+        'used_bytes': used,
+        'available_bytes': available
+    }
+
+def _system_disk_usage_many(paths):
+    """df -h style usage of many paths with statvfs() in-process, so
+    thousands of shares cost no fork at all. Paths that do not exist or
+    cannot be checked are left out."""
+    mounts = _mount_table()
+    usage = {}
+    for path in paths:
+        try:
+            usage[path] = _statvfs_usage(path, mounts)
+        except OSError as e:
+            logger.debug("Cannot get disk usage for %s: %s", path, e)
+    return usage
+
 def terminate_connection(pid):
     """Terminate a Samba connection by PID"""
+    # Validate PID is numeric
+    try:
+        pid_num = int(pid)
+        if pid_num <= 0:
+            return False, f"Invalid PID: {pid} - must be a positive number"
+    except (TypeError, ValueError):
+        return False, f"Invalid PID: {pid} - not a number"
+    
+    # Use the numeric PID for all operations
+    return get_backend().terminate_session(str(pid_num))
+
+def _system_terminate_connection(pid):
     try:
-        # Validate PID is numeric
-        try:
-            pid_num = int(pid)
-            if pid_num <= 0:
-                return False, f"Invalid PID: {pid} - must be a positive number"
-        except ValueError:
-            return False, f"Invalid PID: {pid} - not a number"
-            
-        # Use the numeric PID for all operations
-        pid = str(pid_num)
-        
         # Verify that the PID belongs to a Samba process
-        result = subprocess.run(
-            ['sudo', 'ps', '-p', pid, '-o', 'comm='],
-            capture_output=True,
-            text=True,
-            check=False
-        )
+        result = run_privileged(['ps', '-p', pid, '-o', 'comm='])
         
         # Check if this is a smbd process
         process_name = result.stdout.strip()
@@ -1909,12 +2527,7 @@ def terminate_connection(pid):
         machine_name = None
         try:
             # Get smbstatus output
-            status_result = subprocess.run(
-                ['sudo', 'smbstatus'], 
-                capture_output=True, 
-                text=True,
-                check=False
-            )
+            status_result = run_privileged(['smbstatus'])
             
             if status_result.returncode == 0:
                 # Parse output to find the machine associated with this PID
@@ -1927,98 +2540,65 @@ def terminate_connection(pid):
                             machine_name = parts[2]
                             break
         except Exception as e:
-            print(f"Error getting machine name for PID {pid}: {str(e)}")
+            logger.error("Error getting machine name for PID %s: %s", pid, e)
         
         # Try to kill the process with SIGTERM first
-        kill_result = subprocess.run(
-            ['sudo', 'kill', '-TERM', pid],
-            capture_output=True,
-            text=True,
-            check=False
-        )
+        kill_result = run_privileged(['kill', '-TERM', pid])
         
         # Check if the process is still running
-        check_result = subprocess.run(
-            ['sudo', 'ps', '-p', pid],
-            capture_output=True,
-            text=True,
-            check=False
-        )
+        check_result = run_privileged(['ps', '-p', pid])
         
         # If process still exists, try SIGKILL
         if check_result.returncode == 0:
-            print(f"Process {pid} still running after SIGTERM, trying SIGKILL")
-            kill_result = subprocess.run(
-                ['sudo', 'kill', '-KILL', pid],
-                capture_output=True,
-                text=True,
-                check=False
-            )
+            logger.info("Process %s still running after SIGTERM, trying SIGKILL", pid)
+            kill_result = run_privileged(['kill', '-KILL', pid])
         
         # If we have a machine name, also try to disconnect using smbcontrol
         if machine_name:
             try:
-                print(f"Attempting to force disconnect machine: {machine_name}")
+                logger.info("Attempting to force disconnect machine: %s", machine_name)
                 # Use smbcontrol to force disconnect the client
-                smbcontrol_result = subprocess.run(
-                    ['sudo', 'smbcontrol', 'smbd', 'close-share', machine_name],
-                    capture_output=True,
-                    text=True,
-                    check=False
-                )
+                smbcontrol_result = run_privileged(['smbcontrol', 'smbd', 'close-share', machine_name])
                 if smbcontrol_result.returncode != 0:
-                    print(f"smbcontrol error: {smbcontrol_result.stderr}")
+                    logger.error("smbcontrol error: %s", smbcontrol_result.stderr)
             except Exception as e:
-                print(f"Error using smbcontrol: {str(e)}")
+                logger.error("Error using smbcontrol: %s", e)
         
         # Final check if the process is still running
-        final_check = subprocess.run(
-            ['sudo', 'ps', '-p', pid],
-            capture_output=True,
-            text=True,
-            check=False
-        )
+        final_check = run_privileged(['ps', '-p', pid])
         
         if final_check.returncode == 0:
             return False, f"Failed to terminate connection {pid} - process still running"
         
         return True, f"Connection {pid} terminated successfully"
     except Exception as e:
-        print(f"Error terminating connection: {str(e)}")
+        logger.error("Error terminating connection: %s", e)
         return False, f"Error terminating connection: {str(e)}"
 
 def terminate_connection_by_machine(machine):
     """Terminate a Samba connection by machine name/IP"""
+    if not machine:
+        return False, "No machine name provided"
+    return get_backend().terminate_machine(machine)
+
+def _system_terminate_connection_by_machine(machine):
     try:
-        if not machine:
-            return False, "No machine name provided"
-            
         # Try to use smbcontrol to force disconnect the client
         try:
-            print(f"Attempting to force disconnect machine: {machine}")
+            logger.info("Attempting to force disconnect machine: %s", machine)
             # Use smbcontrol to force disconnect the client
-            smbcontrol_result = subprocess.run(
-                ['sudo', 'smbcontrol', 'smbd', 'close-share', machine],
-                capture_output=True,
-                text=True,
-                check=False
-            )
+            smbcontrol_result = run_privileged(['smbcontrol', 'smbd', 'close-share', machine])
             if smbcontrol_result.returncode != 0:
-                print(f"smbcontrol error: {smbcontrol_result.stderr}")
+                logger.error("smbcontrol error: %s", smbcontrol_result.stderr)
                 return False, f"Failed to disconnect {machine}: {smbcontrol_result.stderr}"
         except Exception as e:
-            print(f"Error using smbcontrol: {str(e)}")
+            logger.error("Error using smbcontrol: %s", e)
             return False, f"Error disconnecting {machine}: {str(e)}"
             
         # Also try to find and kill the associated PID
         try:
             # Get smbstatus output
-            status_result = subprocess.run(
-                ['sudo', 'smbstatus'], 
-                capture_output=True, 
-                text=True,
-                check=False
-            )
+            status_result = run_privileged(['smbstatus'])
             
             if status_result.returncode == 0:
                 # Parse output to find PIDs associated with this machine
@@ -2040,26 +2620,24 @@ def terminate_connection_by_machine(machine):
                 
                 # Kill all PIDs associated with this machine
                 for pid in pids_to_kill:
-                    print(f"Killing PID {pid} associated with machine {machine}")
-                    subprocess.run(['sudo', 'kill', '-KILL', pid], check=False)
+                    logger.info("Killing PID %s associated with machine %s", pid, machine)
+                    run_privileged(['kill', '-KILL', pid])
         except Exception as e:
-            print(f"Error killing PIDs for machine {machine}: {str(e)}")
+            logger.error("Error killing PIDs for machine %s: %s", machine, e)
             
         return True, f"Connection from {machine} terminated successfully"
     except Exception as e:
-        print(f"Error terminating connection for machine {machine}: {str(e)}")
+        logger.error("Error terminating connection for machine %s: %s", machine, e)
         return False, f"Error terminating connection: {str(e)}"
 
 def get_active_connections():
     """Get active Samba connections"""
+    return get_backend().list_sessions()
+
+def _system_active_connections():
     try:
         # Use smbstatus to get active connections
-        result = subprocess.run(
-            ['sudo', 'smbstatus'], 
-            capture_output=True, 
-            text=True,
-            check=True
-        )
+        result = run_privileged(['smbstatus'], check=True)
         
         output = result.stdout.strip()
         
@@ -2187,7 +2765,7 @@ def get_active_connections():
             'connections': connections
         }
     except Exception as e:
-        print(f"Error getting active connections: {str(e)}")
+        logger.error("Error getting active connections: %s", e)
         return {
             'version': "Error retrieving Samba information", 
             'processes': [],
@@ -2196,19 +2774,20 @@ def get_active_connections():
 
 def get_share_usage_stats():
     """Get usage statistics for all shares"""
-    shares = load_shares()
+    shares = [share for share in load_shares() if share.get('path', '')]
+    # One pass over every distinct path, not one df per share; the backend
+    # leaves out paths it has no usage for
+    usage = get_backend().disk_usage_many(list(dict.fromkeys(share['path'] for share in shares)))
     stats = []
     
     for share in shares:
-        path = share.get('path', '')
-        if path and os.path.exists(path):
-            usage = get_disk_usage(path)
-            if usage:
-                stats.append({
-                    'name': share.get('name', ''),
-                    'path': path,
-                    'usage': usage
-                })
+        path = share['path']
+        if usage.get(path):
+            stats.append({
+                'name': share.get('name', ''),
+                'path': path,
+                'usage': usage[path]
+            })
     
     return stats
 
@@ -2250,7 +2829,7 @@ def list_backups():
         
         return backup_files
     except Exception as e:
-        print(f"Error listing backups: {e}")
+        logger.error("Error listing backups: %s", e)
         return []
 
 def create_backup():
@@ -2285,32 +2864,29 @@ def create_backup():
                     # Extract just the filename without the path
                     file_name = os.path.basename(file_path)
                     # Use sudo to copy the file
-                    subprocess.run(['sudo', 'cp', file_path, f"{temp_dir}/{file_name}"], check=True)
+                    run_privileged(['cp', file_path, f"{temp_dir}/{file_name}"], check=True)
                     # Change ownership of the copied file to be readable
-                    subprocess.run(['sudo', 'chmod', '644', f"{temp_dir}/{file_name}"], check=True)
+                    run_privileged(['chmod', '644', f"{temp_dir}/{file_name}"], check=True)
             
             # Create the tar.gz archive
-            subprocess.run([
-                'sudo', 'tar', '-czf', backup_file, '-C', temp_dir, '.'
-            ], check=True)
+            run_privileged(['tar', '-czf', backup_file, '-C', temp_dir, '.'], check=True)
             
             # Change permissions on the backup file
-            subprocess.run(['sudo', 'chmod', '644', backup_file], check=True)
+            run_privileged(['chmod', '644', backup_file], check=True)
         
         return True, backup_file
     except Exception as e:
-        print(f"Error creating backup: {e}")
+        logger.error("Error creating backup: %s", e)
         return False, str(e)
 
 def restore_backup(backup_file):
     """Restore a Samba configuration from a backup file"""
+    remember_service_params()
     try:
         # Create a temporary directory to extract files
         with tempfile.TemporaryDirectory() as temp_dir:
             # Extract the backup archive
-            subprocess.run([
-                'sudo', 'tar', '-xzf', backup_file, '-C', temp_dir
-            ], check=True)
+            run_privileged(['tar', '-xzf', backup_file, '-C', temp_dir], check=True)
             
             # Files to restore (must match files backed up in create_backup)
             restore_mappings = {
@@ -2327,26 +2903,14 @@ def restore_backup(backup_file):
             for src_name, dest_path in restore_mappings.items():
                 src_path = os.path.join(temp_dir, src_name)
                 if os.path.exists(src_path):
-                    # Backup the current file before overwriting
-                    if os.path.exists(dest_path):
-                        backup_path = f"{dest_path}.bak"
-                        subprocess.run(['sudo', 'cp', '-f', dest_path, backup_path], check=True)
-                    
-                    # Copy the restored file to its proper location
-                    subprocess.run(['sudo', 'cp', '-f', src_path, dest_path], check=True)
-                    
-                    # Set proper permissions
-                    if src_name in ['passwd', 'group']:
-                        subprocess.run(['sudo', 'chmod', '644', dest_path], check=True)
-                    elif src_name in ['shadow', 'gshadow']:
-                        subprocess.run(['sudo', 'chmod', '600', dest_path], check=True)
-                    else:
-                        subprocess.run(['sudo', 'chmod', '644', dest_path], check=True)
-        
-        # Restart Samba services
-        restart_samba_service()
+                    # Replace the file in one step, keeping the current one as .bak
+                    mode = '600' if src_name in ['shadow', 'gshadow'] else '644'
+                    write_config_file(dest_path, read_privileged_bytes(src_path), mode=mode, backup=True)
+        
+        # Reload Samba services in the background
+        schedule_reload()
         
         return True, "Backup restored successfully"
     except Exception as e:
-        print(f"Error restoring backup: {e}")
+        logger.error("Error restoring backup: %s", e)
         return False, str(e)
@@ -0,0 +1 @@
+"""Benchmarks for Samba Manager, see run.py"""
@@ -0,0 +1,319 @@
+"""Synthetic fixtures for the benchmarks.
+
+Every generator is deterministic (seeded), so two runs on the same machine
+parse exactly the same input. The formats follow what Samba 4 prints:
+smb.conf/shares.conf, `smbstatus`, `pdbedit -L`, `pdbedit -Lv`,
+`pdbedit -Lw`, `df -h`, and a tdbsam passdb.tdb.
+"""
+
+import os
+import random
+import stat
+import struct
+
+SEED = 1729
+
+GROUPS = ('staff', 'users', 'finance', 'engineering', 'sales', 'smbusers')
+PROTOCOLS = ('SMB3_11', 'SMB3_02', 'SMB2_10')
+
+MAIN_CONFIG = """[global]
+   workgroup = WORKGROUP
+   server string = Samba Server %v
+   netbios name = BENCH
+   security = user
+   map to guest = Bad User
+   log file = /var/log/samba/log.%m
+   max log size = 1000
+   logging = file
+   server role = standalone server
+   obey pam restrictions = yes
+   unix password sync = yes
+   passwd program = /usr/bin/passwd %u
+   pam password change = yes
+   usershare allow guests = yes
+   include = ./shares.conf
+
+[printers]
+   comment = All Printers
+   browseable = no
+   path = /var/spool/samba
+   printable = yes
+   guest ok = no
+   read only = yes
+   create mask = 0700
+
+[print$]
+   comment = Printer Drivers
+   path = /var/lib/samba/printers
+   browseable = yes
+   read only = yes
+   guest ok = no
+"""
+
+
+def shares_config(count, seed=SEED):
+    """shares.conf content with `count` shares"""
+    rng = random.Random(seed)
+    parts = ["# Samba shares configuration\n\n"]
+    for i in range(count):
+        group = rng.choice(GROUPS)
+        lines = [
+            f"[share{i:05d}]",
+            f"    path = /srv/samba/share{i:05d}",
+            f"    comment = Benchmark share {i}",
+            f"    browseable = {rng.choice(('yes', 'no'))}",
+            f"    read only = {rng.choice(('yes', 'no'))}",
+            f"    guest ok = {rng.choice(('yes', 'no'))}",
+            f"    valid users = @{group}, user{rng.randrange(20000):05d}",
+            f"    write list = @{group}",
+            "    create mask = 0664",
+            "    directory mask = 0775",
+            f"    force group = {group}",
+        ]
+        if rng.random() < 0.2:
+            lines.append(f"    max connections = {rng.randrange(1, 100)}")
+        if rng.random() < 0.1:
+            lines.append("    ; vfs objects = recycle")
+        parts.append('\n'.join(lines) + '\n\n')
+    return ''.join(parts)
+
+
+def share_dicts(count, seed=SEED):
+    """Shares as the UI passes them to save_shares"""
+    rng = random.Random(seed)
+    shares = []
+    for i in range(count):
+        group = rng.choice(GROUPS)
+        shares.append({
+            'name': f'share{i:05d}',
+            'path': f'/srv/samba/share{i:05d}',
+            'comment': f'Benchmark share {i}',
+            'browseable': rng.choice(('yes', 'no')),
+            'read_only': rng.choice(('yes', 'no')),
+            'guest_ok': rng.choice(('yes', 'no')),
+            'valid_users': f'@{group}, user{rng.randrange(20000):05d}',
+            'write_list': f'@{group}',
+            'create_mask': '0664',
+            'directory_mask': '0775',
+            'force_group': group,
+        })
+    return shares
+
+
+def _machine(rng):
+    address = f"10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}"
+    return address, f"{address} (ipv4:{address}:{rng.randrange(1024, 65535)})"
+
+
+def smbstatus_output(sessions, locks, shares=200, seed=SEED):
+    """`smbstatus` output with the given number of sessions and locked files"""
+    rng = random.Random(seed)
+    pids = [10000 + i for i in range(sessions)]
+    lines = [
+        "",
+        "Samba version 4.17.12-Debian",
+        "PID     Username     Group        Machine                                   "
+        "Protocol Version  Encryption           Signing              ",
+        "-" * 136,
+    ]
+    machines = {}
+    for pid in pids:
+        address, machine = _machine(rng)
+        machines[pid] = address
+        user = f"user{rng.randrange(20000):05d}"
+        lines.append(f"{pid:<7} {user:<12} {rng.choice(GROUPS):<12} {machine:<41} "
+                     f"{rng.choice(PROTOCOLS):<17} {'-':<20} partial(AES-128-CMAC)")
+
+    lines += [
+        "",
+        "Service      pid     Machine       Connected at                     Encryption   Signing     ",
+        "-" * 93,
+    ]
+    for pid in pids:
+        share = f"share{rng.randrange(shares):05d}"
+        lines.append(f"{share:<12} {pid:<7} {machines[pid]:<13} "
+                     f"Mon Jan  8 09:{rng.randrange(60):02d}:{rng.randrange(60):02d} AM 2024 UTC  "
+                     f"{'-':<12} {'-':<12}")
+
+    lines += [
+        "",
+        "Locked files:",
+        "Pid          User(ID)   DenyMode   Access      R/W        Oplock           "
+        "SharePath   Name   Time",
+        "-" * 98,
+    ]
+    for i in range(locks):
+        pid = rng.choice(pids) if pids else 0
+        share = f"share{rng.randrange(shares):05d}"
+        lines.append(f"{pid:<12} {1000 + rng.randrange(20000):<10} DENY_NONE  0x120089    RDONLY     "
+                     f"LEASE(RWH)       /srv/samba/{share}   docs/file{i:06d}.txt   "
+                     f"Mon Jan  8 09:{rng.randrange(60):02d}:{rng.randrange(60):02d} 2024")
+    lines.append("")
+    return '\n'.join(lines) + '\n'
+
+
+def pdbedit_list(users):
+    """`pdbedit -L` output"""
+    return ''.join(f"user{i:05d}:{1000 + i}:Benchmark User {i}\n" for i in range(users))
+
+
+def _flags(rng):
+    return '[DU         ]' if rng.random() < 0.05 else '[U          ]'
+
+
+def pdbedit_verbose(users, seed=SEED):
+    """`pdbedit -L -v` output"""
+    rng = random.Random(seed)
+    blocks = []
+    for i in range(users):
+        name = f"user{i:05d}"
+        blocks.append(
+            f"Unix username:        {name}\n"
+            "NT username:          \n"
+            f"Account Flags:        {_flags(rng)}\n"
+            f"User SID:             S-1-5-21-1004336348-1177238915-682003330-{3000 + 2 * i}\n"
+            "Primary Group SID:    S-1-5-21-1004336348-1177238915-682003330-513\n"
+            f"Full Name:            Benchmark User {i}\n"
+            f"Home Directory:       \\\\bench\\{name}\n"
+            "HomeDir Drive:        \n"
+            "Logon Script:         \n"
+            f"Profile Path:         \\\\bench\\{name}\\profile\n"
+            "Domain:               BENCH\n"
+            "Account desc:         \n"
+            "Workstations:         \n"
+            "Munged dial:          \n"
+            "Logon time:           0\n"
+            "Logoff time:          never\n"
+            "Kickoff time:         never\n"
+            "Password last set:    Mon, 08 Jan 2024 09:00:00 UTC\n"
+            "Password can change:  Mon, 08 Jan 2024 09:00:00 UTC\n"
+            "Password must change: never\n"
+            "Last bad password   : 0\n"
+            "Bad password count  : 0\n"
+            "Logon hours         : FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF\n"
+        )
+    return '---------------\n'.join(blocks)
+
+
+def pdbedit_smbpasswd(users, seed=SEED):
+    """`pdbedit -L -w` output (smbpasswd format)"""
+    rng = random.Random(seed)
+    lines = []
+    for i in range(users):
+        nt_hash = '%032X' % rng.getrandbits(128)
+        lines.append(f"user{i:05d}:{1000 + i}:{'X' * 32}:{nt_hash}:{_flags(rng)}:LCT-659BBA30:")
+    return '\n'.join(lines) + '\n'
+
+
+def _blob(value):
+    return struct.pack('<I', len(value)) + value
+
+
+def _tdbsam_user(i, rng):
+    name = f"user{i:05d}".encode()
+    flags = 0x0011 if rng.random() < 0.05 else 0x0010
+    strings = [name + b'\0', b'BENCH\0', b'', f"Benchmark User {i}".encode() + b'\0',
+               b'\\\\bench\\' + name + b'\0'] + [b''] * 7
+    hours = b'\xff' * 21
+    return (struct.pack('<7I', 0, 0x7fffffff, 0x7fffffff, 0, 1704704400, 1704704400, 0x7fffffff)
+            + b''.join(_blob(string) for string in strings)
+            + struct.pack('<2I', 3000 + 2 * i, 513)
+            + _blob(b'') + _blob(rng.getrandbits(128).to_bytes(16, 'little')) + _blob(b'')
+            + struct.pack('<IHI', flags, 168, 168) + _blob(hours)
+            + struct.pack('<HHI', 0, 0, 0x4ec))
+
+
+def passdb_tdb(users, hash_size=131, seed=SEED):
+    """A little-endian tdbsam (version 4) passdb.tdb holding `users` users"""
+    rng = random.Random(seed)
+    records = [(b'INFO/version\0', struct.pack('<I', 4)),
+               (b'NEXT_RID\0', struct.pack('<I', 3000 + 2 * users))]
+    for i in range(users):
+        records.append((f"USER_user{i:05d}\0".encode(), _tdbsam_user(i, rng)))
+        records.append((f"RID_{3000 + 2 * i:08x}\0".encode(), f"user{i:05d}\0".encode()))
+
+    header = b'TDB file\n'.ljust(32, b'\0') + struct.pack('<9I', 0x26011967 + 6, hash_size, 0, 0, 0, 0, 0, 0, 0)
+    header += b'\0' * 100
+    offset = len(header) + 4 * (hash_size + 1)
+    heads = [0] * hash_size
+    body = []
+    for index, (key, value) in enumerate(records):
+        bucket = index % hash_size
+        # Chain each record in front of the bucket's previous head
+        body.append(struct.pack('<6I', heads[bucket], len(key) + len(value) + 4, len(key), len(value),
+                                0, 0x26011999) + key + value + struct.pack('<I', 24 + len(key) + len(value) + 4))
+        heads[bucket] = offset
+        offset += len(body[-1])
+    return header + struct.pack(f'<{hash_size + 1}I', 0, *heads) + b''.join(body)
+
+
+def df_output(filesystems=50, seed=SEED):
+    """`df -h` output for a host with many filesystems"""
+    rng = random.Random(seed)
+    lines = ["Filesystem      Size  Used Avail Use% Mounted on"]
+    for i in range(filesystems):
+        size = rng.randrange(100, 4000)
+        used = rng.randrange(size)
+        lines.append(f"/dev/sd{chr(97 + i % 26)}{i // 26 + 1:<9} {size}G {used}G {size - used}G "
+                     f"{used * 100 // size}% /srv/samba/vol{i:02d}")
+    return '\n'.join(lines) + '\n'
+
+
+# Fake tools put first on PATH while benchmarking. They print the recorded
+# fixtures, so the collectors run unmodified against known output.
+FAKE_TOOLS = {
+    'sudo': '''#!/bin/sh
+while [ $# -gt 0 ] && [ "${1#-}" != "$1" ]; do shift; done
+exec "$@"
+''',
+    'smbstatus': '''#!/bin/sh
+exec cat "$BENCH_FIXTURES/smbstatus.txt"
+''',
+    'pdbedit': '''#!/bin/sh
+file=pdbedit_list.txt
+for arg in "$@"; do
+    case "$arg" in
+        -v|--verbose) file=pdbedit_verbose.txt ;;
+        -w|--smbpasswd-style) file=pdbedit_smbpasswd.txt ;;
+    esac
+done
+exec cat "$BENCH_FIXTURES/$file"
+''',
+    'df': '''#!/bin/sh
+head -n 2 "$BENCH_FIXTURES/df.txt"
+''',
+}
+
+
+def write_fixtures(directory, sessions=10000, locks=100000, users=20000):
+    """Write the command fixtures and fake tools into directory; returns the
+    directory holding the fake tools"""
+    outputs = {
+        'smbstatus.txt': smbstatus_output(sessions, locks),
+        'pdbedit_list.txt': pdbedit_list(users),
+        'pdbedit_verbose.txt': pdbedit_verbose(users),
+        'pdbedit_smbpasswd.txt': pdbedit_smbpasswd(users),
+        'df.txt': df_output(),
+    }
+    for name, content in outputs.items():
+        with open(os.path.join(directory, name), 'w') as f:
+            f.write(content)
+    with open(os.path.join(directory, 'passdb.tdb'), 'wb') as f:
+        f.write(passdb_tdb(users))
+
+    bin_dir = os.path.join(directory, 'bin')
+    os.makedirs(bin_dir, exist_ok=True)
+    for name, script in FAKE_TOOLS.items():
+        path = os.path.join(bin_dir, name)
+        with open(path, 'w') as f:
+            f.write(script)
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return bin_dir
+
+
+def write_config(directory, shares):
+    """Write smb.conf and shares.conf with `shares` shares into directory"""
+    with open(os.path.join(directory, 'smb.conf'), 'w') as f:
+        f.write(MAIN_CONFIG)
+    with open(os.path.join(directory, 'shares.conf'), 'w') as f:
+        f.write(shares_config(shares))
@@ -0,0 +1,219 @@
+"""Benchmarks for the configuration parsers and the Samba collectors.
+
+    python -m benchmarks.run              # every case, compared to baselines.json
+    python -m benchmarks.run --quick      # configurations of up to 1000 shares
+    python -m benchmarks.run -k shares    # only cases whose name contains "shares"
+    python -m benchmarks.run --save       # store the results as the new baselines
+    python -m benchmarks.run --check      # exit 1 when a case regressed
+
+Run from the repository root. Fixtures are generated into a temporary
+directory (see fixtures.py) and the application runs in development mode
+against them, with fake smbstatus/pdbedit/df/sudo first on PATH printing
+recorded output, so collectors are timed end to end including the fork.
+
+A case is marked as a regression when its median is more than the
+threshold (default 25%, or the case's own "threshold" in baselines.json)
+slower than its baseline. Baselines are absolute times and only meaningful
+on the machine that recorded them, so by default regressions are reported
+but do not change the exit status. To gate a change, record baselines with
+--save on the same machine first and then run with --check.
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from . import fixtures
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+DEFAULT_THRESHOLD = 0.25
+# Slowdowns smaller than this many seconds are timer noise, never regressions
+MIN_DELTA = 0.0002
+
+SHARE_COUNTS = (10, 100, 1000, 10000, 50000)
+QUICK_SHARE_COUNTS = (10, 100, 1000)
+SESSIONS = 10000
+LOCKS = 100000
+USERS = 20000
+
+
+def prepare(workdir):
+    """Point the application at the fixtures; must run before importing app"""
+    bin_dir = fixtures.write_fixtures(workdir, sessions=SESSIONS, locks=LOCKS, users=USERS)
+    os.environ['BENCH_FIXTURES'] = workdir
+    os.environ['PATH'] = bin_dir + os.pathsep + os.environ.get('PATH', '')
+    os.environ['SAMBA_MANAGER_DEV_MODE'] = '1'
+    os.environ['SAMBA_MANAGER_RELOAD_WINDOW'] = '0'
+    os.chdir(workdir)
+
+
+def measure(func, min_time=0.5, min_runs=3, max_runs=50):
+    """Call func repeatedly and return the run times in seconds. The first
+    call only warms up (imports, caches of the interpreter) and is not
+    counted."""
+    func()
+    times = []
+    deadline = time.perf_counter() + min_time
+    while len(times) < min_runs or (time.perf_counter() < deadline and len(times) < max_runs):
+        started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started)
+    return times
+
+
+def cases(share_counts):
+    """Yield (name, setup) pairs; setup() prepares the input and returns the
+    function to time"""
+    from app import passdb, samba_utils as su
+
+    def config(count):
+        fixtures.write_config(os.getcwd(), count)
+        su.invalidate_config_cache()
+
+    def parse_content(count):
+        content = fixtures.MAIN_CONFIG + fixtures.shares_config(count)
+        return lambda: su.parse_config_content(content)
+
+    def load_shares(count):
+        config(count)
+
+        def run():
+            su.invalidate_config_cache()
+            su.load_shares()
+        return run
+
+    def load_shares_cached(count):
+        config(count)
+        su.load_shares()
+        return su.load_shares
+
+    def render_shares(count):
+        shares = fixtures.share_dicts(count)
+        return lambda: su.render_shares_config(shares)
+
+    def read_global_settings(count):
+        config(count)
+
+        def run():
+            su.invalidate_config_cache()
+            su.read_global_settings()
+        return run
+
+    for count in share_counts:
+        yield f'parse_config_content[shares={count}]', lambda count=count: parse_content(count)
+        yield f'load_shares[shares={count}]', lambda count=count: load_shares(count)
+        yield f'load_shares_cached[shares={count}]', lambda count=count: load_shares_cached(count)
+        yield f'save_shares_render[shares={count}]', lambda count=count: render_shares(count)
+        yield f'read_global_settings[shares={count}]', lambda count=count: read_global_settings(count)
+
+    yield (f'get_active_connections[sessions={SESSIONS},locks={LOCKS}]',
+           lambda: su.get_active_connections)
+    def samba_users():
+        su.invalidate_samba_users()
+        su.get_samba_users()
+
+    yield f'get_samba_users[users={USERS}]', lambda: samba_users
+    yield f'get_samba_users_cached[users={USERS}]', lambda: su.get_samba_users
+    yield 'get_disk_usage', lambda: lambda: su.get_disk_usage('/srv/samba/vol00')
+
+    def read_passdb(name, parse):
+        path = os.path.join(os.environ['BENCH_FIXTURES'], name)
+
+        def run():
+            with open(path, 'rb') as f:
+                parse(f.read())
+        return run
+
+    yield (f'parse_tdbsam[users={USERS}]',
+           lambda: read_passdb('passdb.tdb', passdb.parse_tdbsam))
+    yield (f'parse_smbpasswd[users={USERS}]',
+           lambda: read_passdb('pdbedit_smbpasswd.txt', lambda data: passdb.parse_smbpasswd(data.decode())))
+
+
+def load_baselines():
+    try:
+        with open(BASELINES) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'threshold': DEFAULT_THRESHOLD, 'cases': {}}
+
+
+def save_baselines(baselines):
+    with open(BASELINES, 'w') as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Samba Manager benchmarks')
+    parser.add_argument('--quick', action='store_true', help='only configurations of up to 1000 shares')
+    parser.add_argument('-k', dest='pattern', default='', help='only cases whose name contains PATTERN')
+    parser.add_argument('--save', action='store_true', help='store the results as the new baselines')
+    parser.add_argument('--check', action='store_true',
+                        help='exit with status 1 when a case is slower than its baseline by more than the threshold')
+    parser.add_argument('--threshold', type=float,
+                        help='allowed slowdown over the baseline (default: from baselines.json)')
+    parser.add_argument('--min-time', type=float, default=0.5, help='seconds to spend per case')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.ERROR)
+    baselines = load_baselines()
+    threshold = args.threshold if args.threshold is not None else baselines.get('threshold', DEFAULT_THRESHOLD)
+
+    repo = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix='samba-manager-bench-')
+    sys.path.insert(0, repo)
+    regressions = []
+    results = {}
+    try:
+        prepare(workdir)
+        print(f"{'case':<58} {'median':>11} {'min':>11} {'baseline':>11} {'change':>8}")
+        for name, setup in cases(QUICK_SHARE_COUNTS if args.quick else SHARE_COUNTS):
+            if args.pattern not in name:
+                continue
+            times = measure(setup(), min_time=args.min_time)
+            median = statistics.median(times)
+            results[name] = {'median': median, 'min': min(times), 'runs': len(times)}
+
+            baseline = baselines['cases'].get(name)
+            change = status = ''
+            if baseline:
+                ratio = median / baseline['median'] - 1
+                change = f'{ratio:+.0%}'
+                if ratio > baseline.get('threshold', threshold) and median - baseline['median'] > MIN_DELTA:
+                    status = '  REGRESSION'
+                    regressions.append(name)
+            baseline_text = f"{baseline['median'] * 1000:.2f}ms" if baseline else '-'
+            print(f"{name:<58} {median * 1000:>9.2f}ms {min(times) * 1000:>9.2f}ms "
+                  f"{baseline_text:>11} {change:>8}{status}", flush=True)
+    finally:
+        os.chdir(repo)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.save:
+        for name, result in results.items():
+            entry = baselines['cases'].setdefault(name, {})
+            entry.update(median=round(result['median'], 6), min=round(result['min'], 6))
+        baselines.setdefault('threshold', DEFAULT_THRESHOLD)
+        save_baselines(baselines)
+        print(f"Saved {len(results)} baselines to {BASELINES}")
+        return 0
+
+    if regressions:
+        print(f"{len(regressions)} case(s) slower than baseline by more than the threshold: "
+              f"{', '.join(regressions)}")
+        if args.check:
+            return 1
+        print("Baselines are machine specific; use --check to fail on regressions "
+              "against baselines recorded on this machine")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,56 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+os.environ.setdefault('SAMBA_MANAGER_DEV_MODE', '1')
+
+from app import samba_utils
+from app.backends import Backend, SimulatedBackend
+
+
+class SimulatedSessionsTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.backend = SimulatedBackend(directory.name, shares=5, users=10, sessions=3, latency=0)
+        patcher = mock.patch.object(samba_utils, 'get_backend', return_value=self.backend)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def pids(self):
+        sessions = self.backend.list_sessions()
+        return ([process['pid'] for process in sessions['processes']],
+                [connection['pid'] for connection in sessions['connections']])
+
+    def test_terminate_connection(self):
+        with mock.patch.object(samba_utils, 'run_privileged') as run:
+            self.assertEqual(samba_utils.terminate_connection(20001),
+                             (True, "Connection 20001 terminated successfully"))
+            self.assertFalse(samba_utils.terminate_connection('20001')[0])
+            self.assertFalse(samba_utils.terminate_connection('abc')[0])
+        run.assert_not_called()
+        self.assertEqual(self.pids(), (['20000', '20002'], ['20000', '20002']))
+
+    def test_terminate_connection_by_machine(self):
+        machine = self.backend.list_sessions()['connections'][2]['machine_ip']
+        with mock.patch.object(samba_utils, 'run_privileged') as run:
+            self.assertTrue(samba_utils.terminate_connection_by_machine(machine)[0])
+        run.assert_not_called()
+        self.assertNotIn('20002', self.pids()[0])
+
+
+class BackendInterfaceTest(unittest.TestCase):
+
+    def test_incomplete_backend_cannot_be_created(self):
+        class ReadOnlyBackend(Backend):
+            def read_file(self, path):
+                return b''
+
+        with self.assertRaises(TypeError):
+            ReadOnlyBackend()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import unittest
+from unittest import mock
+
+os.environ.setdefault('SAMBA_MANAGER_DEV_MODE', '1')
+
+from flask import Flask
+
+from app import metrics, samba_utils
+
+SERVICES = {'smbd': {'state': 'active'}, 'nmbd': {'state': 'inactive'}}
+USAGE = [{'name': 'projects', 'path': '/srv/projects',
+          'usage': {'size': '1.5G', 'used': '1.1G', 'available': '409M', 'size_bytes': 1610612736,
+                    'used_bytes': 1181116006, 'available_bytes': 429496730}}]
+CONNECTIONS = {'processes': [{'pid': '1'}], 'connections': [{'service': 'projects'}, {'service': 'projects'}]}
+
+
+class CollectTest(unittest.TestCase):
+
+    def collect(self, capabilities):
+        backend = mock.Mock()
+        backend.name = 'system'
+        with mock.patch('app.backends.get_backend', return_value=backend), \
+                mock.patch.object(samba_utils, 'has_capability', side_effect=lambda name: name in capabilities), \
+                mock.patch.object(samba_utils, 'get_service_status', return_value=SERVICES), \
+                mock.patch.object(samba_utils, 'get_active_connections', return_value=CONNECTIONS) as sessions, \
+                mock.patch.object(samba_utils, 'get_samba_users',
+                                  return_value=[{'enabled': True}, {'enabled': False}]) as users, \
+                mock.patch.object(samba_utils, 'get_share_usage_stats', return_value=USAGE) as usage:
+            return metrics.collect_samba_state(), sessions, users, usage
+
+    def test_all_collectors(self):
+        sample, _, _, _ = self.collect({'signal_smbd', 'read_config'})
+        self.assertEqual(sample, {'services': {'smbd': True, 'nmbd': False}, 'sessions': 1,
+                                  'share_connections': {'projects': 2}, 'users': 2, 'disabled_users': 1,
+                                  'usage': {'projects': {'size': 1610612736, 'used': 1181116006,
+                                                         'available': 429496730}}})
+
+    def test_collectors_without_privileges_are_skipped(self):
+        sample, sessions, users, usage = self.collect(set())
+        self.assertEqual(sample, {'services': {'smbd': True, 'nmbd': False}})
+        sessions.assert_not_called()
+        users.assert_not_called()
+        usage.assert_not_called()
+
+
+class SamplerTest(unittest.TestCase):
+
+    def test_sampler_starts_with_the_first_scrape(self):
+        sampler = metrics.StateSampler(mock.Mock(return_value={}), 3600)
+        app = Flask(__name__)
+        with mock.patch.object(metrics, 'SAMPLER', sampler), \
+                mock.patch.object(metrics, 'render_metrics', return_value=''):
+            metrics.init_app(app)
+            self.assertIsNone(sampler._thread)
+            response = app.test_client().get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(sampler._thread)
+        sampler.collect.assert_called_once_with()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+import os
+import struct
+import tempfile
+import unittest
+from unittest import mock
+
+os.environ.setdefault('SAMBA_MANAGER_DEV_MODE', '1')
+
+from app import passdb, samba_utils
+from app.passdb import PassdbFormatError
+
+
+def blob(value):
+    return struct.pack('<I', len(value)) + value
+
+
+def tdbsam_user(name, rid, acct_ctrl, pass_last_set, hours=b'\xff' * 21):
+    """A tdbsam v3 record; its fields are little-endian on every host"""
+    strings = [name.encode() + b'\0', b'TEST\0'] + [b''] * 10
+    return (struct.pack('<7I', 0, 0x7fffffff, 0x7fffffff, 0, pass_last_set, pass_last_set, 0x7fffffff)
+            + b''.join(blob(string) for string in strings)
+            + struct.pack('<2I', rid, 513)
+            + blob(b'') + blob(b'\x01' * 16) + blob(b'')
+            + struct.pack('<IHI', acct_ctrl, 168, 168) + blob(hours)
+            + struct.pack('<HHI', 0, 0, 0x4ec))
+
+
+def tdb_file(records, order='<', hash_size=3):
+    """A TDB file holding records, with its header, hash table and record
+    headers in byte order `order`"""
+    header = b'TDB file\n'.ljust(32, b'\0') + struct.pack(order + '9I', passdb.TDB_VERSION, hash_size,
+                                                          0, 0, 0, 0, 0, 0, 0)
+    header += b'\0' * (passdb.TDB_HEADER_SIZE - len(header))
+    offset = len(header) + 4 * (hash_size + 1)
+    heads = [0] * hash_size
+    body = []
+    for index, (key, value) in enumerate(records):
+        bucket = index % hash_size
+        body.append(struct.pack(order + '6I', heads[bucket], len(key) + len(value), len(key), len(value),
+                                0, passdb.TDB_MAGIC) + key + value)
+        heads[bucket] = offset
+        offset += len(body[-1])
+    return header + struct.pack(f'{order}{hash_size + 1}I', 0, *heads) + b''.join(body)
+
+
+RECORDS = [
+    (b'INFO/version\0', struct.pack('<I', 4)),
+    (b'USER_alice\0', tdbsam_user('alice', 3000, 0x0010, 1704704400)),
+    (b'RID_00000bb8\0', b'alice\0'),
+    (b'USER_bob\0', tdbsam_user('bob', 3002, 0x0011, 0, hours=b'\x00' * 21)),
+    (b'USER_carol\0', tdbsam_user('carol', 3004, 0x0214, 1704790800)),
+]
+
+SMBPASSWD = (
+    "# smbpasswd file\n"
+    "alice:1000:XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX:8846F7EAEE8FB117AD06BDD830B7586C:[U          ]:LCT-659BDA10:\n"
+    "bob:1001:XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX:8846F7EAEE8FB117AD06BDD830B7586C:[DU         ]:LCT-00000000:\n"
+    "guest:65534:NO PASSWORDXXXXXXXXXXXXXXXXXXXXX:NO PASSWORDXXXXXXXXXXXXXXXXXXXXX:[NU         ]:LCT-659BDA10:\n"
+    "\n"
+)
+
+
+class AccountFlagsTest(unittest.TestCase):
+
+    def test_letters_in_pdbedit_order(self):
+        self.assertEqual(passdb.account_flags(0x0010), '[U          ]')
+        self.assertEqual(passdb.account_flags(0x0011), '[DU         ]')
+        self.assertEqual(passdb.account_flags(0x0214), '[NUX        ]')
+
+
+class TdbsamTest(unittest.TestCase):
+
+    def check_users(self, users):
+        users = {user['username']: user for user in users}
+        self.assertEqual(sorted(users), ['alice', 'bob', 'carol'])
+        self.assertEqual(users['alice'], {'username': 'alice', 'enabled': True, 'flags': '[U          ]',
+                                          'rid': 3000, 'pass_last_set': 1704704400,
+                                          'logon_hours': 'FF' * 21})
+        self.assertFalse(users['bob']['enabled'])
+        self.assertEqual(users['bob']['flags'], '[DU         ]')
+        self.assertIsNone(users['bob']['pass_last_set'])
+        self.assertEqual(users['bob']['logon_hours'], '00' * 21)
+        self.assertEqual(users['carol']['flags'], '[NUX        ]')
+
+    def test_native_byte_order(self):
+        self.check_users(passdb.parse_tdbsam(tdb_file(RECORDS, '<')))
+
+    def test_byte_swapped(self):
+        self.check_users(passdb.parse_tdbsam(tdb_file(RECORDS, '>')))
+
+    def test_records_by_prefix(self):
+        keys = [key for key, _ in passdb.tdb_records(tdb_file(RECORDS), b'RID_')]
+        self.assertEqual(keys, [b'RID_00000bb8\0'])
+
+    def test_not_a_tdb_file(self):
+        with self.assertRaises(PassdbFormatError):
+            passdb.parse_tdbsam(SMBPASSWD.encode())
+
+    def test_unknown_tdb_version(self):
+        data = bytearray(tdb_file(RECORDS))
+        struct.pack_into('<I', data, 32, 0x26011967)
+        with self.assertRaises(PassdbFormatError):
+            passdb.parse_tdbsam(data)
+
+    def test_unknown_tdbsam_version(self):
+        records = [(b'INFO/version\0', struct.pack('<I', 2))] + RECORDS[1:]
+        with self.assertRaises(PassdbFormatError):
+            passdb.parse_tdbsam(tdb_file(records))
+
+    def test_truncated_file(self):
+        data = tdb_file(RECORDS)
+        for size in (100, passdb.TDB_HEADER_SIZE + 8, len(data) - 40, len(data) - 1):
+            with self.subTest(size=size), self.assertRaises(PassdbFormatError):
+                passdb.parse_tdbsam(data[:size])
+
+    def test_hash_chain_loop(self):
+        data = bytearray(tdb_file(RECORDS[:1], hash_size=1))
+        offset = passdb.TDB_HEADER_SIZE + 8
+        # Point the only record back at itself
+        struct.pack_into('<I', data, offset, offset)
+        with self.assertRaises(PassdbFormatError):
+            passdb.parse_tdbsam(data)
+
+
+class SmbpasswdTest(unittest.TestCase):
+
+    def test_flags(self):
+        users = passdb.parse_smbpasswd(SMBPASSWD)
+        self.assertEqual([user['username'] for user in users], ['alice', 'bob', 'guest'])
+        alice, bob, guest = users
+        self.assertEqual(alice, {'username': 'alice', 'enabled': True, 'flags': '[U          ]',
+                                 'uid': 1000, 'pass_last_set': 0x659BDA10})
+        self.assertFalse(bob['enabled'])
+        self.assertIsNone(bob['pass_last_set'])
+        self.assertTrue(guest['enabled'])
+        self.assertEqual(guest['flags'], '[NU         ]')
+
+    def test_short_lines(self):
+        self.assertEqual(passdb.parse_smbpasswd("dave\n:1002:x\n"),
+                         [{'username': 'dave', 'enabled': True, 'flags': '[U          ]',
+                           'uid': None, 'pass_last_set': None}])
+
+
+class ReadPassdbTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'passdb.tdb')
+
+    def samba_users(self, backend, data):
+        with open(self.path, 'wb') as f:
+            f.write(data)
+        pdbedit = mock.Mock(return_value=(True, SMBPASSWD))
+        with mock.patch.object(samba_utils, 'passdb_source', return_value=(backend, self.path)), \
+                mock.patch.object(samba_utils, 'run_command', pdbedit), \
+                mock.patch.object(samba_utils, 'DEV_MODE', False):
+            return samba_utils._system_samba_users(), pdbedit
+
+    def test_reads_the_file(self):
+        users, pdbedit = self.samba_users('tdbsam', tdb_file(RECORDS, '>'))
+        self.assertEqual(len(users), 3)
+        pdbedit.assert_not_called()
+
+    def test_reads_smbpasswd_file(self):
+        users, pdbedit = self.samba_users('smbpasswd', SMBPASSWD.encode())
+        self.assertEqual([user['uid'] for user in users], [1000, 1001, 65534])
+        pdbedit.assert_not_called()
+
+    def test_corrupt_file_falls_back_to_pdbedit(self):
+        data = tdb_file(RECORDS)
+        for corrupt in (data[:len(data) // 2], b'TDB file\n' + b'\xff' * 200):
+            with self.subTest(size=len(corrupt)):
+                users, pdbedit = self.samba_users('tdbsam', corrupt)
+                pdbedit.assert_called_once_with(['sudo', 'pdbedit', '-L', '-w'])
+                self.assertEqual([user['username'] for user in users], ['alice', 'bob', 'guest'])
+
+
+if __name__ == '__main__':
+    unittest.main()
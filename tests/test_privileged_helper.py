@@ -0,0 +1,260 @@
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from app import privileged_helper as helper
+
+
+class HelperPolicyTest(unittest.TestCase):
+    """Path and tool checks, with /etc/samba replaced by a temporary tree"""
+
+    def setUp(self):
+        self.root = os.path.realpath(tempfile.mkdtemp())
+        self.samba = self.path('etc/samba')
+        self.share = self.path('srv/projects')
+        self.outside = self.path('var/spool/cron')
+        for directory in (self.samba, self.share, self.outside, self.path('var/log/samba')):
+            os.makedirs(directory)
+        self.write(os.path.join(self.samba, 'smb.conf'),
+                   f'[global]\n   include = {self.samba}/shares.conf\n')
+        self.write(os.path.join(self.samba, 'shares.conf'),
+                   f'[projects]\n   path = {self.share}\n[homes]\n   path = /home/%U\n')
+        self.write(os.path.join(self.outside, 'root'), '* * * * * true\n')
+
+        patches = [
+            mock.patch.object(helper, 'READ_ROOTS', (self.samba, self.path('var/log/samba'))),
+            mock.patch.object(helper, 'READ_FILES', (self.path('etc/passwd'),)),
+            mock.patch.object(helper, 'WRITE_ROOTS', (self.samba,)),
+            mock.patch.object(helper, 'SMB_CONF', os.path.join(self.samba, 'smb.conf')),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        helper._share_roots.invalidate()
+        self.addCleanup(helper._share_roots.invalidate)
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def path(self, relative):
+        return os.path.join(self.root, relative)
+
+    def write(self, path, content):
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def test_check_read(self):
+        conf = os.path.join(self.samba, 'smb.conf')
+        self.assertEqual(helper.check_read(conf), conf)
+        with self.assertRaises(PermissionError):
+            helper.check_read(os.path.join(self.outside, 'root'))
+        with self.assertRaises(PermissionError):
+            helper.check_read(os.path.join(self.samba, '..', '..', 'var', 'spool', 'cron', 'root'))
+        with self.assertRaises(helper.HelperError):
+            helper.check_read('etc/samba/smb.conf')
+
+    def test_check_read_symlink_escape(self):
+        link = os.path.join(self.samba, 'cron')
+        os.symlink(os.path.join(self.outside, 'root'), link)
+        with self.assertRaises(PermissionError):
+            helper.check_read(link)
+
+    def test_check_write(self):
+        target = os.path.join(self.samba, 'new.conf')
+        self.assertEqual(helper.check_write(target), target)
+        with self.assertRaises(PermissionError):
+            helper.check_write(os.path.join(self.samba, '..', 'passwd'))
+        os.symlink(self.outside, os.path.join(self.samba, 'spool'))
+        with self.assertRaises(PermissionError):
+            helper.check_write(os.path.join(self.samba, 'spool', 'root'))
+
+    def test_share_roots_come_from_the_configuration(self):
+        self.assertEqual(helper.share_roots(), (self.share,))
+
+        self.write(os.path.join(self.samba, 'shares.conf'), f'[cron]\n   path = {self.outside}\n')
+        os.utime(os.path.join(self.samba, 'shares.conf'), ns=(0, 1))
+        self.assertEqual(helper.share_roots(), (self.outside,))
+
+    def test_system_and_home_directories_are_never_share_roots(self):
+        self.assertIsNone(helper._share_root('/var/spool/cron', set()))
+        self.assertIsNone(helper._share_root('/etc', set()))
+        self.assertIsNone(helper._share_root('/srv', set()))
+        self.assertIsNone(helper._share_root('/home/%U', set()))
+        self.assertIsNone(helper._share_root(self.share, {os.path.join(self.share, 'alice')}))
+        self.assertEqual(helper._share_root(self.share, {'/home/alice'}), self.share)
+
+    def test_check_modify(self):
+        inside = os.path.join(self.share, 'team', 'docs')
+        self.assertEqual(helper.check_modify(inside), inside)
+        self.assertEqual(helper.check_modify(os.path.join(self.samba, 'private')),
+                         os.path.join(self.samba, 'private'))
+        for path in (self.samba, self.outside, os.path.join(self.outside, 'root'), self.root,
+                     os.path.join(self.share, '..', '..', 'var', 'spool', 'cron')):
+            with self.subTest(path=path), self.assertRaises(PermissionError):
+                helper.check_modify(path)
+
+    def test_check_modify_recursive_only_on_share_roots(self):
+        self.assertEqual(helper.check_modify(self.share, recursive=True), self.share)
+        for path in (os.path.join(self.share, 'team'), os.path.join(self.samba, 'private'), self.outside):
+            with self.subTest(path=path), self.assertRaises(PermissionError):
+                helper.check_modify(path, recursive=True)
+
+    def test_check_modify_symlink_escape(self):
+        os.symlink(self.outside, os.path.join(self.share, 'cron'))
+        with self.assertRaises(PermissionError):
+            helper.check_modify(os.path.join(self.share, 'cron'))
+        with self.assertRaises(PermissionError):
+            helper.check_modify(os.path.join(self.share, 'cron', 'root'))
+
+    def test_chown_and_chmod_refuse_recursive_changes_outside_share_roots(self):
+        mode = os.stat(self.outside).st_mode
+        with self.assertRaises(PermissionError):
+            helper.op_chmod(self.outside, '777', recursive=True)
+        with self.assertRaises(PermissionError):
+            helper.op_chown(os.path.join(self.share, '..'), user=os.getuid(), recursive=True)
+        self.assertEqual(os.stat(self.outside).st_mode, mode)
+
+    def test_stat_only_where_the_helper_may_read_or_change(self):
+        self.assertTrue(helper.op_stat(self.samba)['is_dir'])
+        self.assertTrue(helper.op_stat(self.share)['is_dir'])
+        self.assertIsNone(helper.op_stat(os.path.join(self.share, 'missing')))
+        for path in (self.outside, os.path.join(self.outside, 'root'), '/'):
+            with self.subTest(path=path), self.assertRaises(PermissionError):
+                helper.op_stat(path)
+
+
+class HelperClientTest(unittest.TestCase):
+    """Retries against a fake helper that answers or drops connections"""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.socket_path = os.path.join(directory, 'helper.sock')
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.socket_path)
+        self.server.listen()
+        self.addCleanup(self.server.close)
+        self.requests = []
+        self.client = helper.HelperClient(self.socket_path, timeout=5)
+        self.addCleanup(self.client.close)
+
+    def serve(self, *answers):
+        """Accept one connection and answer a request per item of answers;
+        None closes the connection after reading the request"""
+        def run():
+            conn, _ = self.server.accept()
+            with conn, conn.makefile('rb') as reader:
+                for answer in answers:
+                    self.requests.append(json.loads(reader.readline()))
+                    if answer is None:
+                        return
+                    conn.sendall(json.dumps({'ok': True, 'result': answer}).encode() + b'\n')
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def test_reconnects_when_the_cached_connection_is_stale(self):
+        first = self.serve('pong')
+        self.assertEqual(self.client.ping(), 'pong')
+        # The helper restarted: the cached connection is closed
+        first.join()
+        self.serve('pong')
+        self.assertEqual(self.client.ping(), 'pong')
+        self.assertEqual(len(self.requests), 2)
+
+    def test_sent_request_is_not_repeated(self):
+        self.serve(None)
+        with self.assertRaises(helper.HelperUnavailable):
+            self.client.call('signal', pid=1234, sig=15)
+        self.assertEqual(self.requests, [{'op': 'signal', 'args': {'pid': 1234, 'sig': 15}}])
+        # No second connection is waiting to be accepted
+        self.server.settimeout(0.1)
+        with self.assertRaises(socket.timeout):
+            self.server.accept()
+
+    def test_unreachable_helper(self):
+        self.server.close()
+        os.unlink(self.socket_path)
+        with self.assertRaises(helper.HelperUnavailable):
+            self.client.ping()
+
+
+class CheckToolTest(unittest.TestCase):
+
+    def setUp(self):
+        patch = mock.patch.object(helper.shutil, 'which', side_effect=lambda tool, path=None: f'/usr/bin/{tool}')
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def allowed(self, *argv):
+        self.assertEqual(helper.check_tool(list(argv)), [f'/usr/bin/{argv[0]}'] + list(argv[1:]))
+
+    def refused(self, *argv):
+        with self.assertRaises(PermissionError):
+            helper.check_tool(list(argv))
+
+    def test_arguments_the_application_uses(self):
+        self.allowed('pdbedit', '-L', '-w')
+        self.allowed('smbpasswd', '-s', '-a', 'alice')
+        self.allowed('smbpasswd', '-s', 'alice')
+        self.allowed('smbpasswd', '-d', 'alice')
+        self.allowed('smbpasswd', '-e', 'alice')
+        self.allowed('smbpasswd', '-x', 'ws01$')
+        self.allowed('smbcontrol', 'all', 'reload-config')
+        self.allowed('smbcontrol', 'smbd', 'close-share', '192.168.1.20')
+        self.allowed('smbstatus')
+        self.allowed('testparm', '-s')
+        self.allowed('testparm', '-s', '-v', '/etc/samba/smb.conf')
+        self.allowed('systemctl', 'reload', 'smbd.service', 'nmbd.service')
+        self.allowed('systemctl', 'enable', 'smbd', 'nmbd')
+        self.allowed('service', 'smbd', 'restart')
+
+    def test_pdbedit_import_needs_a_private_import_file(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'samba-import-abc123.smbpasswd')
+        with open(path, 'w') as f:
+            f.write('alice:1000:X:Y:[U          ]:LCT-00000000:\n')
+        os.chmod(path, 0o600)
+        self.allowed('pdbedit', '-i', f'smbpasswd:{path}')
+
+        self.refused('pdbedit', '-i', f'tdbsam:{path}')
+        self.refused('pdbedit', '-i', 'smbpasswd:/etc/shadow')
+        link = os.path.join(directory, 'samba-import-link.smbpasswd')
+        os.symlink('/etc/shadow', link)
+        self.refused('pdbedit', '-i', f'smbpasswd:{link}')
+        os.chmod(path, 0o644)
+        self.refused('pdbedit', '-i', f'smbpasswd:{path}')
+
+    def test_other_arguments_are_refused(self):
+        self.refused('pdbedit', '-e', 'smbpasswd:/tmp/out')
+        self.refused('pdbedit', '-L', '-w', '-e', 'tdbsam:/tmp/x')
+        self.refused('pdbedit', '-i', 'tdbsam:/x')
+        self.refused('pdbedit', '-a', 'alice')
+        self.refused('smbpasswd', '-a', 'alice')
+        self.refused('smbpasswd', '-s', '-a', '-r')
+        self.refused('smbpasswd', '-s', '-a', '../alice')
+        self.refused('smbpasswd', '-s', 'alice', 'extra')
+        self.refused('smbcontrol', 'smbd', 'shutdown')
+        self.refused('smbcontrol', 'smbd', 'close-share', '-x')
+        self.refused('smbstatus', '-b')
+        self.refused('testparm', '/etc/shadow')
+        self.refused('testparm', '-s', '/etc/shadow')
+        self.refused('testparm', '-s', '/etc/samba/../shadow')
+
+    def test_disallowed_tools_and_units(self):
+        self.refused('bash', '-c', 'id')
+        self.refused('cat', '/etc/shadow')
+        self.refused('systemctl', 'start', 'sshd')
+        self.refused('systemctl', 'poweroff')
+        self.refused('systemctl', '--root=/tmp', 'start', 'smbd')
+        self.refused('service', 'cron', 'restart')
+        with self.assertRaises(helper.HelperError):
+            helper.check_tool(['smbstatus', 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
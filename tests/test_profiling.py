@@ -0,0 +1,26 @@
+import unittest
+
+from app.profiling import COMMAND_SUMMARY_LENGTH, command_summary
+
+
+class CommandSummaryTest(unittest.TestCase):
+
+    def test_arguments_are_left_out(self):
+        self.assertEqual(command_summary(['sudo', '-n', 'smbpasswd', '-s', '-a', 'alice']),
+                         'smbpasswd -s -a +1 args')
+        self.assertEqual(command_summary(['sudo', '-n', 'sh', '-c', 'set -e\nmv "$1" "$2"\n', 'sh', '/etc/x']),
+                         'sh -c +3 args')
+        self.assertEqual(command_summary(['/usr/bin/pdbedit', '-L', '-w']), 'pdbedit -L -w')
+
+    def test_option_values_are_left_out(self):
+        self.assertEqual(command_summary(['systemctl', 'show', '--property=Id,MainPID', 'smbd.service']),
+                         'systemctl --property=... +2 args')
+
+    def test_long_summaries_are_shortened(self):
+        summary = command_summary(['tool'] + [f'--option-{i}' for i in range(20)])
+        self.assertEqual(len(summary), COMMAND_SUMMARY_LENGTH)
+        self.assertTrue(summary.endswith('...'))
+
+
+if __name__ == '__main__':
+    unittest.main()
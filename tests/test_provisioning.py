@@ -0,0 +1,212 @@
+import os
+import subprocess
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+os.environ.setdefault('SAMBA_MANAGER_DEV_MODE', '1')
+
+from app import provisioning
+from app.passdb import parse_smbpasswd
+
+
+class FakeNss:
+
+    def __init__(self, users=(), groups=None):
+        self.users = {name: SimpleNamespace(pw_name=name, pw_uid=1000 + i) for i, name in enumerate(users)}
+        self.groups = {name: SimpleNamespace(gr_name=name, gr_mem=list(members))
+                       for name, members in (groups or {}).items()}
+
+    def user(self, name):
+        return self.users.get(name)
+
+    def group(self, name):
+        return self.groups.get(name)
+
+
+class ParseImportTest(unittest.TestCase):
+
+    def test_csv(self):
+        entries, options = provisioning.parse_import(
+            "\ufeffUserName, Password ,groups\nalice,S3cret!,staff;finance\n,,\nbob,pw,\n")
+        self.assertEqual(options, {})
+        self.assertEqual([entry['username'] for entry in entries], ['alice', 'bob'])
+        self.assertEqual(entries[0]['password'], 'S3cret!')
+        self.assertEqual(entries[0]['groups'], 'staff;finance')
+
+    def test_json_list(self):
+        entries, options = provisioning.parse_import('[{"username": "alice", "password": "pw"}]')
+        self.assertEqual(entries, [{'username': 'alice', 'password': 'pw'}])
+        self.assertEqual(options, {})
+
+    def test_json_object_with_options(self):
+        entries, options = provisioning.parse_import(
+            '{"users": [{"username": "alice"}], "update_existing": true, "unknown": 1}')
+        self.assertEqual(entries, [{'username': 'alice'}])
+        self.assertEqual(options, {'update_existing': True})
+
+    def test_invalid_imports(self):
+        for content in ('', '  \n', '[{"username": ', '{"users": {}}', '"alice"',
+                        'name,password\nalice,pw\n'):
+            with self.subTest(content=content), self.assertRaises(ValueError):
+                provisioning.parse_import(content)
+
+    def test_too_many_users(self):
+        content = 'username\n' + 'user\n' * (provisioning.MAX_IMPORT_USERS + 1)
+        with self.assertRaises(ValueError):
+            provisioning.parse_import(content)
+
+
+class PlanImportTest(unittest.TestCase):
+
+    def plan(self, entries, **options):
+        nss = FakeNss(users=['alice', 'bob', 'carol'],
+                      groups={'smbusers': ['bob'], 'staff': ['alice']})
+        accounts = [{'username': 'bob'}, {'username': 'carol'}]
+        with mock.patch.object(provisioning, 'get_nss', return_value=nss), \
+                mock.patch.object(provisioning, 'get_samba_users', return_value=accounts):
+            return provisioning.plan_import(entries, **options)
+
+    def test_new_and_existing_accounts(self):
+        plan = self.plan([
+            {'username': 'alice', 'password': 'pw', 'groups': 'staff,finance'},
+            {'username': 'bob', 'password': 'pw'},
+            {'username': 'dave', 'password': 'pw', 'create_system_user': 'yes', 'enabled': 'no'},
+            {'username': 'erin', 'password': 'pw'},
+        ])
+        self.assertEqual([entry['username'] for entry in plan.new_accounts], ['alice', 'dave'])
+        self.assertEqual(plan.new_system_users, ['dave'])
+        self.assertFalse(plan.entries['dave']['enabled'])
+        self.assertEqual([(result['username'], result['index']) for result in plan.skipped], [('bob', 1)])
+        self.assertEqual([(result['username'], result['message']) for result in plan.errors],
+                         [('erin', "System user does not exist")])
+        self.assertEqual(plan.new_groups, ['finance'])
+        self.assertEqual(plan.group_members, {'smbusers': ['alice', 'dave'], 'finance': ['alice']})
+
+    def test_update_existing(self):
+        plan = self.plan([{'username': 'bob', 'password': 'pw'}, {'username': 'carol', 'password': 'pw'}],
+                         update_existing=True)
+        self.assertEqual([entry['username'] for entry in plan.password_updates], ['bob', 'carol'])
+        self.assertEqual(plan.skipped, [])
+        self.assertEqual(plan.group_members, {'smbusers': ['carol']})
+
+    def test_create_system_users_default(self):
+        plan = self.plan([{'username': 'dave', 'password': 'pw'},
+                          {'username': 'erin', 'password': 'pw', 'create_system_user': 'no'}],
+                         create_system_users=True)
+        self.assertEqual(plan.new_system_users, ['dave'])
+        self.assertEqual([result['username'] for result in plan.errors], ['erin'])
+
+    def test_invalid_entries(self):
+        plan = self.plan([
+            'alice',
+            {'username': 'Alice', 'password': 'pw'},
+            {'username': 'alice'},
+            {'username': 'alice', 'password': 'a\nb'},
+            {'username': 'alice', 'password': 'pw', 'groups': ['bad group']},
+            {'username': 'alice', 'password': 'pw', 'groups': 5},
+            {'username': 'alice', 'password': 'pw'},
+            {'username': 'alice', 'password': 'pw'},
+        ])
+        self.assertEqual([result['index'] for result in plan.errors], [0, 1, 2, 3, 4, 5, 7])
+        self.assertEqual(plan.errors[-1]['message'], "Duplicate username")
+        self.assertEqual(list(plan.entries), ['alice'])
+
+
+class NtHashTest(unittest.TestCase):
+
+    # RFC 1320, appendix A.5
+    MD4_VECTORS = {
+        b'': '31d6cfe0d16ae931b73c59d7e0c089c0',
+        b'a': 'bde52cb31de33e46245e05fbdbd6fb24',
+        b'abc': 'a448017aaf21d8525fc10ae87aa6729d',
+        b'message digest': 'd9130a8164549fe818874806e1c7014b',
+        b'abcdefghijklmnopqrstuvwxyz': 'd79e1c308aa5bbcdeea8ed63df412da9',
+        b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789': '043f8582f241db351ce627e153e7f0e4',
+        b'1234567890' * 8: 'e33b4ddc9c38f2199c3e7b164fcc0536',
+    }
+
+    def test_md4_fallback(self):
+        for message, digest in self.MD4_VECTORS.items():
+            with self.subTest(message=message):
+                self.assertEqual(provisioning._md4(message).hex(), digest)
+
+    def test_nt_hash(self):
+        self.assertEqual(provisioning.nt_hash('password'), '8846F7EAEE8FB117AD06BDD830B7586C')
+
+    def test_nt_hash_without_hashlib_md4(self):
+        with mock.patch.object(provisioning.hashlib, 'new', side_effect=ValueError("unsupported hash type")):
+            self.assertEqual(provisioning.nt_hash('password'), '8846F7EAEE8FB117AD06BDD830B7586C')
+
+    def test_smbpasswd_line(self):
+        entry = {'username': 'alice', 'password': 'password', 'enabled': False}
+        line = provisioning._smbpasswd_line(entry, 1001, 0x659BDA10)
+        self.assertEqual(line, f"alice:1001:{'X' * 32}:8846F7EAEE8FB117AD06BDD830B7586C:"
+                               "[DU         ]:LCT-659BDA10:\n")
+        self.assertEqual(parse_smbpasswd(line), [{'username': 'alice', 'enabled': False, 'flags': '[DU         ]',
+                                                  'uid': 1001, 'pass_last_set': 0x659BDA10}])
+
+
+class RunSystemTest(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.failures = {}
+        for name in ('invalidate_nss', 'invalidate_samba_users'):
+            patcher = mock.patch.object(provisioning, name)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def run_privileged(self, args, input=None):
+        self.calls.append(args)
+        returncode, stderr = self.failures.get(args[0], (0, ''))
+        return subprocess.CompletedProcess(args, returncode, '', stderr)
+
+    def run_import(self, usernames, members=()):
+        entries = [{'username': name, 'password': 'pw', 'create_system_user': True} for name in usernames]
+        with mock.patch.object(provisioning, 'get_nss', return_value=FakeNss()), \
+                mock.patch.object(provisioning, 'get_samba_users', return_value=[]):
+            plan = provisioning.plan_import(entries)
+        nss = FakeNss(users=usernames, groups={'smbusers': members})
+        with mock.patch.object(provisioning, 'get_nss', return_value=nss), \
+                mock.patch.object(provisioning, 'get_samba_users',
+                                  side_effect=lambda: [{'username': name} for name in usernames]), \
+                mock.patch.object(provisioning, 'run_privileged', self.run_privileged):
+            events = list(provisioning._run_system(plan))
+        return {event['username']: event for event in events if event['event'] == 'user'}
+
+    def test_failed_lines_are_mapped_to_users(self):
+        self.failures['chpasswd'] = (1, "chpasswd: line 2: user 'bob' does not exist\n"
+                                        "chpasswd: error detected, changes ignored\n")
+        results = self.run_import(['alice', 'bob', 'carol'])
+        self.assertEqual({name: result['status'] for name, result in results.items()},
+                         {'alice': 'created', 'bob': 'error', 'carol': 'created'})
+        self.assertIn(['userdel', '-r', 'bob'], self.calls)
+        self.assertNotIn(['userdel', '-r', 'alice'], self.calls)
+
+    def test_failure_without_line_numbers_removes_every_new_user(self):
+        self.failures['chpasswd'] = (1, "chpasswd: PAM: Authentication token manipulation error\n")
+        results = self.run_import(['alice', 'bob'])
+        self.assertEqual([result['status'] for result in results.values()], ['error', 'error'])
+        self.assertIn("removed", results['alice']['message'])
+        self.assertIn(['userdel', '-r', 'alice'], self.calls)
+        self.assertIn(['userdel', '-r', 'bob'], self.calls)
+        self.assertNotIn('pdbedit', [args[0] for args in self.calls])
+
+    def test_new_members_are_added_one_at_a_time(self):
+        results = self.run_import(['alice', 'bob'], members=['bob', 'remote'])
+        self.assertEqual([args for args in self.calls if args[0] == 'gpasswd'],
+                         [['gpasswd', '-a', 'alice', 'smbusers']])
+        self.assertEqual([result['status'] for result in results.values()], ['created', 'created'])
+
+    def test_leftover_users_are_reported(self):
+        self.failures['chpasswd'] = (1, "chpasswd: PAM: Authentication token manipulation error\n")
+        self.failures['userdel'] = (1, "userdel: user alice is currently used by process 42\n")
+        results = self.run_import(['alice'])
+        self.assertEqual(results['alice']['status'], 'error')
+        self.assertIn("left without a password", results['alice']['message'])
+        self.assertIn("currently used by process 42", results['alice']['message'])
+
+
+if __name__ == '__main__':
+    unittest.main()
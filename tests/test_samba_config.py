@@ -0,0 +1,167 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from app.samba_config import ConfigCache, Share, file_key, parse_config, patch_sections
+
+CONFIG = """# Shares managed by Samba Manager
+
+[projects]
+   path = /srv/samba/projects
+   valid users = @staff
+   write list = @staff
+   create mask = 0664
+   directory mask = 0775
+   comment = Team projects  ; hand-written spacing
+
+# Archive, read only
+[archive]
+   path = /srv/samba/archive
+   valid users = alice
+   write list = alice
+   create mask = 0644
+   directory mask = 0755
+   read only = yes
+"""
+
+
+def share(name, **params):
+    return Share.from_mapping(dict(name=name, **params))
+
+
+def current(text, name):
+    return parse_config(text).get(name).to_share()
+
+
+class PatchSectionsTest(unittest.TestCase):
+
+    def test_unchanged_share_returns_none(self):
+        self.assertIsNone(patch_sections(CONFIG, {'projects': current(CONFIG, 'projects')}))
+
+    def test_update_preserves_other_sections_byte_for_byte(self):
+        updated = current(CONFIG, 'projects')
+        updated.comment = 'Renamed comment'
+        result = patch_sections(CONFIG, {'projects': updated})
+
+        archive = CONFIG[CONFIG.index('# Archive'):]
+        self.assertTrue(result.startswith('# Shares managed by Samba Manager\n\n[projects]\n'))
+        self.assertTrue(result.endswith(archive))
+        self.assertEqual(current(result, 'projects').comment, 'Renamed comment')
+
+    def test_section_names_match_case_insensitively(self):
+        updated = current(CONFIG, 'archive')
+        updated.read_only = 'no'
+        result = patch_sections(CONFIG, {'ARCHIVE': updated})
+        self.assertEqual(current(result, 'archive').read_only, 'no')
+        self.assertEqual(len(parse_config(result).share_sections()), 2)
+
+    def test_add_appends_after_one_blank_line(self):
+        result = patch_sections(CONFIG, {'media': share('media', path='/srv/samba/media')})
+        self.assertTrue(result.startswith(CONFIG))
+        self.assertEqual(result[len(CONFIG):len(CONFIG) + 9], '\n[media]\n')
+        self.assertEqual(current(result, 'media').path, '/srv/samba/media')
+
+    def test_add_to_text_without_trailing_newline(self):
+        result = patch_sections('[a]\n   path = /a', {'b': share('b', path='/b')})
+        self.assertTrue(result.startswith('[a]\n   path = /a\n\n[b]\n'))
+
+    def test_remove_keeps_the_comment_introducing_the_next_section(self):
+        result = patch_sections(CONFIG, {'projects': None})
+        self.assertNotIn('[projects]', result)
+        self.assertIn('# Archive, read only\n[archive]', result)
+        self.assertTrue(result.endswith(CONFIG[CONFIG.index('# Archive'):]))
+
+    def test_remove_missing_share_returns_none(self):
+        self.assertIsNone(patch_sections(CONFIG, {'missing': None}))
+
+    def test_rename_removes_old_section_and_adds_new_one(self):
+        renamed = current(CONFIG, 'projects')
+        renamed.name = 'work'
+        result = patch_sections(CONFIG, {'projects': None, 'work': renamed})
+
+        config = parse_config(result)
+        self.assertIsNone(config.get('projects'))
+        self.assertEqual(config.get('work').to_share().path, '/srv/samba/projects')
+        self.assertIn(CONFIG[CONFIG.index('# Archive'):], result)
+
+    def test_repeated_sections_are_merged_into_one(self):
+        text = '[a]\n   path = /a\n\n[b]\n   path = /b\n\n[a]\n   comment = again\n'
+        result = patch_sections(text, {'a': share('a', path='/new')})
+        self.assertEqual(result.count('[a]'), 1)
+        self.assertIn('[b]\n   path = /b\n', result)
+
+
+class ConfigCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'smb.conf')
+        self.write(self.path, 'one')
+        self.cache = ConfigCache()
+        self.loads = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, path, content):
+        with open(path, 'w') as f:
+            f.write(content)
+        # Make sure the change is visible even on coarse mtime filesystems
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000))
+
+    def loader(self, path=None):
+        def load():
+            self.loads += 1
+            with open(path or self.path) as f:
+                return f.read()
+        return load
+
+    def test_hit_until_file_changes(self):
+        self.assertEqual(self.cache.get('conf', [self.path], self.loader()), 'one')
+        self.assertEqual(self.cache.get('conf', [self.path], self.loader()), 'one')
+        self.assertEqual(self.loads, 1)
+
+        self.write(self.path, 'two')
+        self.assertEqual(self.cache.get('conf', [self.path], self.loader()), 'two')
+        self.assertEqual(self.loads, 2)
+        self.assertEqual(self.cache.stats(), {'hits': 1, 'misses': 2, 'entries': 1})
+
+    def test_invalidate(self):
+        self.cache.get('conf', [self.path], self.loader())
+        self.cache.get('other', [self.path], self.loader())
+        self.cache.invalidate('conf')
+        self.cache.get('conf', [self.path], self.loader())
+        self.cache.get('other', [self.path], self.loader())
+        self.assertEqual(self.loads, 3)
+
+        self.cache.invalidate()
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+    def test_dependencies_are_watched(self):
+        included = os.path.join(self.directory, 'shares.conf')
+        self.write(included, 'included')
+        self.cache.get('conf', [self.path], self.loader(), depends_on=lambda value: [included])
+        self.cache.get('conf', [self.path], self.loader(), depends_on=lambda value: [included])
+        self.assertEqual(self.loads, 1)
+
+        self.write(included, 'changed')
+        self.cache.get('conf', [self.path], self.loader(), depends_on=lambda value: [included])
+        self.assertEqual(self.loads, 2)
+
+    def test_file_created_later_invalidates(self):
+        missing = os.path.join(self.directory, 'missing.conf')
+        self.cache.get('conf', [self.path, missing], self.loader())
+        self.write(missing, 'now here')
+        self.cache.get('conf', [self.path, missing], self.loader())
+        self.assertEqual(self.loads, 2)
+
+    def test_file_key(self):
+        self.assertEqual(file_key(os.path.join(self.directory, 'nope')),
+                         (os.path.join(self.directory, 'nope'), None, None, None))
+        self.assertEqual(file_key(self.path)[3], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
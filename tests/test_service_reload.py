@@ -0,0 +1,97 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+os.environ.setdefault('SAMBA_MANAGER_DEV_MODE', '1')
+
+from app import samba_utils
+from app.samba_config import load_config_file
+
+CONFIG = """[global]
+   workgroup = WORKGROUP
+   interfaces = {interfaces}
+"""
+
+
+class ReloadTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'smb.conf')
+        self.backend = mock.Mock(reload_config=mock.Mock(return_value=True),
+                                 restart_services=mock.Mock(return_value=True))
+        self.status = {unit: {'state': 'active', 'uptime': 60} for unit in ('smbd', 'nmbd')}
+        patches = [
+            mock.patch.object(samba_utils, '_service_params', None),
+            mock.patch.object(samba_utils, 'get_backend', return_value=self.backend),
+            mock.patch.object(samba_utils, 'get_service_status', side_effect=lambda: self.status),
+            mock.patch.object(samba_utils, 'load_samba_config', side_effect=lambda: load_config_file(self.path)),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def write(self, interfaces, age=0):
+        with open(self.path, 'w') as f:
+            f.write(CONFIG.format(interfaces=interfaces))
+        changed = time.time() - age
+        os.utime(self.path, (changed, changed))
+
+    def test_unchanged_config_is_reloaded(self):
+        self.write('eth0', age=3600)
+        self.assertTrue(samba_utils.reload_samba_service())
+        self.backend.reload_config.assert_called_once_with()
+        self.backend.restart_services.assert_not_called()
+
+    def test_restart_only_change_restarts(self):
+        self.write('eth0', age=3600)
+        samba_utils.remember_service_params()
+        self.write('eth1')
+        self.assertTrue(samba_utils.reload_samba_service())
+        self.backend.restart_services.assert_called_once_with()
+        self.backend.reload_config.assert_not_called()
+
+    def test_edit_before_first_read_restarts(self):
+        # Edited after the daemons started, before this process read it
+        self.write('eth1')
+        self.assertTrue(samba_utils.reload_samba_service())
+        self.backend.restart_services.assert_called_once_with()
+        self.assertEqual(samba_utils._service_params['interfaces'], 'eth1')
+
+        self.assertTrue(samba_utils.reload_samba_service())
+        self.backend.reload_config.assert_called_once_with()
+
+    def test_unknown_start_time_restarts(self):
+        self.write('eth0', age=3600)
+        self.status['smbd']['uptime'] = None
+        self.assertTrue(samba_utils.reload_samba_service())
+        self.backend.restart_services.assert_called_once_with()
+
+
+class ReloadSchedulerTest(unittest.TestCase):
+
+    def test_waiting_caller_is_not_held_for_the_window(self):
+        reload = mock.Mock(return_value=True)
+        scheduler = samba_utils.ReloadScheduler(reload, window=30)
+        started = time.monotonic()
+        self.assertTrue(scheduler.request(wait=True, timeout=5))
+        self.assertLess(time.monotonic() - started, 5)
+        reload.assert_called_once_with()
+        self.assertEqual(scheduler.status(), {'pending': False, 'running': False, 'reloads': 1,
+                                              'last_result': True})
+
+    def test_waiting_caller_joins_a_pending_reload(self):
+        reload = mock.Mock(return_value=False)
+        scheduler = samba_utils.ReloadScheduler(reload, window=0.2)
+        self.assertTrue(scheduler.request())
+        self.assertTrue(scheduler.status()['pending'])
+        self.assertFalse(scheduler.request(wait=True, timeout=5))
+        reload.assert_called_once_with()
+        self.assertIs(scheduler.status()['last_result'], False)
+
+
+if __name__ == '__main__':
+    unittest.main()
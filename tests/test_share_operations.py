@@ -0,0 +1,57 @@
+import os
+import unittest
+from unittest import mock
+
+os.environ.setdefault('SAMBA_MANAGER_DEV_MODE', '1')
+
+from app import samba_utils
+
+
+class ShareTextTest(unittest.TestCase):
+
+    def test_plain_share_is_accepted(self):
+        self.assertIsNone(samba_utils.share_text_error('projects', {'path': '/srv/x', 'comment': 'A; B'}))
+
+    def test_line_breaks_are_rejected(self):
+        for params in ({'path': '/x\n[evil]'}, {'path': '/x\r'}, {'comment': 'a\x00b'},
+                       {'path\n[evil]': '/x'}, {'path = /x': 'y'}):
+            with self.subTest(params=params):
+                self.assertIsNotNone(samba_utils.share_text_error('projects', params))
+
+    def test_bad_names_are_rejected(self):
+        for name in ('a\nb', 'a]', '[a', 'a\tb'):
+            with self.subTest(name=name):
+                self.assertIsNotNone(samba_utils.share_text_error(name, {}))
+
+
+class ShareOperationsTest(unittest.TestCase):
+
+    def test_injected_lines_never_reach_the_config(self):
+        operations = [
+            {'action': 'add', 'share': {'name': 'x', 'path': '/srv/x\n[evil]\n   path = /'}},
+            {'action': 'add', 'share': {'name': 'y\n[evil]', 'path': '/srv/y'}},
+        ]
+        with mock.patch.object(samba_utils, 'load_shares', return_value=[]), \
+                mock.patch.object(samba_utils, 'create_share_directory') as create, \
+                mock.patch.object(samba_utils, 'write_share_changes') as write:
+            success, results = samba_utils.apply_share_operations(operations)
+
+        self.assertFalse(success)
+        self.assertEqual([result['status'] for result in results], ['error', 'error'])
+        create.assert_not_called()
+        write.assert_not_called()
+
+    def test_system_shares_are_protected_in_any_case(self):
+        operations = [{'action': 'delete', 'name': name} for name in ('Share', 'SECURE-SHARE')]
+        with mock.patch.object(samba_utils, 'load_shares', return_value=[]), \
+                mock.patch.object(samba_utils, 'write_share_changes') as write:
+            success, results = samba_utils.apply_share_operations(operations)
+
+        self.assertFalse(success)
+        self.assertEqual([result['message'] for result in results],
+                         ['Cannot modify system share "Share"', 'Cannot modify system share "SECURE-SHARE"'])
+        write.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()